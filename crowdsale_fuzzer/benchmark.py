@@ -0,0 +1,245 @@
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from multiprocessing import get_context
+
+import fuzzer
+import test_writer
+from scheduler import CoverageScheduler
+
+LENGTHS = [10, 100, 1000, 10000, 100000]
+
+# the op benchmarks start over from a new crowdsale every SEGMENT ops, which keeps every op in the mix
+SEGMENT = 100
+
+
+class CountingSink:
+    """
+    File-like object that only counts what is written to it
+    """
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, s):
+        self.bytes += len(s)
+
+
+def bench_gen_test(ops, seed):
+    out = CountingSink()
+    start = time.perf_counter()
+    fuzzer.gen_test(out, ops, random.Random(seed), CoverageScheduler(fuzzer.UNSUPPORTED_VECTORS))
+    return {"ops": ops, "seconds": time.perf_counter() - start, "bytes": out.bytes}
+
+
+def bench_gen_predefined_test(ops, seed):
+    # the predefined test is short: write it again until ops operations have been written
+    out = CountingSink()
+    rng = random.Random(seed)
+    done = 0
+    start = time.perf_counter()
+    while done < ops:
+        done += len(fuzzer.gen_predefined_test(out, rng).trace)
+    return {"ops": done, "seconds": time.perf_counter() - start, "bytes": out.bytes}
+
+
+def bench_ops(ops, seed):
+    """
+    Time every operation of the crowdsale, including the writing of its fragments, over ops random operations
+    """
+    out = CountingSink()
+    rng = random.Random(seed)
+    results = {}
+    crowdsale = None
+    done = 0
+    while done < ops:
+        if done % SEGMENT == 0 or crowdsale is None:
+            crowdsale = fuzzer.new_crowdsale(rng)
+        f = rng.choice(crowdsale.functions)
+        fail = rng.choice(f.failure_types() + [None])
+        if (f.function.__name__, fail) in fuzzer.UNSUPPORTED_VECTORS:
+            continue
+        written = out.bytes
+        start = time.perf_counter()
+        s = f.function(fail)
+        if s is None:
+            continue
+        test_writer.write_fragments(out, s)
+        elapsed = time.perf_counter() - start
+        result = results.setdefault(f.function.__name__, {"ops": 0, "seconds": 0.0, "bytes": 0})
+        result["ops"] += 1
+        result["seconds"] += elapsed
+        result["bytes"] += out.bytes - written
+        done += 1
+    return results
+
+
+def helper_calls():
+    """
+    (name, call) for every test_writer helper, with representative arguments
+    """
+    call = ["await sale.sendTransaction({from: user3, value: '200000000000000000'});\n"]
+    return [
+        ("wrap_exception", lambda: test_writer.wrap_exception(call, "cannot contribute below the minimum")),
+        ("wrap_token_balance_checks", lambda: test_writer.wrap_token_balance_checks(call, "user3",
+                                                                                   "token_balance_user3")),
+        ("wrap_ether_balance_checks", lambda: test_writer.wrap_ether_balance_checks(call, "beneficiary",
+                                                                                   "beneficiary_ether")),
+        ("wrap_sale_balance_checks", lambda: test_writer.wrap_sale_balance_checks(call, "user3",
+                                                                                 "sale_balance_user3")),
+        ("wrap_amount_raised", lambda: test_writer.wrap_amount_raised(call, "amount_raised")),
+        ("wrap_allowance_checks", lambda: test_writer.wrap_allowance_checks(call, "sale.address",
+                                                                           "crowdsale_allowance")),
+        ("wrap_batched_reads", lambda: test_writer.wrap_batched_reads(
+            call, [("token_balance_user3", test_writer.token_balance_read("user3")),
+                   ("amount_raised", test_writer.amount_raised_read())], test_writer.GOAL_AND_CAP_READS)),
+        ("balance_assertion_check", lambda: test_writer.balance_assertion_check(
+            "amount_raised", ".add(new bigInt('200000000000000000'))", "the amountRaised should increase by wei")),
+        ("goal_and_cap_assertion_checks", lambda: test_writer.goal_and_cap_assertion_checks(True, False)),
+        ("check_value", lambda: test_writer.check_value("new_contract_amount_raised", "sale.amountRaised()")),
+        ("gen_user_str", lambda: test_writer.gen_user_str("user3", 200000000000000000)),
+        ("gen_assert_equal", lambda: test_writer.gen_assert_equal("rate", "5000", "the rate should not change")),
+        ("gen_log", lambda: test_writer.gen_log("'Finished Test'")),
+        ("gen_big_int", lambda: test_writer.gen_big_int("'200000000000000000'")),
+    ]
+
+
+def bench_helpers(calls, seed=None):
+    """
+    Time every test_writer helper, including the writing of its fragments, over calls calls
+    """
+    results = {}
+    for name, helper in helper_calls():
+        out = CountingSink()
+        start = time.perf_counter()
+        for _ in range(calls):
+            test_writer.write_fragments(out, helper())
+        results[name] = {"ops": calls, "seconds": time.perf_counter() - start, "bytes": out.bytes}
+    return results
+
+
+def run_case(function, ops, verbose, seed):
+    # runs in a worker of its own, so that the peak RSS is the one of this case only
+    fuzzer.VERBOSE = verbose
+    results = function(ops, seed)
+    return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def rates(result, peak_rss_kb):
+    seconds = result["seconds"]
+    return dict(result, ops_per_s=result["ops"] / seconds if seconds else None,
+                bytes_per_s=result["bytes"] / seconds if seconds else None, peak_rss_kb=peak_rss_kb)
+
+
+def cases(lengths, helper_calls_count):
+    """
+    (name, function, ops, verbose, one result per op) for every benchmark
+    """
+    for verbose in [True, False]:
+        for ops in lengths:
+            yield "gen_test", bench_gen_test, ops, verbose, False
+        yield "gen_predefined_test", bench_gen_predefined_test, max(lengths), verbose, False
+        yield "op", bench_ops, max(lengths), verbose, True
+    yield "helper", bench_helpers, helper_calls_count, False, True
+
+
+def run(lengths, helper_calls_count, seed=1, repeat=3):
+    """
+    Run every benchmark repeat times, keeping the fastest run, and return {name: result}
+    """
+    results = {}
+    context = get_context("fork")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for name, function, ops, verbose, per_op in cases(lengths, helper_calls_count):
+            best = {}
+            for _ in range(repeat):
+                case_results, peak_rss_kb = pool.apply(run_case, (function, ops, verbose, seed))
+                if not per_op:
+                    case_results = {None: case_results}
+                for sub_name, result in case_results.items():
+                    key = name if sub_name is None else name + ":" + sub_name
+                    if function is bench_gen_test:
+                        key += "/ops=" + str(ops)
+                    if function is not bench_helpers:
+                        key += "/verbose=" + str(int(verbose))
+                    result = rates(result, peak_rss_kb)
+                    if key not in best or result["seconds"] < best[key]["seconds"]:
+                        best[key] = result
+            results.update(best)
+            sys.stderr.write("%s ops=%d%s done\n" % (name, ops, "" if function is bench_helpers else
+                                                       " verbose=" + str(int(verbose))))
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(old, new, threshold, out=sys.stdout):
+    """
+    Report the benchmarks of new that are more than threshold (a fraction) slower or bigger than in old,
+    and return how many there are
+    """
+    regressions = 0
+    for key in sorted(set(old["results"]) & set(new["results"])):
+        before, after = old["results"][key], new["results"][key]
+        for metric, worse in [("ops_per_s", lambda b, a: a < b * (1 - threshold)),
+                              ("bytes_per_s", lambda b, a: a < b * (1 - threshold)),
+                              ("peak_rss_kb", lambda b, a: a > b * (1 + threshold))]:
+            if before[metric] and after[metric] and worse(before[metric], after[metric]):
+                regressions += 1
+                out.write("REGRESSION %-50s %-12s %14.1f -> %14.1f (%+.1f%%)\n" %
+                          (key, metric, before[metric], after[metric],
+                           100.0 * (after[metric] - before[metric]) / before[metric]))
+    for key in sorted(set(old["results"]) ^ set(new["results"])):
+        out.write("only in %s: %s\n" % ("old" if key in old["results"] else "new", key))
+    out.write("%d regressions over %d benchmarks\n" % (regressions, len(set(old["results"]) & set(new["results"]))))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation of fuzz tests")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--lengths", type=int, nargs="+", default=LENGTHS, help="numbers of ops of gen_test")
+    run_parser.add_argument("--helper-calls", type=int, default=10000, help="calls per test_writer helper")
+    run_parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the fastest is kept")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--out", default=None, help="file to write the results to (default: stdout)")
+    compare_parser = subparsers.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative change that counts as a regression")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        sys.exit(1 if compare(old, new, args.threshold) else 0)
+
+    if args.command is None:
+        args = run_parser.parse_args([])
+    report = {"meta": metadata(), "results": run(args.lengths, args.helper_calls, args.seed, args.repeat)}
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+
+BUNDLE_FILE = "fuzz_bundle.%d.js"
+INDEX_FILE = "fuzz_bundles.index.jsonl"
+
+
+def member(content, compress=False):
+    """
+    The bytes of a test in a bundle: its content, as a gzip member of its own when compressed (members can be
+    decompressed one at a time, and the whole bundle decompresses to the concatenation of its tests)
+    """
+    data = content.encode()
+    if compress:
+        # without a timestamp, so that the bundles of a campaign only depend on its seeds
+        return gzip.compress(data, mtime=0)
+    return data
+
+
+class BundleWriter:
+    """
+    Packs generated tests into bundles of up to size tests each, fuzz_bundle.<n>.js (.js.gz when compressed),
+    and writes the index of the tests, one JSON {"seed", "bundle", "offset", "length"} per line.
+    Every test is a complete test file and declares everything with var, so an uncompressed bundle is itself
+    a test file that runs all of its tests.
+    """
+    def __init__(self, out_dir, size, compress=False):
+        self.out_dir = out_dir
+        self.size = size
+        self.compress = compress
+        self.bundles = 0
+        self.count = 0
+        self.out = None
+        for path in glob.glob(os.path.join(out_dir, "fuzz_bundle.*.js")) + \
+                glob.glob(os.path.join(out_dir, "fuzz_bundle.*.js.gz")):
+            # the bundles of a previous run, which the new index does not refer to
+            os.remove(path)
+        self.index = open(os.path.join(out_dir, INDEX_FILE), "w")
+
+    def next_bundle(self):
+        if self.out is not None:
+            self.out.close()
+        name = BUNDLE_FILE % self.bundles + (".gz" if self.compress else "")
+        self.path = os.path.join(self.out_dir, name)
+        self.out = open(self.path, "wb")
+        self.bundles += 1
+        self.count = 0
+
+    def add(self, seed, data):
+        """
+        Append the member data (see member) of the test of seed and return the path of its bundle
+        """
+        if self.out is None or self.count == self.size:
+            self.next_bundle()
+        offset = self.out.tell()
+        self.out.write(data)
+        self.count += 1
+        self.index.write(json.dumps({"seed": seed, "bundle": os.path.basename(self.path), "offset": offset,
+                                     "length": len(data)}) + "\n")
+        return self.path
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_index(bundle_dir):
+    """
+    {seed: index entry} of the bundles of bundle_dir
+    """
+    entries = {}
+    with open(os.path.join(bundle_dir, INDEX_FILE)) as f:
+        for line in f:
+            entry = json.loads(line)
+            entries[entry["seed"]] = entry
+    return entries
+
+
+def extract(bundle_dir, entry):
+    """
+    The content of the test of an index entry, identical to the file generated for its seed without bundles
+    """
+    with open(os.path.join(bundle_dir, entry["bundle"]), "rb") as f:
+        f.seek(entry["offset"])
+        data = f.read(entry["length"])
+    if entry["bundle"].endswith(".gz"):
+        data = gzip.decompress(data)
+    return data.decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or extract the tests of a directory of bundles")
+    subparsers = parser.add_subparsers(dest="command")
+    list_parser = subparsers.add_parser("list", help="print the seed, bundle, offset and length of every test")
+    list_parser.add_argument("bundle_dir")
+    extract_parser = subparsers.add_parser("extract", help="write the fuzz_test.<seed>.js file of seeds")
+    extract_parser.add_argument("bundle_dir")
+    extract_parser.add_argument("seeds", type=int, nargs="+")
+    extract_parser.add_argument("--out-dir", default=None, help="directory to write the tests to (default: stdout)")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("a command is required")
+
+    entries = read_index(args.bundle_dir)
+    if args.command == "list":
+        for entry in entries.values():
+            print("%d %s %d %d" % (entry["seed"], entry["bundle"], entry["offset"], entry["length"]))
+        return
+    missing = [seed for seed in args.seeds if seed not in entries]
+    if missing:
+        parser.error("not in the bundles: " + ", ".join(str(seed) for seed in missing))
+    for seed in args.seeds:
+        content = extract(args.bundle_dir, entries[seed])
+        if args.out_dir is None:
+            sys.stdout.write(content)
+            continue
+        if not os.path.exists(args.out_dir):
+            os.makedirs(args.out_dir)
+        out_file = os.path.join(args.out_dir, "fuzz_test." + str(seed) + ".js")
+        with open(out_file, "w") as out:
+            out.write(content)
+        print(out_file)
+
+
+if __name__ == '__main__':
+    main()
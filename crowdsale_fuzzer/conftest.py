@@ -0,0 +1,12 @@
+import os
+import sys
+
+# the modules of the fuzzer import each other by name and the package constants from crowdsale_fuzzer, as when
+# they are run as scripts (see generate_fuzz_tests.sh)
+HERE = os.path.dirname(os.path.abspath(__file__))
+for path in [HERE, os.path.dirname(HERE)]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# test_writer.py writes the JS tests, it is not a test module
+collect_ignore = ["test_writer.py"]
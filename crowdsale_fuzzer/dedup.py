@@ -0,0 +1,112 @@
+import argparse
+import hashlib
+import sqlite3
+
+# the parameter that holds the account receiving the tokens of an operation; the other user parameters are
+# callers, and only the owner can call an operation that succeeds
+DESTINATIONS = {"fallback": "user", "owner_allocate_tokens": "to_user"}
+
+
+def canonical_sequence(sequence, basic_users):
+    """
+    Canonical form of a sequence of (function name, fail, parameters): basic users are renamed in the order
+    in which they first appear (they are interchangeable), and the parameters of failing operations,
+    which only have to be in the range of their failure vector, are dropped
+    """
+    names = {}
+    basic_users = set(basic_users)
+
+    def canonical_user(user):
+        if user not in basic_users:
+            return user
+        if user not in names:
+            names[user] = "user" + str(len(names))
+        return names[user]
+
+    canonical = []
+    for function_name, fail, parameters in sequence:
+        destination = DESTINATIONS.get(function_name)
+        if fail == "validDestination":
+            canonical.append((function_name, fail, parameters[destination]))
+        elif fail:
+            canonical.append((function_name, fail))
+        else:
+            values = []
+            for key in sorted(parameters):
+                value = parameters[key]
+                if key == "user" and key != destination:
+                    continue
+                if key == destination:
+                    value = canonical_user(value)
+                values.append((key, value))
+            canonical.append((function_name, fail, tuple(values)))
+    return canonical
+
+
+def fingerprint(sequence, basic_users):
+    return hashlib.blake2b(repr(canonical_sequence(sequence, basic_users)).encode(), digest_size=16).digest()
+
+
+class DedupIndex:
+    """
+    On-disk set of sequence fingerprints, shared by every generation run that uses the same file.
+    With a config (the hash of the config of the run, see manifest.config_hash), a fingerprint is only a duplicate
+    of the ones added with the same config: the same sequence under other parameters is another test.
+    Indexes built on other machines can be merged in.
+    """
+    def __init__(self, path, config=None):
+        self.config = config
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fingerprints (fingerprint BLOB PRIMARY KEY) WITHOUT ROWID")
+
+    def key(self, fp):
+        if self.config is None:
+            return fp
+        return hashlib.blake2b(fp + self.config.encode(), digest_size=16).digest()
+
+    def add(self, fp):
+        """
+        Add a fingerprint, returning False if it was already in the index
+        """
+        cursor = self.connection.execute("INSERT OR IGNORE INTO fingerprints VALUES (?)", (self.key(fp),))
+        return cursor.rowcount == 1
+
+    def __contains__(self, fp):
+        return self.connection.execute("SELECT 1 FROM fingerprints WHERE fingerprint = ?",
+                                       (self.key(fp),)).fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+    def merge(self, path):
+        self.connection.execute("ATTACH DATABASE ? AS other", (path,))
+        self.connection.execute("INSERT OR IGNORE INTO fingerprints SELECT fingerprint FROM other.fingerprints")
+        self.connection.commit()
+        self.connection.execute("DETACH DATABASE other")
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or merge dedup indexes of generated sequences")
+    parser.add_argument("index")
+    parser.add_argument("--merge", nargs="*", default=[], help="indexes to merge into index")
+    args = parser.parse_args()
+    with DedupIndex(args.index) as index:
+        for path in args.merge:
+            index.merge(path)
+        print("%d fingerprints" % len(index))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from multiprocessing import Pool
+
+from fuzzer import choose_op, new_model
+
+
+# ==================== Model-level invariants. =========================================
+# Every invariant is checked after every op, so each is O(1): the sums of the balance vectors are the running
+# totals the model keeps next to them (balance_total, Token.issued), never re-summed.
+def sale_balances_match_amount_raised(model):
+    return model.balance_total == model.amount_raised
+
+
+def issued_tokens_match_allowance(model):
+    token = model.token
+    return token.initial_crowdsale_allowance - token.crowdsale_allowance == token.issued
+
+
+def allowance_not_negative(model):
+    return model.token.crowdsale_allowance >= 0
+
+
+def goal_reached_consistent(model):
+    return not model.goal_reached or model.amount_raised >= model.funding_goal
+
+
+def cap_reached_consistent(model):
+    return not model.cap_reached or model.amount_raised >= model.funding_cap
+
+
+def rate_within_bounds(model):
+    return model.low_rate <= model.rate <= model.high_rate
+
+
+INVARIANTS = [
+    sale_balances_match_amount_raised,
+    issued_tokens_match_allowance,
+    allowance_not_negative,
+    goal_reached_consistent,
+    cap_reached_consistent,
+    rate_within_bounds,
+]
+
+
+# Checks of the running totals themselves against the vectors they sum, O(accounts) per op (see --audit)
+def balance_total_matches_balances(model):
+    return model.balance_total == sum(model.balance)
+
+
+def issued_matches_token_balances(model):
+    return model.token.issued == sum(model.token.balances)
+
+
+AUDIT_INVARIANTS = INVARIANTS + [
+    balance_total_matches_balances,
+    issued_matches_token_balances,
+]
+# =====================================================================================
+
+
+class ModelFailure(Exception):
+    """
+    A crash or an invariant violation of the model, located at the operation that caused it
+    """
+    def __init__(self, kind, message, index, function_name, fail):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.index = index
+        self.function_name = function_name
+        self.fail = fail
+
+    def __reduce__(self):
+        return ModelFailure, (self.kind, self.message, self.index, self.function_name, self.fail)
+
+    def signature(self):
+        # strip the numbers so that the same crash with different values is reported once
+        return self.kind, self.function_name, self.fail, re.sub(r"-?\d+", "N", self.message)
+
+
+def apply_op(model, index, function_name, fail, parameters=None, invariants=INVARIANTS):
+    """
+    Apply one operation to the model and check the invariants, raising ModelFailure on a crash or a violation.
+    Returns the instantiated parameters, or None if the operation does not apply in the current state.
+    """
+    try:
+        if parameters is None:
+            parameters = getattr(model, function_name)(fail)
+        else:
+            parameters = model.replay(function_name, fail, parameters)
+    except (Exception, SystemExit) as e:
+        raise ModelFailure(type(e).__name__, str(e), index, function_name, fail)
+    for invariant in invariants:
+        if not invariant(model):
+            raise ModelFailure("invariant", invariant.__name__, index, function_name, fail)
+    return parameters
+
+
+def run_sequence(sequence, rng=None, invariants=INVARIANTS):
+    """
+    Run a recorded sequence of (function name, fail, parameters) against a fresh model and return the model
+    """
+    model = new_model(rng or random.Random(0))
+    for index, (function_name, fail, parameters) in enumerate(sequence):
+        apply_op(model, index, function_name, fail, parameters, invariants)
+    return model
+
+
+def random_sequence(rng, ops, invariants=INVARIANTS):
+    """
+    Draw and run a random sequence of ops the same way gen_test does, and return it as
+    a list of (function name, fail, parameters)
+    """
+    model = new_model(rng)
+    sequence = []
+    while len(sequence) < ops:
+        # the vectors the model cannot instantiate yet (fuzzer.UNSUPPORTED_VECTORS) are drawn again
+        op = choose_op(model, rng)
+        if op is None:
+            continue
+        f, fail = op
+        function_name = f.function.__name__
+        parameters = apply_op(model, len(sequence), function_name, fail, None, invariants)
+        if parameters is None:
+            continue
+        sequence.append((function_name, fail, parameters))
+    return sequence
+
+
+def dry_run(seeds, ops, invariants=INVARIANTS):
+    """
+    Run one random sequence per seed and return {failure signature: [count, first seed, first failure]}
+    """
+    failures = {}
+    for seed in seeds:
+        try:
+            random_sequence(random.Random(seed), ops, invariants)
+        except ModelFailure as e:
+            entry = failures.setdefault(e.signature(), [0, seed, e])
+            entry[0] += 1
+    return failures
+
+
+def dry_run_batch(seeds, ops, jobs=None, invariants=INVARIANTS):
+    if jobs == 1:
+        return dry_run(seeds, ops, invariants)
+    jobs = jobs or os.cpu_count()
+    with Pool(jobs) as pool:
+        results = pool.starmap(dry_run, [(seeds[i::jobs], ops, invariants) for i in range(jobs)])
+    failures = {}
+    for result in results:
+        for signature, (count, seed, e) in result.items():
+            if signature not in failures:
+                failures[signature] = [count, seed, e]
+                continue
+            entry = failures[signature]
+            entry[0] += count
+            if seed < entry[1]:
+                entry[1], entry[2] = seed, e
+    return failures
+
+
+def report(failures, sequences, elapsed, out=sys.stdout):
+    out.write("ran %d sequences in %.2fs (%d sequences/min)\n" % (sequences, elapsed, sequences * 60 / elapsed))
+    for (kind, function_name, fail, message), (count, seed, e) in sorted(failures.items(),
+                                                                          key=lambda item: -item[1][0]):
+        out.write("%6d x %s in %s(%s): %s [first seed %d, op %d]\n" %
+                  (count, kind, function_name, fail, e.message, seed, e.index))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run random op sequences against the crowdsale model only")
+    parser.add_argument("--sequences", type=int, default=10000)
+    parser.add_argument("--ops", type=int, default=10, help="number of ops per sequence")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the first sequence")
+    parser.add_argument("--jobs", type=int, default=1, help="size of the worker pool (0 = one worker per core)")
+    parser.add_argument("--audit", action="store_true",
+                        help="also check the running totals of the model against the balances they sum (slower)")
+    args = parser.parse_args()
+
+    seeds = list(range(args.seed, args.seed + args.sequences))
+    start = time.perf_counter()
+    failures = dry_run_batch(seeds, args.ops, args.jobs, AUDIT_INVARIANTS if args.audit else INVARIANTS)
+    report(failures, len(seeds), time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
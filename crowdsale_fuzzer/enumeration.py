@@ -0,0 +1,211 @@
+import argparse
+import random
+import resource
+import sys
+import time
+from collections import deque
+
+import fuzzer
+from engine import ModelFailure, apply_op
+from scheduler import abstract_state, all_vectors, coverage_report
+
+RATE_BUCKETS = 4
+
+# the vectors that credit the account in the parameter of that name, which is enumerated (see user_choices);
+# the other parameters are drawn as usual
+ENUMERATED_USERS = {("fallback", None): "user", ("owner_allocate_tokens", None): "to_user"}
+
+
+def rate_bucket(model):
+    if model.rate < model.low_rate:
+        return "below"
+    if model.rate > model.high_rate:
+        return "above"
+    return (model.rate - model.low_rate) * RATE_BUCKETS // (model.high_rate - model.low_rate + 1)
+
+
+def pruning_key(model):
+    """
+    The abstract state under which two model states are considered equivalent
+    """
+    return abstract_state(model) + (rate_bucket(model),)
+
+
+def user_choices(model, candidates):
+    """
+    The users of candidates worth trying: the basic users are interchangeable, so of those that have
+    not bought anything yet only the first one is tried
+    """
+    choices = []
+    fresh = False
+    for user in candidates:
+        if user in model.basic_users:
+            index = model.accounts.intern(user)
+            if index >= len(model.balance) or not model.balance[index]:
+                if fresh:
+                    continue
+                fresh = True
+        choices.append(user)
+    return choices
+
+
+def time_moves(model):
+    # a representative time in every time window
+    return [("change_time", None, {"time": model.startTime - 1}),
+            ("change_time", None, {"time": model.startTime}),
+            ("change_time", None, {"time": model.endTime + 1})]
+
+
+def moves(model, vectors, with_time=False):
+    """
+    Every (function name, fail, parameters) to try from the current state of the model;
+    parameters that are None are drawn by the model
+    """
+    for function_name, fail in vectors:
+        key = ENUMERATED_USERS.get((function_name, fail))
+        if key is None:
+            yield function_name, fail, None
+            continue
+        candidates = model.basic_users if function_name == "fallback" else model.non_owner_users
+        for user in user_choices(model, candidates):
+            yield function_name, fail, {key: user}
+    if with_time:
+        yield from time_moves(model)
+
+
+def sequence_of(node):
+    sequence = []
+    while node is not None:
+        op, node = node
+        sequence.append(op)
+    return sequence[::-1]
+
+
+class Enumerator:
+    """
+    Enumerates the sequences of up to depth operations over the vectors of the model (BFS or DFS), without
+    expanding a state whose pruning key has already been expanded at the same or a lower depth.
+    Stops early when the visited states exceed max_states or the process exceeds memory_mb.
+    """
+    def __init__(self, depth, seed=1, with_time=False, max_states=None, memory_mb=None):
+        self.depth = depth
+        self.model = fuzzer.new_model(random.Random(seed))
+        self.vectors = all_vectors(self.model.functions, fuzzer.UNSUPPORTED_VECTORS)
+        self.with_time = with_time
+        self.max_states = max_states
+        self.memory_mb = memory_mb
+        self.visited = {}  # pruning key -> lowest depth it was expanded at
+        self.coverage = {}  # (function name, fail, abstract state) -> number of times applied
+        self.failures = {}  # failure signature -> (failure, shortest sequence)
+        self.edges = 0
+        self.expanded = 0
+        self.complete = True
+
+    def over_budget(self):
+        self.expanded += 1
+        if self.max_states is not None and len(self.visited) > self.max_states:
+            return True
+        if self.memory_mb is not None and self.expanded % 256 == 0:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 > self.memory_mb
+        return False
+
+    def children(self, snapshot, node, depth):
+        """
+        Apply every move to the state of snapshot and return (snapshot, node) of the states that are new
+        """
+        children = []
+        model = self.model
+        model.restore(snapshot)
+        for move in list(moves(model, self.vectors, self.with_time)):
+            model.restore(snapshot)
+            function_name, fail, parameters = move
+            state = abstract_state(model)
+            self.edges += 1
+            try:
+                if function_name == "change_time":
+                    model.change_time(parameters["time"])
+                    parameters = dict(parameters)
+                else:
+                    parameters = apply_op(model, depth, function_name, fail, parameters)
+            except ModelFailure as e:
+                signature = e.signature()
+                if signature not in self.failures:
+                    self.failures[signature] = (e, sequence_of(((function_name, fail, parameters), node)))
+                continue
+            if parameters is None:
+                continue
+            if function_name != "change_time":
+                key = (function_name, fail, state)
+                self.coverage[key] = self.coverage.get(key, 0) + 1
+            key = pruning_key(model)
+            if self.visited.get(key, self.depth + 1) <= depth + 1:
+                continue
+            self.visited[key] = depth + 1
+            children.append((model.fork(), ((function_name, fail, parameters), node)))
+        return children
+
+    def bfs(self):
+        root = self.model.fork()
+        self.visited[pruning_key(self.model)] = 0
+        frontier = deque([(root, None, 0)])
+        while frontier:
+            snapshot, node, depth = frontier.popleft()
+            if depth == self.depth:
+                continue
+            if self.over_budget():
+                self.complete = False
+                return
+            for child, child_node in self.children(snapshot, node, depth):
+                frontier.append((child, child_node, depth + 1))
+
+    def dfs(self):
+        root = self.model.fork()
+        self.visited[pruning_key(self.model)] = 0
+        stack = [(root, None, 0)]
+        while stack:
+            snapshot, node, depth = stack.pop()
+            if depth == self.depth:
+                continue
+            if self.over_budget():
+                self.complete = False
+                return
+            for child, child_node in reversed(self.children(snapshot, node, depth)):
+                stack.append((child, child_node, depth + 1))
+
+    def run(self, strategy="bfs"):
+        if strategy == "dfs":
+            self.dfs()
+        else:
+            self.bfs()
+        return self
+
+
+def report(enumerator, elapsed, out=sys.stdout):
+    out.write("%s enumeration to depth %d: %d abstract states, %d transitions in %.2fs\n" %
+              ("complete" if enumerator.complete else "INCOMPLETE (budget exhausted)", enumerator.depth,
+               len(enumerator.visited), enumerator.edges, elapsed))
+    coverage_report(enumerator.coverage, enumerator.vectors, out)
+    for (e, sequence) in enumerator.failures.values():
+        out.write("%s in %s(%s): %s after %d ops\n" % (e.kind, e.function_name, e.fail, e.message, len(sequence)))
+        for op in sequence:
+            out.write("  %s\n" % (op,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enumerate every op sequence of the crowdsale model up to a depth")
+    parser.add_argument("--depth", type=int, default=4, help="maximum number of ops of a sequence")
+    parser.add_argument("--strategy", choices=["bfs", "dfs"], default="bfs")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the numeric parameters")
+    parser.add_argument("--time", action="store_true",
+                        help="also move the time into every time window of the sale")
+    parser.add_argument("--max-states", type=int, default=None, help="stop after this many abstract states")
+    parser.add_argument("--memory-mb", type=float, default=None, help="stop when the peak RSS exceeds this")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    enumerator = Enumerator(args.depth, args.seed, args.time, args.max_states, args.memory_mb).run(args.strategy)
+    report(enumerator, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# answers of the methods that do not depend on the state of the node
+STATIC_RESULTS = {
+    "net_version": "5777",
+    "net_listening": True,
+    "web3_clientVersion": "FakeNode/v0.1",
+    "eth_chainId": "0x539",
+    "eth_protocolVersion": "0x3f",
+    "eth_syncing": False,
+    "eth_mining": True,
+    "eth_gasPrice": "0x4a817c800",
+    "eth_accounts": ["0x" + ("%02x" % i) * 20 for i in range(1, 11)],
+    "eth_getBalance": "0x56bc75e2d63100000",
+    "eth_getCode": "0x",
+    "eth_getTransactionCount": "0x0",
+    "eth_estimateGas": "0x6691b7",
+}
+
+
+class FakeNode:
+    """
+    Stand-in for a local chain that records every JSON-RPC call as (method, params).
+    It implements evm_snapshot/evm_revert like ganache (reverting to a snapshot drops the later ones)
+    and answers the other methods with dummy values, which is enough to check what a test sends to the chain.
+    """
+    def __init__(self, host="127.0.0.1", port=0, log=None):
+        self.calls = []
+        self.snapshots = []
+        self.next_snapshot = 1
+        self.block = 0
+        self.lock = threading.Lock()
+        self.log = log
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def handler(self):
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    request = json.loads(body)
+                except ValueError:
+                    return self.send_json({"jsonrpc": "2.0", "id": None,
+                                           "error": {"code": -32700, "message": "Parse error"}})
+                if isinstance(request, list):
+                    return self.send_json([node.answer(i) for i in request])
+                self.send_json(node.answer(request))
+
+            def send_json(self, response):
+                data = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def answer(self, request):
+        method = request.get("method")
+        params = request.get("params", [])
+        with self.lock:
+            self.calls.append((method, params))
+            if self.log:
+                self.log.write(json.dumps([method, params]) + "\n")
+                self.log.flush()
+            try:
+                result = self.call(method, params)
+            except KeyError:
+                return {"jsonrpc": "2.0", "id": request.get("id"),
+                        "error": {"code": -32601, "message": "Method %s not supported" % method}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def call(self, method, params):
+        if method == "evm_snapshot":
+            snapshot_id = hex(self.next_snapshot)
+            self.next_snapshot += 1
+            self.snapshots.append(snapshot_id)
+            return snapshot_id
+        if method == "evm_revert":
+            snapshot_id = params[0] if isinstance(params[0], str) else hex(params[0])
+            if snapshot_id not in self.snapshots:
+                return False
+            del self.snapshots[self.snapshots.index(snapshot_id):]
+            return True
+        if method in ("evm_mine", "evm_increaseTime"):
+            self.block += 1
+            return "0x0"
+        if method == "eth_blockNumber":
+            return hex(self.block)
+        if method in ("eth_sendTransaction", "eth_sendRawTransaction"):
+            self.block += 1
+            return "0x" + "%064x" % self.block
+        if method == "eth_call":
+            return "0x" + "0" * 64
+        return STATIC_RESULTS[method]
+
+    def methods(self):
+        return [method for method, _ in self.calls]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake JSON-RPC node that records the calls it receives")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--log", default=None, help="file to append the calls to, one JSON [method, params] per line")
+    args = parser.parse_args()
+    log = open(args.log, "a") if args.log else None
+    node = FakeNode(args.host, args.port, log)
+    print(node.url, flush=True)
+    try:
+        node.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        node.server.server_close()
+        if log:
+            log.close()
+
+
+if __name__ == '__main__':
+    main()
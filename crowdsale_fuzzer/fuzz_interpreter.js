@@ -0,0 +1,146 @@
+// Interpreter of the JSON op lists written by fuzzer.py --backend json.
+// Every fuzz_test.<seed>.json of the directory of this file (or of FUZZ_OPS_DIR), or only the one named by
+// FUZZ_OP_LIST (see runner.py), is run as a contract() block with one it() block per test case, which executes the operations of the case and compares the state of the chain with
+// the values of the model. This file is not generated: fuzzer.py copies it next to the op lists.
+
+var fs = require("fs");
+var path = require("path");
+
+var QuantstampToken = artifacts.require("./QuantstampToken.sol");
+var QuantstampSaleMock = artifacts.require('./helpers/QuantstampSaleMock.sol');
+
+var OPS_DIR = process.env.FUZZ_OPS_DIR || __dirname;
+var OP_LIST = /^fuzz_test\.\d+\.json$/;
+var ONLY_OP_LIST = process.env.FUZZ_OP_LIST;
+
+function opLists () {
+    return fs.readdirSync(OPS_DIR).filter(function(name) {
+        return OP_LIST.test(name) && (!ONLY_OP_LIST || name === ONLY_OP_LIST);
+    }).sort().map(function(name) {
+        return JSON.parse(fs.readFileSync(path.join(OPS_DIR, name), "utf8"));
+    });
+}
+
+function checkpointState (start, state) {
+    // the first values of state are relative to start, since the token is shared by all the test cases
+    return state.map(function(value, i) {
+        if (typeof value === "boolean") { return String(value); }
+        return (i < start.length ? value.minus(start[i]) : value).toFixed();
+    });
+}
+
+opLists().forEach(function(test) {
+    contract('Fuzz Test ' + test.seed, function(accounts) {
+        var users = {};
+        test.users.forEach(function(user, i) { users[user] = accounts[i]; });
+        var owner = users.owner;
+        var token;
+        var sale;
+
+        // an account variable, one of the addresses the operations use as invalid destinations, or a literal
+        async function address (name) {
+            if (users.hasOwnProperty(name)) { return users[name]; }
+            if (name === "sale.address") { return sale.address; }
+            if (name === "token.address") { return token.address; }
+            if (name === "token.owner()") { return await token.owner(); }
+            return name;
+        }
+
+        async function deploy (params) {
+            var args = [];
+            for (var i = 0; i < params.length; i++) {
+                args.push(typeof params[i] === "string" ? await address(params[i]) : params[i]);
+            }
+            args.push(token.address);
+            return QuantstampSaleMock.new.apply(QuantstampSaleMock, args);
+        }
+
+        // the reads in the order of the values of the model (see CrowdsaleModel.checkpoint_values)
+        async function readState () {
+            var tokenOwner = await token.owner();
+            return Promise.all(test.users.map(function(user) { return token.balanceOf(users[user]); }).concat(
+                [token.allowance(tokenOwner, sale.address)],
+                test.users.map(function(user) { return sale.balanceOf(users[user]); }),
+                [sale.amountRaised(), sale.rate(), sale.paused(), sale.saleClosed(), sale.fundingGoalReached(),
+                 sale.fundingCapReached()]));
+        }
+
+        // the transaction of every function of the model, from its recorded parameters
+        var CALLS = {
+            create_new_crowdsale: async function(p) {
+                sale = await deploy(p.params);
+                if (p.set_crowdsale) { await token.setCrowdsale(sale.address, 0); }
+            },
+            set_pause: async function(p) {
+                var from = {from: await address(p.user)};
+                return p.pause ? sale.pause(from) : sale.unpause(from);
+            },
+            change_time: async function(p) { return sale.changeTime(p.time, {from: owner}); },
+            terminate: async function(p) { return sale.terminate({from: await address(p.user)}); },
+            owner_unlock_fund: async function(p) { return sale.ownerUnlockFund({from: await address(p.user)}); },
+            set_rate: async function(p) { return sale.setRate(p.rate, {from: await address(p.user)}); },
+            owner_safe_withdrawal: async function(p) {
+                return sale.ownerSafeWithdrawal({from: await address(p.user)});
+            },
+            owner_allocate_tokens: async function(p) {
+                return sale.ownerAllocateTokens(await address(p.to_user), p.amount_wei, p.amount_mini_qsp,
+                                                {from: await address(p.user)});
+            },
+            fallback: async function(p) {
+                return sale.sendTransaction({from: await address(p.user), value: p.wei});
+            }
+        };
+
+        async function assertState (start, expected, label) {
+            var state = checkpointState(start, await readState());
+            assert.equal(state.join(","), expected.join(","), label + ": the state should be the one of the model");
+        }
+
+        test.cases.forEach(function(testCase, index) {
+            it('should pass the fuzz test' + (index ? ' ' + index : ''), async function() {
+                token = await QuantstampToken.deployed();
+                sale = await deploy(test.contract_parameters);
+                await token.setCrowdsale(sale.address, 0);
+                var tokenOwner = await token.owner();
+                var start = await Promise.all(test.users.map(function(user) {
+                    return token.balanceOf(users[user]);
+                }).concat([token.allowance(tokenOwner, sale.address)]));
+                var expected = testCase.start && testCase.start.slice();
+
+                for (var i = 0; i < testCase.ops.length; i++) {
+                    // [index in the table of (function name, fail, parameter names), whether the transaction
+                    // fails, changes of the values of the model] + the values of the parameters
+                    var op = testCase.ops[i];
+                    var entry = test.table[op[0]];
+                    var name = entry[0], fail = entry[1], throws = op[1], changes = op[2];
+                    var parameters = {};
+                    entry[2].forEach(function(parameter, j) { parameters[parameter] = op[3 + j]; });
+                    // the failures of the test name the operation, so that results.py maps them back to it
+                    var label = "op " + i + " " + name + "(" + (fail || "") + ")";
+                    if (test.verbose) {
+                        console.log("About to call " + name + " with parameters: " + JSON.stringify(parameters));
+                    }
+                    var threw = false;
+                    try {
+                        await CALLS[name](parameters);
+                    }
+                    catch (e) {
+                        if (!throws) {
+                            e.message = label + ": " + e.message;
+                            throw e;
+                        }
+                        threw = true;
+                    }
+                    if (throws && !threw) { throw new Error(label + ": the transaction should have failed"); }
+                    if (changes) {
+                        changes.forEach(function(change) { expected[change[0]] = change[1]; });
+                        await assertState(start, expected, label);
+                    }
+                }
+                if (testCase.final) {
+                    await assertState(start, testCase.final, "end_checks");
+                }
+            });
+        });
+    });
+});
@@ -1,12 +1,28 @@
+import argparse
+import hashlib
+import io
+import json
 import os
 import random
+import shutil
 import sys
+from functools import partial
+from multiprocessing import Pool
 
 import test_writer
-from solidity_entities.crowdsale import CrowdsaleFuzzer
+from bundle import BundleWriter, member
+from dedup import DedupIndex, fingerprint
+from manifest import Manifest, config_hash, generator_hash
+from profiler import Profiler
+from results import LINE_MAP_FILE, LineMapWriter, write_line_map
+from scheduler import CoverageScheduler, all_vectors, coverage_report, merge_counts
+from solidity_entities.crowdsale import ASSERTION_LEVELS, CrowdsaleFuzzer
+from solidity_entities.crowdsale_model import CrowdsaleModel
+from solidity_entities.crowdsale_op_list import CrowdsaleOpList, pack
 from solidity_entities.environment import SolidityEnvironment
 from solidity_entities.token import Token
-from test_writer import gen_header, gen_test_contract_header, gen_test_contract_footer
+from test_writer import USERS, gen_header, gen_test_contract_header, gen_test_contract_footer
+from traces import TRACE_FILE, trace_entry, write_traces
 
 
 # ==================== Change these parameters as needed. =============================
@@ -15,8 +31,7 @@ VERBOSE = True
 START_TIME = 1323244
 DURATION_IN_MINUTES = 2
 CROWDSALE_PARAMETERS = ["owner", "beneficiary", "token_admin", 10, 20, 1, START_TIME, DURATION_IN_MINUTES, 5000]
-CROWDSALE_CONTRACT_PARAMETERS = ["beneficiary", 10, 20, 1, START_TIME, DURATION_IN_MINUTES, 5000]
-USERS = ["owner", "beneficiary", "token_admin", "user3", "user4"]
+# the account variables of the tests are test_writer.USERS
 
 # TOKEN_PARAMETERS
 DECIMALS = 18
@@ -24,16 +39,70 @@ INITIAL_SUPPLY = 1000000000 * (10 ** DECIMALS)
 INITIAL_CROWDSALE_ALLOWANCE = 650000000 * (10 ** DECIMALS)
 INITIAL_ADMIN_ALLOWANCE = 350000000 * (10 ** DECIMALS)
 
-MAIN_TEST_DIR = "/home/ezulkosk/quantstamp/token-distribution/test/fuzz_tests/"
+# relative to the working directory, e.g. the root of the truffle project of the sale
+MAIN_TEST_DIR = "test/fuzz_tests/"
 
 # test subtype directories
 SUB_TEST_DIR = MAIN_TEST_DIR  # + "sale_terminate/"
 
 RANDOM_SEED = 123
+
+# pick the ops of random tests (gen_test) with the coverage-guided scheduler instead of uniformly
+COVERAGE_GUIDED = True
+
+# read the state before and after every transaction with one Promise.all each instead of one await per value
+BATCH_READS = False
+
+# assertions of the tests: none, final, op or paranoid (see crowdsale.ASSERTION_LEVELS)
+ASSERTIONS = "op"
+
+# split random tests into it blocks of this many ops, each ending with a checkpoint (see gen_chunked_test)
+CHUNK_OPS = None
+
+# write the tests as JS (js) or as JSON op lists for the interpreter (json), see gen_op_list_file
+BACKEND = "js"
 # =====================================================================================
 
+
+def contract_parameters(crowdsale_parameters):
+    """
+    The arguments of the constructor of the sale for the parameters of the model (see CrowdsaleModel): all of them
+    but the owner and the token admin, who are not arguments of the contract
+    """
+    return crowdsale_parameters[1:2] + crowdsale_parameters[3:]
+
+
+CROWDSALE_CONTRACT_PARAMETERS = contract_parameters(CROWDSALE_PARAMETERS)
+
+BACKENDS = ["js", "json"]
+
+# the hand-written interpreter of the JSON op lists, installed next to them
+INTERPRETER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fuzz_interpreter.js")
+
+# (function, fail) vectors the model cannot instantiate yet; random tests never dispatch them
+UNSUPPORTED_VECTORS = [("owner_unlock_fund", "onlyOwner"), ("owner_unlock_fund", "afterDeadline")]
+
 RNG = random.Random()
 
+# profiler.Profiler of the run, set by --profile
+PROFILER = None
+
+# the parameters above that a config file (see load_config) or the flags can set, by config key
+CONFIG_CONSTANTS = {
+    "verbose": "VERBOSE",
+    "crowdsale_parameters": "CROWDSALE_PARAMETERS",
+    "users": "USERS",
+    "initial_supply": "INITIAL_SUPPLY",
+    "initial_crowdsale_allowance": "INITIAL_CROWDSALE_ALLOWANCE",
+    "initial_admin_allowance": "INITIAL_ADMIN_ALLOWANCE",
+    "out_dir": "SUB_TEST_DIR",
+    "coverage_guided": "COVERAGE_GUIDED",
+    "batch_reads": "BATCH_READS",
+    "assertions": "ASSERTIONS",
+    "chunk_ops": "CHUNK_OPS",
+    "backend": "BACKEND",
+}
+
 
 def seed_random():
     global RANDOM_SEED
@@ -43,34 +112,325 @@ def seed_random():
     RNG = random.Random(RANDOM_SEED)
 
 
-def gen_test(out, ops=2):
+def configure(config):
+    """
+    Set the parameters of the module from a dict of config keys (see CONFIG_CONSTANTS); the parameters of the
+    contract always follow the ones of the model
+    """
+    global CROWDSALE_CONTRACT_PARAMETERS
+    for key, value in config.items():
+        if key not in CONFIG_CONSTANTS:
+            raise ValueError("unknown config key: " + key)
+        globals()[CONFIG_CONSTANTS[key]] = value
+    CROWDSALE_CONTRACT_PARAMETERS = contract_parameters(CROWDSALE_PARAMETERS)
+
+
+def current_config():
+    return {key: globals()[name] for key, name in CONFIG_CONSTANTS.items()}
+
+
+def start_profiler():
+    """
+    Profile this process (see profiler.Profiler) in the fuzzer module that is running: the module __main__ when
+    fuzzer.py is run as a script, whose functions may not see the attributes of the module (a spawned worker runs it
+    with runpy), so its globals are instrumented instead
+    """
+    global PROFILER
+    PROFILER = Profiler()
+    PROFILER.instrument(globals())
+
+
+def worker_state():
+    """
+    The arguments of init_worker for the worker pools of this process
+    """
+    return current_config(), PROFILER is not None
+
+
+def init_worker(config, profile):
+    """
+    Initializer of the worker pools: the workers get the parameters of the parent (see configure) and, if the
+    parent profiles, a profiler of their own, whose stats every result sends back (see test_result).
+    This is all the state of the parent a worker uses, so the workers are the same whatever the start method.
+    """
+    configure(config)
+    if profile and PROFILER is None:
+        start_profiler()
+
+
+def load_config(path):
+    """
+    Read a JSON config file: an object whose keys are either config keys of the parameters (see CONFIG_CONSTANTS)
+    or the names of command line options (with underscores, e.g. "prefix_ops"), which become their defaults
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(path + ": the config must be a JSON object")
+    return config
+
+
+def spawn_seed(master_seed, index):
+    """
+    The seed of the test at index of the campaign of master_seed: the first 8 bytes of the SHA-256 of
+    "<master_seed>/<index>" (both in decimal) as a big-endian integer, shifted right by one bit.
+    It only depends on master_seed and index, so any machine can generate any slice of a campaign.
+    """
+    digest = hashlib.sha256((str(master_seed) + "/" + str(index)).encode()).digest()
+    return int.from_bytes(digest[:8], "big") >> 1
+
+
+def campaign_seeds(master_seed, count, shard=0, shards=1):
+    """
+    The seeds of the tests of shard (in [0, shards)) of the campaign of count tests of master_seed:
+    shard i generates the tests of index i, i + shards, i + 2 * shards, ...
+    The shards of a campaign are disjoint and together generate all of its tests.
+    """
+    return [spawn_seed(master_seed, index) for index in range(shard, count, shards)]
+
+
+def new_model(rng):
+    """
+    A model of the crowdsale, without JS emission, instantiated with the parameters of the tests
+    """
+    env = SolidityEnvironment()
+    token = Token(INITIAL_SUPPLY, INITIAL_CROWDSALE_ALLOWANCE, INITIAL_ADMIN_ALLOWANCE)
+    return CrowdsaleModel(rng, env, token, USERS, *CROWDSALE_PARAMETERS)
+
+
+def new_crowdsale(rng, assertions=None):
+    """
+    A crowdsale that emits JS, instantiated with the parameters of the tests
+    (and with the assertions of the tests unless assertions is given)
+    """
+    env = SolidityEnvironment()
+    token = Token(INITIAL_SUPPLY, INITIAL_CROWDSALE_ALLOWANCE, INITIAL_ADMIN_ALLOWANCE)
+    return CrowdsaleFuzzer(rng, env, token, USERS, *CROWDSALE_PARAMETERS, VERBOSE, BATCH_READS,
+                           ASSERTIONS if assertions is None else assertions)
+
+
+def new_op_list(rng, assertions=None):
+    """
+    A crowdsale that emits the records of JSON op lists (see gen_op_list_file), instantiated with the parameters
+    of the tests
+    """
     env = SolidityEnvironment()
     token = Token(INITIAL_SUPPLY, INITIAL_CROWDSALE_ALLOWANCE, INITIAL_ADMIN_ALLOWANCE)
-    crowdsale = CrowdsaleFuzzer(RNG, env, token, USERS, *CROWDSALE_PARAMETERS)
-    functions = crowdsale.functions
-    functions = [i for i in functions if i.function.__name__ == "fuzz_terminate"]
+    return CrowdsaleOpList(rng, env, token, USERS, *CROWDSALE_PARAMETERS,
+                           ASSERTIONS if assertions is None else assertions)
+
+
+def choose_op(crowdsale, rng, scheduler=None):
+    """
+    The (function, fail) of the next random operation of crowdsale, or None if the vector drawn is not supported.
+    If a CoverageScheduler is given, it picks the operation, otherwise it is picked uniformly.
+    """
+    if scheduler:
+        return scheduler.choose(crowdsale.functions, crowdsale, rng)
+    # get a function to test at random
+    f = rng.choice(crowdsale.functions)
+    fail = rng.choice(f.failure_types() + [None])
+    if (f.function.__name__, fail) in UNSUPPORTED_VECTORS:
+        return None
+    return f, fail
 
-    test_writer.gen_test_case_header(out)
+
+def gen_ops(out, crowdsale, ops, rng, scheduler=None):
+    """
+    Write ops random operations of crowdsale (see choose_op)
+    """
+    line_map = isinstance(out, LineMapWriter)
     count = 0
     while count < ops:
-        # get a function to test at random
-        f = RNG.choice(functions)
-        fail = RNG.choice(f.failure_types() + [None])
-        s = f.function(fail)
-        if not s:
+        op = choose_op(crowdsale, rng, scheduler)
+        if op is None:
             continue
+        f, fail = op
+        first_line = out.lines + 1 if line_map else None
+        if PROFILER:
+            if not PROFILER.dispatch(out, f.function, fail):
+                continue
+        else:
+            s = f.function(fail)
+            if s is None:
+                continue
+            test_writer.write_fragments(out, s)
+        if line_map:
+            out.record(len(crowdsale.trace) - 1, f.function.__name__, fail, first_line)
+        count += 1
+
 
-        arr = s.split("\n")
-        for line in arr:
-            out.write("        " + line + "\n")
+def replay_ops(out, crowdsale, sequence, ops=None):
+    """
+    Write the operations of sequence, an iterator of recorded (function name, fail, parameters) (see
+    CrowdsaleModel.trace), with their recorded parameters, like gen_ops writes random ones: up to ops operations,
+    or until sequence is exhausted
+    """
+    line_map = isinstance(out, LineMapWriter)
+    count = 0
+    while ops is None or count < ops:
+        op = next(sequence, None)
+        if op is None:
+            break
+        function_name, fail, parameters = op
+        first_line = out.lines + 1 if line_map else None
+        s = crowdsale.replay(function_name, fail, parameters)
+        if s is None:
+            continue
+        test_writer.write_fragments(out, s)
+        if line_map:
+            out.record(len(crowdsale.trace) - 1, function_name, fail, first_line)
         count += 1
+
+
+def write_checks(out, s, name, op_index=None):
+    # the start or end checks of a crowdsale, if any, or a checkpoint after the first op_index ops
+    if s is None:
+        return
+    first_line = out.lines + 1 if isinstance(out, LineMapWriter) else None
+    test_writer.write_fragments(out, s)
+    if first_line is not None:
+        out.record(op_index, name, None, first_line)
+
+
+def gen_test(out, ops=2, rng=None, scheduler=None, case=0):
+    """
+    Write a test case of ops random operations (see gen_ops)
+    """
+    if rng is None:
+        rng = RNG
+    crowdsale = new_crowdsale(rng)
+
+    test_writer.gen_test_case_header(out, case)
+    write_checks(out, crowdsale.start_checks(), "start_checks")
+    gen_ops(out, crowdsale, ops, rng, scheduler)
+    write_checks(out, crowdsale.end_checks(), "end_checks")
     out.write("    });\n")
+    return crowdsale
 
 
-def gen_predefined_test(out):
-    env = SolidityEnvironment()
-    token = Token(INITIAL_SUPPLY, INITIAL_CROWDSALE_ALLOWANCE, INITIAL_ADMIN_ALLOWANCE)
-    c = CrowdsaleFuzzer(RNG, env, token, USERS, *CROWDSALE_PARAMETERS, VERBOSE)
+def gen_tree_test(out, prefix_ops, branches, ops, rng=None, scheduler=None, case=0):
+    """
+    Write a test case that runs a shared prefix of prefix_ops random operations once, then branches random
+    suffixes of ops operations from it: the model is forked after the prefix and restored before every branch,
+    and the test reverts the chain to a snapshot taken after the prefix (needs gen_snapshot_helpers).
+    Returns a copy of the crowdsale at the end of every branch.
+    """
+    if rng is None:
+        rng = RNG
+    crowdsale = new_crowdsale(rng)
+
+    test_writer.gen_test_case_header(out, case)
+    write_checks(out, crowdsale.start_checks(), "start_checks")
+    gen_ops(out, crowdsale, prefix_ops, rng, scheduler)
+    prefix = crowdsale.fork()
+    test_writer.write_fragments(out, test_writer.gen_tree_snapshot())
+    leaves = []
+    for branch in range(branches):
+        if branch:
+            crowdsale.restore(prefix)
+            test_writer.write_fragments(out, test_writer.gen_tree_revert())
+        test_writer.write_fragments(out, test_writer.gen_log("'branch " + str(branch) + "'"))
+        gen_ops(out, crowdsale, ops, rng, scheduler)
+        write_checks(out, crowdsale.end_checks(), "end_checks")
+        leaves.append(crowdsale.copy())
+    out.write("    });\n")
+    return leaves
+
+
+def gen_chunked_test(out, ops, chunk_ops, rng=None, scheduler=None, case=0, resume_chunk=None, sequence=None):
+    """
+    Write a test case of the ops random operations gen_test would write for rng, split into consecutive it blocks
+    of chunk_ops operations that run on the same sale, so that no block runs for long. Every block ends with a
+    checkpoint of the state of the model (see CrowdsaleFuzzer.checkpoint) instead of the start and end checks.
+    With resume_chunk, the blocks before it are left out, and the sale is brought to the state of the checkpoint
+    before it by restore_prefix instead, which resumes a failing test from its last good checkpoint.
+    With sequence, the operations are the recorded ones of sequence instead (see replay_ops).
+    """
+    if rng is None:
+        rng = RNG
+    if sequence is not None:
+        sequence = iter(sequence)
+    crowdsale = new_crowdsale(rng)
+    chunks = (ops + chunk_ops - 1) // chunk_ops
+    if resume_chunk is not None and not 0 <= resume_chunk < chunks:
+        raise ValueError("the test case has chunks 0 to " + str(chunks - 1) + ", not " + str(resume_chunk))
+
+    test_writer.gen_chunked_case_header(out, CROWDSALE_CONTRACT_PARAMETERS, case, crowdsale.start_reads())
+    start = resume_chunk or 0
+    if start:
+        with open(os.devnull, "w") as skipped:
+            if sequence is None:
+                gen_ops(skipped, crowdsale, start * chunk_ops, rng, scheduler)
+            else:
+                replay_ops(skipped, crowdsale, sequence, start * chunk_ops)
+        # inside before()
+        indent = test_writer.INDENT + "    "
+        test_writer.write_fragments(out, restore_prefix(crowdsale), indent)
+        test_writer.write_fragments(out, crowdsale.checkpoint("checkpoint " + str(start - 1)), indent)
+    test_writer.gen_chunked_setup_footer(out)
+    for chunk in range(start, chunks):
+        test_writer.gen_chunk_header(out, chunk)
+        if sequence is None:
+            gen_ops(out, crowdsale, min(chunk_ops, ops - chunk * chunk_ops), rng, scheduler)
+        else:
+            replay_ops(out, crowdsale, sequence, min(chunk_ops, ops - chunk * chunk_ops))
+        write_checks(out, crowdsale.checkpoint("checkpoint " + str(chunk)), "checkpoint", len(crowdsale.trace))
+        out.write("    });\n")
+    out.write("});\n")
+    return crowdsale
+
+
+def restore_prefix(model):
+    """
+    The code that brings a new sale to the state of model without the operations that led to it: the time, one
+    ownerAllocateTokens per account of its whole sale and token balances, the rate, the pause and the closing of
+    the sale. Raises ValueError if these operations do not reach the state of model.
+    """
+    # the restoring operations have their own model, which only needs to end in the state of model
+    restorer = new_crowdsale(random.Random(0), "none")
+    s = []
+    if model.env.current_time != restorer.env.current_time:
+        s.append(restorer.change_time(model.env.current_time))
+    for account, user in enumerate(model.accounts.names):
+        wei = model.balance[account] if account < len(model.balance) else 0
+        mini_qsp = model.token.balances[account] if account < len(model.token.balances) else 0
+        if wei or mini_qsp:
+            s.append(restorer.owner_allocate_tokens(None, {"user": model.owner, "to_user": user,
+                                                           "amount_mini_qsp": mini_qsp, "amount_wei": wei}))
+    if model.rate != restorer.rate:
+        s.append(restorer.set_rate(None, {"user": model.owner, "rate": model.rate}))
+    if model.paused:
+        s.append(restorer.set_pause(None, {"user": model.owner, "pause": True}))
+    if model.sale_closed:
+        s.append(restorer.terminate(None, {"user": model.owner}))
+    if restorer.state_key() != model.state_key():
+        raise ValueError("the state of the model cannot be restored by allocations")
+    return test_writer.fragments(*s)
+
+
+def gen_op_list(crowdsale, ops, rng, scheduler=None):
+    """
+    The JSON test case of ops random operations of crowdsale, a CrowdsaleOpList: the same operations gen_test
+    writes for rng, as the records of CrowdsaleOpList, with the values of the model at the start and at the end
+    """
+    start = crowdsale.start_values()
+    records = []
+    while len(records) < ops:
+        op = choose_op(crowdsale, rng, scheduler)
+        if op is None:
+            continue
+        f, fail = op
+        record = f.function(fail)
+        if record is not None:
+            records.append(record)
+    return {"start": start, "ops": records, "final": crowdsale.final_values()}
+
+
+def gen_predefined_test(out, rng=None, case=0):
+    if rng is None:
+        rng = RNG
+    c = new_crowdsale(rng)
 
     ops = [
         c.fallback(fail=None, parameters={"user": "user3", "wei": 0.2 * 10 ** 18}),
@@ -90,31 +450,581 @@ def gen_predefined_test(out):
         test_writer.gen_log("'Finished Test'")
     ]
 
-    test_writer.gen_test_case_header(out)
+    test_writer.gen_test_case_header(out, case)
+    # the predefined test deploys a new sale at the end, so the final state is not checked; only the paranoid
+    # checks of its operations need the start reads
+    write_checks(out, c.start_checks(), "start_checks")
     count = 0
     for s in ops:
-        if not s:
+        if s is None:
             continue
 
-        arr = s.split("\n")
-        for line in arr:
-            out.write("        " + line + "\n")
+        test_writer.write_fragments(out, s)
         count += 1
     out.write("    });\n")
+    return c
+
+
+def gen_sequence_test(out, sequence, rng=None, case=0):
+    """
+    Write a test case that replays a recorded sequence of (function name, fail, parameters), see CrowdsaleModel.trace
+    """
+    if rng is None:
+        rng = RNG
+    crowdsale = new_crowdsale(rng)
+
+    test_writer.gen_test_case_header(out, case)
+    write_checks(out, crowdsale.start_checks(), "start_checks")
+    replay_ops(out, crowdsale, iter(sequence))
+    write_checks(out, crowdsale.end_checks(), "end_checks")
+    out.write("    });\n")
+    return crowdsale
+
+
+def gen_sequence_file(out, sequence, seed):
+    """
+    Write a test of seed with a single test case that replays sequence (see gen_sequence_test)
+    """
+    gen_header(out)
+    gen_test_contract_header(out, CROWDSALE_CONTRACT_PARAMETERS, seed, users=USERS)
+    crowdsale = gen_sequence_test(out, sequence, random.Random(seed))
+    gen_test_contract_footer(out)
+    return crowdsale
+
+
+def write_sequence_file(out_file, sequence, seed):
+    with open(out_file, 'w') as out:
+        gen_sequence_file(out, sequence, seed)
+    return out_file
+
+
+def gen_test_file(out, seed, ops=None, cases=1, snapshot=False, branches=None, prefix_ops=None):
+    """
+    Write the test for a single seed with its own random.Random, so the test only depends on the seed.
+    With ops, every test case is a random test of that many operations, otherwise the predefined test.
+    With branches, every test case is a tree of that many random branches of ops operations that share
+    a prefix of prefix_ops operations (see gen_tree_test).
+    With snapshot, the cases share one deployment of the sale (see gen_test_contract_header).
+    With CHUNK_OPS, every random test case is split into chunks (see gen_chunked_test), unless it is a tree.
+    With the json BACKEND, the random test cases are written as a JSON op list instead (see gen_op_list_file).
+    Returns the crowdsale of every test case (of every branch for trees) and the scheduler of the test
+    (None if there is none).
+    """
+    rng = random.Random(seed)
+    if PROFILER:
+        PROFILER.instrument_rng(rng)
+    # a fresh scheduler per test keeps every file reproducible from its seed alone
+    scheduler = CoverageScheduler(UNSUPPORTED_VECTORS) if ops and COVERAGE_GUIDED else None
+    if BACKEND == "json":
+        return gen_op_list_file(out, seed, ops, cases, rng, scheduler)
+    chunked = bool(ops and CHUNK_OPS and not branches)
+    gen_header(out)
+    if snapshot or branches:
+        test_writer.gen_snapshot_helpers(out)
+    if chunked:
+        test_writer.gen_checkpoint_helpers(out)
+    gen_test_contract_header(out, CROWDSALE_CONTRACT_PARAMETERS, seed, snapshot, USERS, chunked)
+    crowdsales = []
+    for case in range(cases):
+        if isinstance(out, LineMapWriter):
+            out.case = case
+        if branches and ops:
+            crowdsales.extend(gen_tree_test(out, prefix_ops or ops, branches, ops, rng, scheduler, case))
+        elif chunked:
+            crowdsales.append(gen_chunked_test(out, ops, CHUNK_OPS, rng, scheduler, case))
+        elif ops:
+            crowdsales.append(gen_test(out, ops, rng, scheduler, case))
+        else:
+            crowdsales.append(gen_predefined_test(out, rng, case))
+    gen_test_contract_footer(out)
+    return crowdsales, scheduler
+
+
+def gen_trace_file(out, entry):
+    """
+    Write the test of a recorded trace (see traces.trace_entry) with the current settings of the emitter: every
+    recorded case is replayed as a test case of its own (see gen_sequence_test, or gen_chunked_test with CHUNK_OPS),
+    so the random choices of the original run are not drawn again. With the settings of the original run, the test
+    of a random test without snapshot or branches is identical to the original one.
+    Returns the crowdsale of every test case.
+    """
+    chunked = bool(CHUNK_OPS)
+    gen_header(out)
+    if chunked:
+        test_writer.gen_checkpoint_helpers(out)
+    gen_test_contract_header(out, CROWDSALE_CONTRACT_PARAMETERS, entry["seed"], users=USERS, chunked=chunked)
+    crowdsales = []
+    for case, sequence in enumerate(entry["cases"]):
+        if isinstance(out, LineMapWriter):
+            out.case = case
+        if chunked:
+            crowdsales.append(gen_chunked_test(out, len(sequence), CHUNK_OPS, case=case, sequence=sequence))
+        else:
+            crowdsales.append(gen_sequence_test(out, sequence, case=case))
+    gen_test_contract_footer(out)
+    return crowdsales
+
+
+def gen_op_list_file(out, seed, ops, cases, rng, scheduler=None):
+    """
+    Write the test of seed as one line of JSON for the interpreter (see INTERPRETER): the parameters of the sale,
+    the account variables and the assertion level of the test, and every test case as gen_op_list writes it,
+    packed (see crowdsale_op_list.pack).
+    Returns the crowdsale of every test case and scheduler, like gen_test_file.
+    """
+    crowdsales = []
+    test_cases = []
+    for _ in range(cases):
+        crowdsale = new_op_list(rng)
+        test_cases.append(gen_op_list(crowdsale, ops, rng, scheduler))
+        crowdsales.append(crowdsale)
+    table, test_cases = pack(test_cases)
+    test = {"seed": seed, "contract_parameters": CROWDSALE_CONTRACT_PARAMETERS, "users": USERS,
+            "assertions": ASSERTIONS, "verbose": VERBOSE, "table": table, "cases": test_cases}
+    out.write(json.dumps(test, separators=(",", ":")) + "\n")
+    return crowdsales, scheduler
+
+
+def install_interpreter(out_dir):
+    """
+    Copy the interpreter of the JSON op lists to out_dir, unless it is already there
+    """
+    path = os.path.join(out_dir, os.path.basename(INTERPRETER))
+    if os.path.exists(path):
+        with open(path) as f, open(INTERPRETER) as g:
+            if f.read() == g.read():
+                return path
+    shutil.copyfile(INTERPRETER, path)
+    return path
+
+
+def test_file_name(seed):
+    return "fuzz_test." + str(seed) + (".json" if BACKEND == "json" else ".js")
+
+
+def write_resume_file(seed, case, chunk, out_dir=None, ops=None):
+    """
+    Write test case case of the chunked test of seed (see gen_test_file with CHUNK_OPS) from chunk on, resumed
+    from the checkpoint before it (see gen_chunked_test), to fuzz_test.<seed>.case<case>.chunk<chunk>.js
+    """
+    if out_dir is None:
+        out_dir = SUB_TEST_DIR
+    rng = random.Random(seed)
+    scheduler = CoverageScheduler(UNSUPPORTED_VECTORS) if COVERAGE_GUIDED else None
+    with open(os.devnull, "w") as skipped:
+        # the test cases before case draw from the same rng and scheduler
+        for i in range(case):
+            gen_chunked_test(skipped, ops, CHUNK_OPS, rng, scheduler, i)
+    out_file = out_dir + "/fuzz_test." + str(seed) + ".case" + str(case) + ".chunk" + str(chunk) + ".js"
+    with open(out_file, 'w') as out:
+        gen_header(out)
+        test_writer.gen_checkpoint_helpers(out)
+        gen_test_contract_header(out, CROWDSALE_CONTRACT_PARAMETERS, seed, users=USERS, chunked=True)
+        gen_chunked_test(out, ops, CHUNK_OPS, rng, scheduler, case, chunk)
+        gen_test_contract_footer(out)
+    return out_file
+
+
+def write_test_file(seed, out_dir=None, ops=None, with_fingerprint=False, cases=1, snapshot=False, branches=None,
+                    prefix_ops=None, keep_unchanged=False, line_map=False, with_trace=False):
+    """
+    Write the test for a single seed (see gen_test_file) to its own file.
+    With keep_unchanged, an existing file that already has the content of the test is not written again, which
+    keeps its modification time for the incremental builds of the tests.
+    Returns a dict with the seed, the path of the file, the coverage counts of its scheduler (empty if there is
+    none), if asked for, the fingerprint of its sequence (see dedup.fingerprint), the line map of the test
+    (see results.LineMapWriter) and its trace (see traces.trace_entry), and, when profiling, the profile of the test.
+    """
+    if out_dir is None:
+        out_dir = SUB_TEST_DIR
+    out_file = out_dir + "/" + test_file_name(seed)
+    lines = None
+    if keep_unchanged:
+        out = io.StringIO()
+        if line_map:
+            out = lines = LineMapWriter(out)
+        crowdsales, scheduler = gen_test_file(out, seed, ops, cases, snapshot, branches, prefix_ops)
+        content = (lines.out if line_map else out).getvalue()
+        try:
+            with open(out_file) as f:
+                unchanged = f.read() == content
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            with open(out_file, 'w') as f:
+                f.write(content)
+    else:
+        with open(out_file, 'w') as out:
+            if line_map:
+                out = lines = LineMapWriter(out)
+            crowdsales, scheduler = gen_test_file(out, seed, ops, cases, snapshot, branches, prefix_ops)
+    return test_result(seed, out_file, crowdsales, scheduler, with_fingerprint, lines, with_trace)
+
+
+def write_trace_file(entry, out_dir=None, line_map=False):
+    """
+    Write the test of a recorded trace (see gen_trace_file) to the file of its seed, and return the dict of
+    write_test_file
+    """
+    if out_dir is None:
+        out_dir = SUB_TEST_DIR
+    out_file = out_dir + "/" + test_file_name(entry["seed"])
+    lines = None
+    with open(out_file, 'w') as out:
+        if line_map:
+            out = lines = LineMapWriter(out)
+        crowdsales = gen_trace_file(out, entry)
+    return test_result(entry["seed"], out_file, crowdsales, None, False, lines)
+
+
+def gen_test_member(seed, ops=None, with_fingerprint=False, cases=1, snapshot=False, branches=None, prefix_ops=None,
+                    compress=False, line_map=False, with_trace=False):
+    """
+    Generate the test for a single seed (see gen_test_file) as a member of a bundle (see bundle.member).
+    Returns the dict of write_test_file, without the path of a file, and with the member.
+    """
+    content = io.StringIO()
+    lines = LineMapWriter(content) if line_map else None
+    crowdsales, scheduler = gen_test_file(lines or content, seed, ops, cases, snapshot, branches, prefix_ops)
+    result = test_result(seed, None, crowdsales, scheduler, with_fingerprint, lines, with_trace)
+    result["member"] = member(content.getvalue(), compress)
+    return result
+
+
+def test_result(seed, out_file, crowdsales, scheduler, with_fingerprint, lines=None, with_trace=False):
+    result = {"seed": seed, "file": out_file, "coverage": scheduler.counts if scheduler else {}}
+    if lines is not None:
+        result["lines"] = lines.entry(seed)
+    if with_trace:
+        result["trace"] = trace_entry(seed, crowdsales)
+    if with_fingerprint:
+        trace = [op for crowdsale in crowdsales for op in crowdsale.trace + [("end_case", None, {})]]
+        result["fingerprint"] = fingerprint(trace, crowdsales[0].basic_users)
+    if PROFILER:
+        result["profile"] = PROFILER.take()
+    return result
+
+
+def record_sequence(seed, ops=None, case=0):
+    """
+    The sequence of (function name, fail, parameters) of a test case of a seed, without writing the test
+    """
+    with open(os.devnull, 'w') as out:
+        crowdsales, _ = gen_test_file(out, seed, ops, case + 1)
+    return crowdsales[case].trace
+
+
+def run_config(ops=None, cases=1, snapshot=False, branches=None, prefix_ops=None):
+    """
+    Hash of everything besides the seed and the code that the tests of a run depend on (see manifest.config_hash)
+    """
+    return config_hash(dict(current_config(), out_dir=None, ops=ops, cases=cases, snapshot=snapshot,
+                            branches=branches, prefix_ops=prefix_ops))
+
+
+def gen_batch(seeds, jobs=None, out_dir=None, ops=None, dedup_index=None, cases=1, snapshot=False, branches=None,
+              prefix_ops=None, manifest=None, line_map=False, traces=False):
+    """
+    Generate one test file per seed in a single process pool of size jobs (None = one worker per core).
+    Every file is written by the worker that generated it, and is identical to a serial run with the same seed.
+    With a dedup_index path, the tests whose sequence is already in the index under the same config (see
+    run_config) are removed and left out of the results, and the others are added to it.
+    With a manifest path (see manifest.Manifest), the tests whose seed, config and generator code have not changed
+    since they were last generated in out_dir are skipped and left out of the results, the files of the manifest
+    that are not in seeds are removed, and the files that come out identical are not written again.
+    With line_map, the line map of the tests is added to the line map of out_dir (see results.write_line_map).
+    With traces, the traces of the tests are added to the traces of out_dir (see traces.write_traces).
+    """
+    if out_dir is None:
+        out_dir = SUB_TEST_DIR
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    if BACKEND == "json":
+        install_interpreter(out_dir)
+    index = None
+    if manifest is not None:
+        index = Manifest(manifest, out_dir)
+        config = run_config(ops, cases, snapshot, branches, prefix_ops)
+        generator = generator_hash()
+        names = {test_file_name(seed): seed for seed in seeds}
+        for name in index.stale(names):
+            index.remove(name)
+        seeds = [seed for name, seed in names.items() if not index.unchanged(name, seed, config, generator)]
+    worker = partial(write_test_file, out_dir=out_dir, ops=ops, with_fingerprint=dedup_index is not None,
+                     cases=cases, snapshot=snapshot, branches=branches, prefix_ops=prefix_ops,
+                     keep_unchanged=index is not None, line_map=line_map, with_trace=traces)
+    if jobs == 1:
+        results = [worker(seed) for seed in seeds]
+    else:
+        with Pool(jobs, init_worker, worker_state()) as pool:
+            results = pool.map(worker, seeds)
+    unique = results
+    if dedup_index is not None:
+        with DedupIndex(dedup_index, run_config(ops, cases, snapshot, branches, prefix_ops)) as dedup:
+            unique = []
+            for result in results:
+                if dedup.add(result["fingerprint"]):
+                    unique.append(result)
+                else:
+                    os.remove(result["file"])
+    # the line map and the traces only cover the files that are left
+    if line_map:
+        write_line_map(out_dir, [result["lines"] for result in unique])
+    if traces:
+        write_traces(out_dir, [result["trace"] for result in unique])
+    if index is not None:
+        with index:
+            for result in results:
+                index.update(test_file_name(result["seed"]), result["seed"], config, generator)
+    return unique
+
+
+def gen_bundles(seeds, bundle_size, jobs=None, out_dir=None, ops=None, dedup_index=None, cases=1, snapshot=False,
+                branches=None, prefix_ops=None, compress=False, line_map=False, traces=False):
+    """
+    Generate the tests of seeds like gen_batch, but packed into bundles of bundle_size tests, with an index of
+    the seed, bundle and offset of every test (see bundle.BundleWriter); bundle.py extracts single tests.
+    The workers generate (and compress) the tests, which are written to the bundles in the order of seeds.
+    Returns the results of gen_batch, whose file is the bundle of the test.
+    """
+    if out_dir is None:
+        out_dir = SUB_TEST_DIR
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    worker = partial(gen_test_member, ops=ops, with_fingerprint=dedup_index is not None, cases=cases,
+                     snapshot=snapshot, branches=branches, prefix_ops=prefix_ops, compress=compress,
+                     line_map=line_map, with_trace=traces)
+    index = None
+    if dedup_index is not None:
+        index = DedupIndex(dedup_index, run_config(ops, cases, snapshot, branches, prefix_ops))
+    results = []
+    with BundleWriter(out_dir, bundle_size, compress) as writer:
+        if jobs == 1:
+            generated = map(worker, seeds)
+        else:
+            pool = Pool(jobs, init_worker, worker_state())
+            generated = pool.imap(worker, seeds, chunksize=16)
+        for result in generated:
+            if index is not None and not index.add(result["fingerprint"]):
+                continue
+            result["file"] = writer.add(result["seed"], result.pop("member"))
+            results.append(result)
+        if jobs != 1:
+            pool.close()
+            pool.join()
+    if index is not None:
+        index.close()
+    if line_map:
+        write_line_map(out_dir, [result["lines"] for result in results])
+    if traces:
+        write_traces(out_dir, [result["trace"] for result in results])
+    return results
 
 
 def main():
     seed_random()
     if not os.path.exists(SUB_TEST_DIR):
         os.makedirs(SUB_TEST_DIR)
-    out_file = SUB_TEST_DIR + "/fuzz_test." + str(RANDOM_SEED) + ".js"
-    with open(out_file, 'w') as out:
-        gen_header(out)
-        gen_test_contract_header(out, CROWDSALE_CONTRACT_PARAMETERS, RANDOM_SEED)
-        gen_predefined_test(out)
-        gen_test_contract_footer(out)
-    print(out_file)
+    print(write_test_file(RANDOM_SEED)["file"])
+
+
+def parse_shard(value):
+    try:
+        shard, shards = [int(i) for i in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected i/N, got " + value)
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError("the shard i of i/N must be in [0, N)")
+    return shard, shards
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate crowdsale fuzz tests")
+    parser.add_argument("--config", default=None,
+                        help="JSON config file of the parameters and options (see load_config); "
+                             "the flags override it")
+    parser.add_argument("--count", type=int, default=None,
+                        help="number of tests of the campaign (default: a single test of --seed)")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="i/N: generate only the slice i (from 0) of N of the --count tests of the campaign")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="size of the worker pool used with --count (default: number of cores)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the single test, or with --count, master seed of the campaign from which the "
+                             "seed of every test is derived (see spawn_seed) (default: RANDOM_SEED)")
+    parser.add_argument("--out-dir", default=None, help="directory of the tests (default: SUB_TEST_DIR)")
+    parser.add_argument("--users", nargs="+", default=None,
+                        help="account variables of the tests (default: USERS)")
+    parser.add_argument("--verbose", dest="verbose", action="store_const", const=True, default=None,
+                        help="log every call in the tests (default: VERBOSE)")
+    parser.add_argument("--quiet", dest="verbose", action="store_const", const=False,
+                        help="do not log the calls in the tests")
+    parser.add_argument("--ops", type=int, default=None,
+                        help="generate random tests of this many operations instead of the predefined test")
+    parser.add_argument("--uniform", action="store_true",
+                        help="pick the operations of random tests uniformly instead of by coverage")
+    parser.add_argument("--batch-reads", action="store_true",
+                        help="batch the state reads around every transaction with Promise.all")
+    parser.add_argument("--assertions", choices=ASSERTION_LEVELS, default=None,
+                        help="assertions of the tests, from the cheapest: only the transactions (none), the state at "
+                             "the end of every test case (final), the effect of every operation (op) or also the "
+                             "state after every operation (paranoid) (default: ASSERTIONS)")
+    parser.add_argument("--chunk-ops", type=int, default=None,
+                        help="split every random test case into it blocks of this many operations on the same sale, "
+                             "each ending with a checkpoint of the whole state (default: CHUNK_OPS)")
+    parser.add_argument("--resume-chunk", type=int, default=None,
+                        help="write the test case of --resume-case of the chunked test of --seed from this chunk on, "
+                             "starting from the state of the checkpoint of the chunk before")
+    parser.add_argument("--resume-case", type=int, default=0, help="test case to resume (see --resume-chunk)")
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="write every test as JS (js) or as a JSON op list with the values of the model, run "
+                             "by the interpreter installed in the output directory (json) (default: BACKEND)")
+    parser.add_argument("--cases", type=int, default=1, help="number of test cases (it blocks) per file")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="deploy the sale once per file and revert to a snapshot between test cases")
+    parser.add_argument("--branches", type=int, default=None,
+                        help="write every test case as a tree of this many branches of --ops operations after "
+                             "a shared prefix, reverting the chain to the end of the prefix between branches")
+    parser.add_argument("--prefix-ops", type=int, default=None,
+                        help="number of operations of the shared prefix of trees (default: --ops)")
+    parser.add_argument("--dedup-index", default=None,
+                        help="index of the sequences generated so far; duplicate tests are skipped")
+    parser.add_argument("--manifest", default=None,
+                        help="manifest of the tests of the output directory (see manifest.Manifest): only the tests "
+                             "whose seed, config or generator code changed are generated again, and the tests "
+                             "that are no longer in the campaign are removed")
+    parser.add_argument("--bundle-size", type=int, default=None,
+                        help="pack the tests into bundles of this many tests with an index of the seed, bundle and "
+                             "offset of every test, instead of one file per test (see bundle.py to extract them)")
+    parser.add_argument("--compress", action="store_true",
+                        help="gzip the tests of the bundles, one gzip member per test")
+    parser.add_argument("--line-map", action="store_true",
+                        help="record the lines of every operation of the tests in " + LINE_MAP_FILE +
+                             " of the output directory, to map failures back to operations (see results.py)")
+    parser.add_argument("--traces", action="store_true",
+                        help="record the operations and parameters of every random test in " + TRACE_FILE +
+                             " of the output directory, from which replay.py regenerates the tests")
+    parser.add_argument("--profile", default=None,
+                        help="profile the ops and test_writer helpers into this file (JSON if it ends with .json, "
+                             "pstats otherwise)")
+    args = parser.parse_args(argv)
+    args.parameters = {}
+    if args.config:
+        config = load_config(args.config)
+        unknown = set(config) - set(CONFIG_CONSTANTS) - set(vars(args))
+        if unknown:
+            parser.error("unknown keys in " + args.config + ": " + ", ".join(sorted(unknown)))
+        parser.set_defaults(**{key: value for key, value in config.items() if key in vars(args)})
+        if "shard" in config:
+            parser.set_defaults(shard=parse_shard(config["shard"]))
+        args = parser.parse_args(argv)
+        args.parameters = {key: value for key, value in config.items() if key in CONFIG_CONSTANTS}
+    if args.shard is not None and args.count is None:
+        parser.error("--shard needs --count")
+    if args.jobs is not None and args.count is None:
+        # a single test is generated in this process
+        parser.error("--jobs needs --count")
+    if args.chunk_ops is not None and args.chunk_ops < 1:
+        parser.error("--chunk-ops must be at least 1")
+    if args.chunk_ops and (args.snapshot or args.branches):
+        # the chunks of a test case need the sale they deploy for themselves
+        parser.error("--chunk-ops cannot be combined with --snapshot or --branches")
+    if args.resume_chunk is not None and (not args.chunk_ops or args.ops is None or args.count is not None):
+        parser.error("--resume-chunk needs --chunk-ops and --ops, and a single test (no --count)")
+    if args.resume_chunk is not None and not 0 <= args.resume_case < args.cases:
+        parser.error("--resume-case must be one of the --cases test cases")
+    if args.bundle_size is not None and args.manifest is not None:
+        parser.error("--manifest only applies to tests written to files of their own, not to --bundle-size")
+    if args.backend == "json" and (args.ops is None or args.snapshot or args.branches or args.chunk_ops or
+                                   args.bundle_size is not None or args.line_map or args.profile or
+                                   args.resume_chunk is not None):
+        parser.error("--backend json needs --ops, and cannot be combined with --snapshot, --branches, --chunk-ops, "
+                     "--bundle-size, --line-map, --profile or --resume-chunk")
+    if args.traces and args.ops is None:
+        # the predefined test also writes code that is not an operation of its trace
+        parser.error("--traces needs --ops")
+    if args.compress and args.bundle_size is None:
+        parser.error("--compress needs --bundle-size")
+    if args.manifest is not None and args.dedup_index is not None:
+        # the tests skipped as unchanged would not be checked against the index
+        parser.error("--manifest cannot be combined with --dedup-index")
+    return args
+
+
+def configuration(args):
+    """
+    The config of the parameters of the module given by args (see configure)
+    """
+    config = dict(args.parameters)
+    if args.verbose is not None:
+        config["verbose"] = args.verbose
+    if args.users is not None:
+        config["users"] = args.users
+    if args.out_dir is not None:
+        config["out_dir"] = args.out_dir
+    if args.uniform:
+        config["coverage_guided"] = False
+    if args.batch_reads:
+        config["batch_reads"] = True
+    if args.assertions is not None:
+        config["assertions"] = args.assertions
+    if args.chunk_ops is not None:
+        config["chunk_ops"] = args.chunk_ops
+    if args.backend is not None:
+        config["backend"] = args.backend
+    return config
 
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    configure(configuration(args))
+    if args.seed is not None:
+        RANDOM_SEED = args.seed
+    if args.profile:
+        start_profiler()
+    if args.resume_chunk is not None:
+        seed_random()
+        if not os.path.exists(SUB_TEST_DIR):
+            os.makedirs(SUB_TEST_DIR)
+        print(write_resume_file(RANDOM_SEED, args.resume_case, args.resume_chunk, ops=args.ops))
+    elif args.count is None and args.ops is None and args.cases == 1 and not args.snapshot and not args.profile \
+            and not args.branches and not args.manifest and not args.bundle_size and not args.line_map \
+            and not args.dedup_index:
+        main()
+    else:
+        coverage = {}
+        if args.count is None:
+            seed_random()
+            seeds = [RANDOM_SEED]
+        else:
+            master_seed = RANDOM_SEED or random.randrange(sys.maxsize)
+            shard, shards = args.shard or (0, 1)
+            seeds = campaign_seeds(master_seed, args.count, shard, shards)
+            sys.stderr.write("master seed %d, shard %d/%d: %d of %d tests\n" %
+                             (master_seed, shard, shards, len(seeds), args.count))
+        if args.bundle_size:
+            results = gen_bundles(seeds, args.bundle_size, args.jobs, ops=args.ops, dedup_index=args.dedup_index,
+                                  cases=args.cases, snapshot=args.snapshot, branches=args.branches,
+                                  prefix_ops=args.prefix_ops, compress=args.compress, line_map=args.line_map,
+                                  traces=args.traces)
+        else:
+            results = gen_batch(seeds, args.jobs, ops=args.ops, dedup_index=args.dedup_index, cases=args.cases,
+                                snapshot=args.snapshot, branches=args.branches, prefix_ops=args.prefix_ops,
+                                manifest=args.manifest, line_map=args.line_map, traces=args.traces)
+        printed = None
+        for result in results:
+            merge_counts(coverage, result["coverage"])
+            if PROFILER:
+                PROFILER.merge(result["profile"])
+            # the tests of a bundle are consecutive
+            if result["file"] != printed:
+                print(result["file"])
+                printed = result["file"]
+        if len(results) < len(seeds):
+            sys.stderr.write("skipped %d %s tests\n" % (len(seeds) - len(results),
+                                                       "unchanged" if args.manifest else "duplicate"))
+        if coverage:
+            coverage_report(coverage, all_vectors(new_model(random.Random()).functions, UNSUPPORTED_VECTORS),
+                            sys.stderr)
+        if PROFILER:
+            PROFILER.dump(args.profile)
@@ -0,0 +1,101 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the sources the content of a generated test depends on, relative to this directory: besides the generator,
+# the line maps (results.py) and traces (traces.py) recorded with the tests and the interpreter of the op lists
+GENERATOR_SOURCES = ["__init__.py", "fuzzer.py", "test_writer.py", "scheduler.py", "results.py", "traces.py",
+                     "fuzz_interpreter.js", "solidity_entities/*.py"]
+
+
+def generator_hash():
+    """
+    Hash of the code of the generator (see GENERATOR_SOURCES)
+    """
+    h = hashlib.sha256()
+    for pattern in GENERATOR_SOURCES:
+        for path in sorted(glob.glob(os.path.join(HERE, pattern))):
+            h.update(os.path.relpath(path, HERE).encode() + b"\0")
+            with open(path, "rb") as f:
+                h.update(f.read() + b"\0")
+    return h.hexdigest()
+
+
+def config_hash(config):
+    """
+    Hash of a JSON-serializable dict of everything besides the seed and the code that a test depends on
+    """
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    """
+    Record of the tests generated in directory (by default the directory of the manifest): the key every file
+    was generated from, that is its seed, the hash of the config and the hash of the generator code.
+    A file whose key has not changed would be generated again identical, so it can be skipped.
+    """
+    def __init__(self, path, directory=None):
+        self.path = path
+        self.directory = os.path.dirname(path) if directory is None else directory
+        self.entries = {}  # file name -> {"seed", "config", "generator"}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)["files"]
+
+    def unchanged(self, name, seed, config, generator):
+        """
+        Whether the file name exists and was generated from the same key
+        """
+        entry = self.entries.get(name)
+        return entry is not None and entry == {"seed": seed, "config": config, "generator": generator} and \
+            os.path.exists(os.path.join(self.directory, name))
+
+    def update(self, name, seed, config, generator):
+        self.entries[name] = {"seed": seed, "config": config, "generator": generator}
+
+    def stale(self, names):
+        """
+        The files of the manifest that are not in names
+        """
+        names = set(names)
+        return sorted(name for name in self.entries if name not in names)
+
+    def remove(self, name):
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+        del self.entries[name]
+
+    def save(self):
+        # write the new manifest next to the old one and swap them, so that an interrupted run leaves a valid one
+        with open(self.path + ".tmp", "w") as out:
+            json.dump({"files": self.entries}, out, indent=0, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # the entries only change once their files are written or removed, so they are always up to date
+        self.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the manifest of a directory of generated tests")
+    parser.add_argument("manifest")
+    args = parser.parse_args()
+    manifest = Manifest(args.manifest)
+    generator = generator_hash()
+    current = sum(1 for entry in manifest.entries.values() if entry["generator"] == generator)
+    print("%d files, %d generated by the current code" % (len(manifest), current))
+
+
+if __name__ == '__main__':
+    main()
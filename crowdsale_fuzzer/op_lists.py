@@ -0,0 +1,91 @@
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+
+import fuzzer
+from solidity_entities.crowdsale_op_list import decode_parameters, unpack
+
+
+def validate(test):
+    """
+    The differences between a JSON op list (see fuzzer.gen_op_list_file) and the model: every test case is replayed
+    with its recorded parameters on a new CrowdsaleOpList, which must write the same records and values.
+    Returns the list of the differences, empty if the op list is the one of the model.
+    """
+    errors = []
+    for key, value in [("contract_parameters", fuzzer.CROWDSALE_CONTRACT_PARAMETERS), ("users", fuzzer.USERS)]:
+        if test[key] != value:
+            errors.append("the " + key + " are not the ones of the model")
+    for case, test_case in enumerate(test["cases"]):
+        # the recorded parameters are replayed, so the random number generator is never used
+        crowdsale = fuzzer.new_op_list(random.Random(0), test["assertions"])
+        if test_case["start"] != crowdsale.start_values():
+            errors.append("case %d: the start values are not the ones of the model" % case)
+        for index, op in enumerate(test_case["ops"]):
+            record = unpack(test["table"], op)
+            function_name, fail, parameters = record[:3]
+            try:
+                expected = crowdsale.replay(function_name, fail, decode_parameters(parameters))
+            except (Exception, SystemExit) as e:
+                errors.append("case %d op %d %s(%s): the model fails: %s" % (case, index, function_name, fail, e))
+                break
+            if record != expected:
+                # the state of the model and the one of the op list have diverged, so the rest would differ as well
+                errors.append("case %d op %d %s(%s): %s instead of %s" % (case, index, function_name, fail,
+                                                                           json.dumps(record), json.dumps(expected)))
+                break
+        else:
+            if test_case["final"] != crowdsale.final_values():
+                errors.append("case %d: the final values are not the ones of the model" % case)
+    return errors
+
+
+def op_list_files(paths):
+    """
+    The op lists of paths, which are op lists or directories of op lists
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "fuzz_test.*.json"))))
+        else:
+            files.append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate JSON op lists (see fuzzer.py --backend json) against the "
+                                                 "model")
+    parser.add_argument("paths", nargs="+", help="op lists, or directories of op lists")
+    parser.add_argument("--config", default=None,
+                        help="config file of the run (see fuzzer.load_config) with the parameters of the model")
+    args = parser.parse_args()
+
+    if args.config:
+        config = fuzzer.load_config(args.config)
+        fuzzer.configure({key: value for key, value in config.items() if key in fuzzer.CONFIG_CONSTANTS})
+    files = op_list_files(args.paths)
+    invalid = 0
+    for path in files:
+        try:
+            with open(path) as f:
+                errors = validate(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            errors = ["cannot read the op list: " + str(e)]
+        except (KeyError, TypeError, IndexError) as e:
+            # JSON, but not in the layout of an op list
+            errors = ["malformed op list: %s %s" % (type(e).__name__, e)]
+        if errors:
+            invalid += 1
+            for error in errors:
+                print(path + ": " + error)
+    sys.stderr.write("%d op lists, %d invalid\n" % (len(files), invalid))
+    if invalid:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import inspect
+import json
+import marshal
+import time
+
+import test_writer
+from scheduler import CoverageScheduler
+from solidity_entities import crowdsale
+
+# the draws of random.Random the model makes
+RNG_METHODS = ["choice", "choices", "randint", "randrange", "random", "uniform"]
+
+# test_writer functions that are not timed: fragments only chains the others
+UNTIMED_HELPERS = {"fragments"}
+
+
+class CountingWriter:
+    def __init__(self, out):
+        self.out = out
+        self.bytes = 0
+
+    def write(self, s):
+        self.bytes += len(s)
+        self.out.write(s)
+
+
+class Profiler:
+    """
+    Records calls, wall time and emitted bytes of the ops dispatched from gen_test, of the test_writer helpers,
+    of the fills of their templates, of the draws of the random number generator and of str() in the crowdsale
+    (mostly big ints). A template is only built the first time it is asked for (see test_writer.template), so once
+    the templates are built, the time of an op is mostly in Template.fill and str().
+    Nothing is patched until instrument() is called, so a run without a profiler pays nothing.
+
+    Times are kept like cProfile does: the total time of a key includes the keys it called,
+    its own time does not.
+    """
+    def __init__(self):
+        self.stats = {}  # key -> [calls, own seconds, total seconds, bytes, (file, line, name)]
+        self.stack = [0.0]  # time spent in the timed callees of every open region
+        self.patched = []
+
+    def entry(self, key, function=None):
+        if key not in self.stats:
+            code = getattr(function, "__code__", None)
+            if code is not None:
+                location = (code.co_filename, code.co_firstlineno, key)
+            else:
+                location = ("~", 0, key)
+            self.stats[key] = [0, 0.0, 0.0, 0, location]
+        return self.stats[key]
+
+    def enter(self):
+        self.stack.append(0.0)
+        return time.perf_counter()
+
+    def exit(self, entry, start, emitted=0, calls=1):
+        elapsed = time.perf_counter() - start
+        callees = self.stack.pop()
+        self.stack[-1] += elapsed
+        entry[0] += calls
+        entry[1] += elapsed - callees
+        entry[2] += elapsed
+        entry[3] += emitted
+
+    def timed_function(self, key, function):
+        entry = self.entry(key, function)
+
+        def timed(*args, **kwargs):
+            start = self.enter()
+            result = function(*args, **kwargs)
+            self.exit(entry, start, len(result) if type(result) is str else 0)
+            return result
+        return timed
+
+    def timed_generator(self, key, function):
+        # the work of a generator helper happens while it is consumed, so every step is timed
+        entry = self.entry(key, function)
+
+        def timed(*args, **kwargs):
+            generator = function(*args, **kwargs)
+            calls = 1
+            while True:
+                start = self.enter()
+                try:
+                    fragment = next(generator)
+                except StopIteration:
+                    self.exit(entry, start, 0, calls)
+                    return
+                self.exit(entry, start, len(fragment), calls)
+                calls = 0
+                yield fragment
+        return timed
+
+    def timed_str(self):
+        entries = {}
+
+        def timed(value=""):
+            entry = entries.get(type(value))
+            if entry is None:
+                entry = entries[type(value)] = self.entry("str(" + type(value).__name__ + ")")
+            start = self.enter()
+            result = str(value)
+            self.exit(entry, start, len(result))
+            return result
+        return timed
+
+    def patch(self, owner, name, value):
+        # owner is a class or a module, or a dict of globals
+        if isinstance(owner, dict):
+            self.patched.append((owner, name, owner.get(name)))
+            owner[name] = value
+        else:
+            self.patched.append((owner, name, owner.__dict__.get(name)))
+            setattr(owner, name, value)
+
+    def instrument(self, *namespaces):
+        """
+        Time the test_writer helpers wherever they are called from (test_writer, the crowdsale and the dicts of
+        globals of namespaces, e.g. the ones of the fuzzer module that is running), Template.fill, the scheduler and
+        str() in the crowdsale
+        """
+        helpers = {}
+        for name, function in vars(test_writer).items():
+            if inspect.isfunction(function) and function.__module__ == test_writer.__name__ \
+                    and name not in UNTIMED_HELPERS:
+                if inspect.isgeneratorfunction(function):
+                    helpers[function] = self.timed_generator("test_writer." + name, function)
+                else:
+                    helpers[function] = self.timed_function("test_writer." + name, function)
+        for namespace in [vars(test_writer), vars(crowdsale)] + list(namespaces):
+            for name, value in list(namespace.items()):
+                if inspect.isfunction(value) and value in helpers:
+                    self.patch(namespace, name, helpers[value])
+        self.patch(test_writer.Template, "fill",
+                   self.timed_function("test_writer.Template.fill", test_writer.Template.fill))
+        self.patch(CoverageScheduler, "choose",
+                   self.timed_function("CoverageScheduler.choose", CoverageScheduler.choose))
+        # shadows the builtin str in the crowdsale module only, where the big ints are turned into JS literals
+        self.patch(crowdsale, "str", self.timed_str())
+
+    def uninstrument(self):
+        while self.patched:
+            owner, name, value = self.patched.pop()
+            if isinstance(owner, dict):
+                if value is None:
+                    del owner[name]
+                else:
+                    owner[name] = value
+            elif value is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, value)
+
+    def instrument_rng(self, rng):
+        for name in RNG_METHODS:
+            setattr(rng, name, self.timed_function("rng." + name, getattr(rng, name)))
+        return rng
+
+    def dispatch(self, out, function, fail):
+        """
+        Dispatch function(fail) and write its fragments to out like gen_test does, timing both.
+        Returns whether the op was emitted.
+        """
+        key = function.__name__ + "(" + str(fail) + ")"
+        entry = self.entry(key, function)
+        writer = CountingWriter(out)
+        start = self.enter()
+        s = function(fail)
+        if s is not None:
+            test_writer.write_fragments(writer, s)
+        self.exit(entry, start, writer.bytes)
+        return s is not None
+
+    def take(self):
+        """
+        The stats recorded so far, which are then cleared (to send the stats of one test back from a worker).
+        The entries are cleared in place since the timed functions hold on to them.
+        """
+        stats = {key: tuple(entry) for key, entry in self.stats.items() if entry[0]}
+        for entry in self.stats.values():
+            entry[:4] = [0, 0.0, 0.0, 0]
+        return stats
+
+    def merge(self, stats):
+        for key, (calls, own, total, emitted, location) in stats.items():
+            entry = self.entry(key)
+            entry[0] += calls
+            entry[1] += own
+            entry[2] += total
+            entry[3] += emitted
+            entry[4] = tuple(location)
+
+    def dump_json(self, path):
+        rows = [{"key": key, "calls": calls, "own_seconds": own, "total_seconds": total, "bytes": emitted}
+                for key, (calls, own, total, emitted, _) in self.stats.items() if calls]
+        rows.sort(key=lambda row: -row["own_seconds"])
+        with open(path, "w") as out:
+            json.dump(rows, out, indent=1)
+
+    def dump_pstats(self, path):
+        """
+        Write the stats in the format of cProfile's dump_stats, which pstats.Stats can load;
+        every key is reported as a function of its own, without callers
+        """
+        stats = {}
+        for key, (calls, own, total, _, location) in self.stats.items():
+            if not calls:
+                continue
+            filename, line, _ = location
+            stats[(filename, line, key)] = (calls, calls, own, total, {})
+        with open(path, "wb") as out:
+            marshal.dump(stats, out)
+
+    def dump(self, path):
+        if path.endswith(".json"):
+            self.dump_json(path)
+        else:
+            self.dump_pstats(path)
@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+
+import fuzzer
+from results import write_line_map
+from solidity_entities.crowdsale import ASSERTION_LEVELS
+from traces import read_traces
+
+
+def replay_batch(entries, out_dir, jobs=None, line_map=False):
+    """
+    Write the test of every trace of entries (see fuzzer.write_trace_file) in a process pool of size jobs
+    (None = one worker per core), and return the results of fuzzer.write_test_file
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    worker = partial(fuzzer.write_trace_file, out_dir=out_dir, line_map=line_map)
+    if jobs == 1:
+        results = [worker(entry) for entry in entries]
+    else:
+        with Pool(jobs, fuzzer.init_worker, fuzzer.worker_state()) as pool:
+            results = pool.map(worker, entries, chunksize=16)
+    if line_map:
+        write_line_map(out_dir, [result["lines"] for result in results])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate the tests of recorded traces (see fuzzer.py --traces) "
+                                                 "with their recorded operations and parameters")
+    parser.add_argument("traces", help="trace file, e.g. the fuzz_traces.jsonl of a directory of tests")
+    parser.add_argument("--seeds", type=int, nargs="+", default=None, help="only the tests of these seeds")
+    parser.add_argument("--config", default=None,
+                        help="config file of the run (see fuzzer.load_config); the parameters of the model must be "
+                             "the ones the traces were recorded with")
+    parser.add_argument("--out-dir", default=None, help="directory of the tests (default: SUB_TEST_DIR)")
+    parser.add_argument("--jobs", type=int, default=None, help="size of the worker pool (default: number of cores)")
+    parser.add_argument("--verbose", dest="verbose", action="store_const", const=True, default=None,
+                        help="log every call in the tests")
+    parser.add_argument("--quiet", dest="verbose", action="store_const", const=False,
+                        help="do not log the calls in the tests")
+    parser.add_argument("--batch-reads", action="store_true",
+                        help="batch the state reads around every transaction with Promise.all")
+    parser.add_argument("--assertions", choices=ASSERTION_LEVELS, default=None, help="assertions of the tests")
+    parser.add_argument("--chunk-ops", type=int, default=None,
+                        help="split every test case into it blocks of this many operations (see fuzzer.py)")
+    parser.add_argument("--line-map", action="store_true", help="record the lines of every operation of the tests")
+    args = parser.parse_args()
+    if args.chunk_ops is not None and args.chunk_ops < 1:
+        parser.error("--chunk-ops must be at least 1")
+
+    config = {}
+    if args.config:
+        config = {key: value for key, value in fuzzer.load_config(args.config).items()
+                  if key in fuzzer.CONFIG_CONSTANTS}
+    for key, value in [("verbose", args.verbose), ("assertions", args.assertions), ("chunk_ops", args.chunk_ops),
+                       ("out_dir", args.out_dir)]:
+        if value is not None:
+            config[key] = value
+    if args.batch_reads:
+        config["batch_reads"] = True
+    fuzzer.configure(config)
+
+    entries = read_traces(args.traces)
+    if args.seeds is not None:
+        missing = [seed for seed in args.seeds if seed not in entries]
+        if missing:
+            parser.error("not in the traces: " + ", ".join(str(seed) for seed in missing))
+        entries = {seed: entries[seed] for seed in args.seeds}
+    results = replay_batch(list(entries.values()), fuzzer.SUB_TEST_DIR, args.jobs, args.line_map)
+    for result in results:
+        print(result["file"])
+    sys.stderr.write("replayed %d tests\n" % len(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+
+# the line map of the tests of a directory, one JSON {"seed", "lines", "ops"} per line (see LineMapWriter)
+LINE_MAP_FILE = "fuzz_lines.jsonl"
+
+SUITE_TITLE = re.compile(r"Fuzz Test (\d+)")
+CASE_TITLE = re.compile(r"should pass the fuzz test(?: (\d+))?")
+# the location of the failing statement in a stack trace, in a test file (or a reproduction of one, e.g.
+# fuzz_test.<seed>.shrink.js) or in a bundle
+TEST_LOCATION = re.compile(r"fuzz_test\.(\d+)(?:\.\w+)?\.js:(\d+):\d+")
+BUNDLE_LOCATION = re.compile(r"(fuzz_bundle\.\d+\.js):(\d+):\d+")
+TAP_RESULT = re.compile(r"^(not ok|ok) \d+ (.*)$")
+# the operation a failure of the interpreter of JSON op lists names (see fuzz_interpreter.js)
+OP_LABEL = re.compile(r"\bop (\d+) (\w+)\((\w*)\): ")
+ERROR_PREFIX = re.compile(r"^(AssertionError|Error)(?: \[\w+\])?: ")
+
+
+class LineMapWriter:
+    """
+    File-like object that counts the lines written through it, and records the first and last line of every
+    operation of a test as (case, op index, function name, fail, first line, last line). The op index is the
+    index of the operation in the trace of its crowdsale; the start and end checks have none.
+    """
+    def __init__(self, out):
+        self.out = out
+        self.lines = 0
+        self.case = 0
+        self.ops = []
+
+    def write(self, s):
+        self.lines += s.count("\n")
+        self.out.write(s)
+
+    def record(self, op_index, function_name, fail, first_line):
+        self.ops.append((self.case, op_index, function_name, fail, first_line, self.lines))
+
+    def entry(self, seed):
+        return {"seed": seed, "lines": self.lines, "ops": self.ops}
+
+
+def write_line_map(out_dir, entries):
+    """
+    Append the line maps of entries to the line map of out_dir; the last entry of a seed is the current one
+    """
+    with open(os.path.join(out_dir, LINE_MAP_FILE), "a") as out:
+        for entry in entries:
+            out.write(json.dumps(entry) + "\n")
+
+
+class LineMap:
+    """
+    Maps a line of a test file, or of a bundle (with the bundle index of the directory), to its operation.
+    The line map is the one of test_dir, or the entries of LineMapWriter.entry without test_dir.
+    """
+    def __init__(self, test_dir=None, entries=()):
+        self.ops = {}  # seed -> ops of LineMapWriter
+        lines = {}
+        if test_dir is not None:
+            with open(os.path.join(test_dir, LINE_MAP_FILE)) as f:
+                entries = [json.loads(line) for line in f]
+        for entry in entries:
+            self.ops[entry["seed"]] = entry["ops"]
+            lines[entry["seed"]] = entry["lines"]
+        self.bundles = {}  # bundle -> [(first line, seed)] in the order of the bundle
+        index = None if test_dir is None else os.path.join(test_dir, "fuzz_bundles.index.jsonl")
+        if index is not None and os.path.exists(index):
+            with open(index) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    bundle = entry["bundle"][:-3] if entry["bundle"].endswith(".gz") else entry["bundle"]
+                    tests = self.bundles.setdefault(bundle, [])
+                    first = tests[-1][0] + lines.get(tests[-1][1], 0) if tests else 0
+                    tests.append((first, entry["seed"]))
+
+    def in_bundle(self, bundle, line):
+        """
+        The (seed, line in the test) of a line of a bundle
+        """
+        tests = self.bundles.get(bundle)
+        if not tests:
+            return None, None
+        for first, seed in reversed(tests):
+            if first < line:
+                return seed, line - first
+        return None, None
+
+    def op(self, seed, line):
+        """
+        The (case, op index, function name, fail) of a line of the test of seed, or None
+        """
+        for case, op_index, function_name, fail, first_line, last_line in self.ops.get(seed, ()):
+            if first_line <= line <= last_line:
+                return case, op_index, function_name, fail
+        return None
+
+
+def clean_message(message):
+    return ERROR_PREFIX.sub("", message.strip().split("\n")[0]).strip()
+
+
+def test_outcome(title, status, message=None, stack=None, line_map=None):
+    """
+    The (seed, case, status, failure) of a test run; failure is (op index, function name, fail, message, line)
+    """
+    match = SUITE_TITLE.search(title)
+    seed = int(match.group(1)) if match else None
+    match = CASE_TITLE.search(title)
+    case = int(match.group(1) or 0) if match else None
+    if status != "fail":
+        return seed, case, status, None
+    line = None
+    stack = stack or ""
+    match = TEST_LOCATION.search(stack)
+    if match:
+        line = int(match.group(2))
+        seed = int(match.group(1)) if seed is None else seed
+    elif line_map is not None:
+        match = BUNDLE_LOCATION.search(stack)
+        if match:
+            bundle_seed, line = line_map.in_bundle(match.group(1), int(match.group(2)))
+            seed = bundle_seed if seed is None else seed
+    op_index = function_name = fail = None
+    if line is not None and line_map is not None and seed is not None:
+        op = line_map.op(seed, line)
+        if op is not None:
+            case, op_index, function_name, fail = op
+    message = clean_message(message or "")
+    match = OP_LABEL.search(message)
+    if function_name is None and match:
+        op_index, function_name, fail = int(match.group(1)), match.group(2), match.group(3) or None
+    elif function_name is None and message.startswith("end_checks: "):
+        function_name = "end_checks"
+    return seed, case, status, (op_index, function_name, fail, message, line)
+
+
+def parse_mocha_json(text, line_map=None):
+    """
+    The outcomes of the output of the mocha JSON reporter, which may follow the output of truffle
+    """
+    start = 0 if text.startswith("{") else text.find("\n{") + 1
+    report, _ = json.JSONDecoder().raw_decode(text[start:])
+    outcomes = []
+    for test in report.get("failures", []):
+        err = test.get("err", {})
+        outcomes.append(test_outcome(test.get("fullTitle", ""), "fail", err.get("message"), err.get("stack"),
+                                     line_map))
+    for test in report.get("passes", []):
+        outcomes.append(test_outcome(test.get("fullTitle", ""), "pass"))
+    for test in report.get("pending", []):
+        outcomes.append(test_outcome(test.get("fullTitle", ""), "pending"))
+    return outcomes
+
+
+def parse_tap(text, line_map=None):
+    """
+    The outcomes of the output of the mocha TAP reporter: the lines indented under a not ok are the message
+    and stack of the error (or a YAML block with message and stack)
+    """
+    outcomes = []
+    current = None
+
+    def finish():
+        if current is not None:
+            title, details = current
+            details = [i.strip() for i in details if i.strip() not in ("", "---", "...")]
+            message = ""
+            for detail in details:
+                message = detail[len("message:"):].strip().strip("'\"") if detail.startswith("message:") else detail
+                break
+            outcomes.append(test_outcome(title, "fail", message, "\n".join(details), line_map))
+
+    for line in text.splitlines():
+        match = TAP_RESULT.match(line)
+        if match:
+            finish()
+            current = None
+            if match.group(1) == "ok":
+                status = "pending" if "# SKIP" in match.group(2) else "pass"
+                outcomes.append(test_outcome(match.group(2), status))
+            else:
+                current = (match.group(2), [])
+        elif current is not None and line.startswith(" "):
+            current[1].append(line)
+        elif current is not None and not line.startswith("#"):
+            finish()
+            current = None
+    finish()
+    return outcomes
+
+
+def parse_output(text, line_map=None):
+    if text.lstrip().startswith("{") or "\n{" in text:
+        try:
+            return parse_mocha_json(text, line_map)
+        except ValueError:
+            pass
+    return parse_tap(text, line_map)
+
+
+class ResultIndex:
+    """
+    On-disk index of the outcomes of test runs: the status of every file (from the results of runner.py),
+    of every test case, and the failures with the operation and failure vector they come from.
+    Every source is stored once: ingesting it again replaces its rows.
+    """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS files (seed INTEGER, status TEXT, attempts INTEGER, duration REAL,
+                                              source TEXT);
+            CREATE TABLE IF NOT EXISTS tests (seed INTEGER, case_index INTEGER, status TEXT, source TEXT);
+            CREATE TABLE IF NOT EXISTS failures (seed INTEGER, case_index INTEGER, op_index INTEGER, function TEXT,
+                                                 fail TEXT, message TEXT, line INTEGER, source TEXT);
+            CREATE INDEX IF NOT EXISTS files_seed ON files (seed);
+            CREATE INDEX IF NOT EXISTS files_source ON files (source);
+            CREATE INDEX IF NOT EXISTS tests_seed ON tests (seed);
+            CREATE INDEX IF NOT EXISTS tests_source ON tests (source);
+            CREATE INDEX IF NOT EXISTS failures_vector ON failures (function, fail, message);
+            CREATE INDEX IF NOT EXISTS failures_message ON failures (message);
+            CREATE INDEX IF NOT EXISTS failures_seed ON failures (seed);
+            CREATE INDEX IF NOT EXISTS failures_source ON failures (source);
+        """)
+
+    def clear(self, source):
+        for table in ["files", "tests", "failures"]:
+            self.connection.execute("DELETE FROM " + table + " WHERE source = ?", (source,))
+
+    def add_runner_results(self, source, results):
+        self.clear(source)
+        self.connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                                    [(result["seed"], result["status"], result.get("attempts"),
+                                      result.get("duration"), source) for result in results])
+
+    def add_outcomes(self, source, outcomes):
+        self.clear(source)
+        self.connection.executemany("INSERT INTO tests VALUES (?, ?, ?, ?)",
+                                    [(seed, case, status, source) for seed, case, status, _ in outcomes])
+        self.connection.executemany("INSERT INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    [(seed, case) + failure + (source,)
+                                     for seed, case, _, failure in outcomes if failure is not None])
+
+    def query(self, function_name=None, fail=None, message=None, message_like=None, limit=None):
+        """
+        The failures of function_name (None = any), fail ("none" = the success vector, None = any) and message
+        (exact, or containing message_like), as (seed, case, op index, function name, fail, message, line)
+        """
+        conditions, values = [], []
+        if function_name is not None:
+            conditions.append("function = ?")
+            values.append(function_name)
+        if fail == "none":
+            conditions.append("fail IS NULL")
+        elif fail is not None:
+            conditions.append("fail = ?")
+            values.append(fail)
+        if message is not None:
+            conditions.append("message = ?")
+            values.append(message)
+        if message_like is not None:
+            conditions.append("message LIKE ?")
+            values.append("%" + message_like + "%")
+        sql = "SELECT seed, case_index, op_index, function, fail, message, line FROM failures"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY seed, case_index, op_index"
+        if limit is not None:
+            sql += " LIMIT " + str(int(limit))
+        return self.connection.execute(sql, values).fetchall()
+
+    def summary(self):
+        """
+        (function name, fail, message, failures, seeds) by number of failures
+        """
+        return self.connection.execute(
+            "SELECT function, fail, message, COUNT(*), COUNT(DISTINCT seed) FROM failures "
+            "GROUP BY function, fail, message ORDER BY COUNT(*) DESC").fetchall()
+
+    def counts(self):
+        return {status: count for status, count in
+                self.connection.execute("SELECT status, COUNT(*) FROM tests GROUP BY status")}
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def runner_results(text):
+    """
+    The results of runner.py if text is a results file, otherwise None
+    """
+    results = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            result = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(result, dict) or "seed" not in result or "status" not in result:
+            return None
+        results.append(result)
+    return results
+
+
+def sources(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(i for i in glob.glob(os.path.join(path, "**", "*"), recursive=True)
+                              if os.path.isfile(i))
+        else:
+            yield path
+
+
+def ingest(index, paths, line_map=None, out=sys.stderr):
+    for path in sources(paths):
+        with open(path, errors="replace") as f:
+            text = f.read()
+        source = os.path.abspath(path)
+        results = runner_results(text)
+        if results is not None:
+            index.add_runner_results(source, results)
+            out.write("%s: %d files\n" % (path, len(results)))
+            continue
+        outcomes = parse_output(text, line_map)
+        index.add_outcomes(source, outcomes)
+        out.write("%s: %d tests, %d failures\n" % (path, len(outcomes),
+                                                   sum(1 for outcome in outcomes if outcome[3] is not None)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the outcomes of test runs and query their failures")
+    subparsers = parser.add_subparsers(dest="command")
+    ingest_parser = subparsers.add_parser("ingest", help="add the outputs of test runs (mocha JSON or TAP reporter) "
+                                                         "and results files of runner.py to the index")
+    ingest_parser.add_argument("index")
+    ingest_parser.add_argument("paths", nargs="+", help="files, or directories of files, to ingest")
+    ingest_parser.add_argument("--test-dir", default=None,
+                               help="directory of the tests and of their line map (see fuzzer.py --line-map), "
+                                    "to map the failures to their operations")
+    query_parser = subparsers.add_parser("query", help="print the failures that match")
+    query_parser.add_argument("index")
+    query_parser.add_argument("--function", default=None)
+    query_parser.add_argument("--fail", default=None, help="failure vector, 'none' for the success vector")
+    query_parser.add_argument("--message", default=None, help="exact assertion message")
+    query_parser.add_argument("--message-like", default=None, help="part of the assertion message")
+    query_parser.add_argument("--seeds", action="store_true", help="print the failing seeds only")
+    query_parser.add_argument("--limit", type=int, default=None)
+    summary_parser = subparsers.add_parser("summary", help="print the number of failures by vector and message")
+    summary_parser.add_argument("index")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("a command is required")
+
+    with ResultIndex(args.index) as index:
+        if args.command == "ingest":
+            ingest(index, args.paths, LineMap(args.test_dir) if args.test_dir else None)
+        elif args.command == "query":
+            rows = index.query(args.function, args.fail, args.message, args.message_like, args.limit)
+            if args.seeds:
+                for seed in sorted(set(row[0] for row in rows)):
+                    print(seed)
+            for row in [] if args.seeds else rows:
+                print("\t".join("" if i is None else str(i) for i in row))
+        else:
+            counts = index.counts()
+            print("tests: " + ", ".join("%d %s" % (counts[i], i) for i in sorted(counts)))
+            for function_name, fail, message, failures, seeds in index.summary():
+                print("%6d failures %6d seeds  %s(%s): %s" % (failures, seeds, function_name, fail, message))
+
+
+if __name__ == '__main__':
+    main()
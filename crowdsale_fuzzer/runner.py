@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import queue
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+TEST_FILE = re.compile(r"fuzz_test\.(\d+)\.(js|json)$")
+BUNDLE_FILE = re.compile(r"fuzz_bundle\.\d+\.js(\.gz)?$")
+
+# the interpreter of the JSON op lists, which fuzzer.py installs next to them
+INTERPRETER_FILE = "fuzz_interpreter.js"
+
+# a truffle network named fuzz that connects to the node of the run, e.g. in truffle.js:
+#   fuzz: {host: "127.0.0.1", port: process.env.FUZZ_NODE_PORT, network_id: "*"}
+DEFAULT_TEST_COMMAND = "truffle test {file} --network fuzz"
+
+FAKE_NODE_COMMAND = shlex.quote(sys.executable) + " " + \
+    shlex.quote(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_node.py")) + " --port {port}"
+
+
+class InfrastructureError(Exception):
+    pass
+
+
+def test_files(test_dir):
+    """
+    The (seed, path) of every generated test of test_dir, by seed: the tests of their own (fuzz_test.<seed>.js),
+    the JSON op lists (fuzz_test.<seed>.json, see fuzzer.py --backend json) and, with a seed of None, the bundles
+    (fuzz_bundle.<n>.js), which are test files of all their tests.
+    Compressed bundles cannot be run: their tests have to be extracted first (see bundle.py).
+    """
+    files = []
+    for name in os.listdir(test_dir):
+        match = TEST_FILE.match(name)
+        if match:
+            files.append((int(match.group(1)), os.path.join(test_dir, name)))
+            continue
+        match = BUNDLE_FILE.match(name)
+        if match and match.group(1):
+            raise ValueError("cannot run the compressed bundle " + name + ": extract its tests with bundle.py")
+        if match:
+            files.append((None, os.path.join(test_dir, name)))
+    return sorted(files, key=lambda file: file_order(*file))
+
+
+def file_order(seed, path):
+    # the tests by seed, then the bundles by path
+    return seed is None, seed or 0, path
+
+
+def log_name(seed, path):
+    return (os.path.basename(path) if seed is None else str(seed)) + ".log"
+
+
+def format_command(command, **values):
+    return [i.format(**values) for i in shlex.split(command)]
+
+
+class LocalNode:
+    """
+    A local chain launched from command ({port} is replaced by the port of the node),
+    which is ready once it answers JSON-RPC requests on that port
+    """
+    def __init__(self, command, port, startup_timeout=30):
+        self.command = command
+        self.port = port
+        self.url = "http://127.0.0.1:%d" % port
+        self.startup_timeout = startup_timeout
+        self.process = None
+
+    def alive(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        request = urllib.request.Request(self.url, json.dumps({"jsonrpc": "2.0", "id": 1, "method": "net_version",
+                                                               "params": []}).encode(),
+                                         {"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=1) as response:
+                return "result" in json.loads(response.read())
+        except (OSError, ValueError):
+            return False
+
+    def start(self):
+        self.process = subprocess.Popen(format_command(self.command, port=self.port),
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + self.startup_timeout
+        while not self.alive():
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise InfrastructureError("node on port %d did not start" % self.port)
+            time.sleep(0.1)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+
+class Runner:
+    """
+    Runs test files on a pool of local nodes, one file at a time per node. Every file is run with test_command
+    ({file}, {port} and {url} are replaced by the path of the test and the port and url of its node; the port
+    and url are also in the FUZZ_NODE_PORT and FUZZ_NODE_URL environment variables). A JSON op list is run as
+    the interpreter next to it, with FUZZ_OPS_DIR and FUZZ_OP_LIST set to its directory and its name.
+    A run that exits with a zero status passes and any other status fails, unless the node died during the run:
+    that is an infrastructure failure, and the file is run again on the restarted node, up to retries times.
+    With an output_dir, the output of the last run of every file is kept in <output_dir>/<seed>.log, or
+    <output_dir>/<bundle>.log for a bundle (see results.py to index it).
+    """
+    def __init__(self, node_command, test_command, nodes=1, base_port=8545, timeout=None, retries=2,
+                 output_dir=None):
+        self.nodes = [LocalNode(node_command, base_port + i) for i in range(nodes)]
+        self.test_command = test_command
+        self.timeout = timeout
+        self.retries = retries
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+
+    def run_file(self, node, path, seed):
+        env = dict(os.environ, FUZZ_NODE_PORT=str(node.port), FUZZ_NODE_URL=node.url)
+        test_file = path
+        if path.endswith(".json"):
+            test_file = os.path.join(os.path.dirname(path), INTERPRETER_FILE)
+            env.update(FUZZ_OPS_DIR=os.path.dirname(path), FUZZ_OP_LIST=os.path.basename(path))
+        command = format_command(self.test_command, file=test_file, port=node.port, url=node.url)
+        output = subprocess.DEVNULL
+        if self.output_dir is not None:
+            output = open(os.path.join(self.output_dir, log_name(seed, path)), "w")
+        start = time.monotonic()
+        try:
+            returncode = subprocess.run(command, stdout=output, stderr=subprocess.DEVNULL, env=env,
+                                        timeout=self.timeout).returncode
+            status = "pass" if returncode == 0 else "fail"
+        except subprocess.TimeoutExpired:
+            status = "timeout"
+        finally:
+            if output is not subprocess.DEVNULL:
+                output.close()
+        duration = time.monotonic() - start
+        if status != "pass" and not node.alive():
+            raise InfrastructureError("node on port %d died while running %s" % (node.port, path))
+        return status, duration
+
+    def worker(self, node, files, results, out):
+        try:
+            node.start()
+        except InfrastructureError:
+            # leave the files to the other nodes
+            return
+        try:
+            while True:
+                try:
+                    seed, path = files.get_nowait()
+                except queue.Empty:
+                    return
+                result = {"seed": seed, "file": path, "node": node.port}
+                for attempt in range(1, self.retries + 2):
+                    result["attempts"] = attempt
+                    try:
+                        result["status"], result["duration"] = self.run_file(node, path, seed)
+                        break
+                    except InfrastructureError as e:
+                        result["status"], result["error"] = "infra", str(e)
+                        try:
+                            node.restart()
+                        except InfrastructureError:
+                            # this node is gone: put the file back for the other nodes
+                            files.put((seed, path))
+                            return
+                with self.lock:
+                    results.append(result)
+                    if out:
+                        out.write(json.dumps(result) + "\n")
+                        out.flush()
+        finally:
+            node.stop()
+
+    def run(self, files, out=None):
+        """
+        Run the (seed, path) files and return a result dict per file, also written to out as JSON lines
+        """
+        if self.output_dir is not None and not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        pending = queue.Queue()
+        for i in files:
+            pending.put(i)
+        results = []
+        threads = [threading.Thread(target=self.worker, args=(node, pending, results, out)) for node in self.nodes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if not pending.empty():
+            raise InfrastructureError("no node could run the remaining %d files" % pending.qsize())
+        return sorted(results, key=lambda result: file_order(result["seed"], result["file"]))
+
+
+def summary(results, elapsed, out=sys.stderr):
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    out.write("ran %d files in %.2fs: %s\n" % (len(results), elapsed,
+                                              ", ".join("%d %s" % (counts[i], i) for i in sorted(counts))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run generated fuzz tests on a pool of local chains")
+    parser.add_argument("test_dir", help="directory of the generated tests: fuzz_test.<seed>.js files, JSON op lists "
+                                         "or uncompressed bundles")
+    parser.add_argument("--nodes", type=int, default=os.cpu_count(), help="number of local chains")
+    parser.add_argument("--node-command", default="ganache-cli -p {port}",
+                        help="command that launches a local chain listening on {port}")
+    parser.add_argument("--fake-node", action="store_true",
+                        help="launch fake_node.py instead of a chain (to check the runner itself)")
+    parser.add_argument("--test-command", default=DEFAULT_TEST_COMMAND,
+                        help="command that runs {file} against the chain at {url} or {port} (default: %(default)s, "
+                             "whose truffle network fuzz connects to port process.env.FUZZ_NODE_PORT)")
+    parser.add_argument("--base-port", type=int, default=8545)
+    parser.add_argument("--timeout", type=float, default=None, help="timeout of a single file in seconds")
+    parser.add_argument("--retries", type=int, default=2, help="retries of a file after an infrastructure failure")
+    parser.add_argument("--results", default="results.jsonl", help="file the results are written to")
+    parser.add_argument("--output-dir", default=None,
+                        help="directory to keep the output of every file in, as <seed>.log (run the tests with the "
+                             "mocha JSON or TAP reporter to index it with results.py)")
+    args = parser.parse_args()
+    try:
+        files = test_files(args.test_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    node_command = FAKE_NODE_COMMAND if args.fake_node else args.node_command
+    runner = Runner(node_command, args.test_command, args.nodes, args.base_port, args.timeout, args.retries,
+                    args.output_dir)
+    start = time.monotonic()
+    with open(args.results, "w") as out:
+        results = runner.run(files, out)
+    summary(results, time.monotonic() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import itertools
+import sys
+
+TIME_WINDOWS = ["beforeStart", "ongoing", "afterEnd"]
+
+
+def time_window(model):
+    current_time = model.env.current_time
+    if current_time < model.startTime:
+        return "beforeStart"
+    if current_time > model.endTime:
+        return "afterEnd"
+    return "ongoing"
+
+
+def abstract_state(model):
+    """
+    The part of the model state that decides which branch of an operation is taken
+    """
+    return model.paused, model.sale_closed, model.goal_reached, model.cap_reached, time_window(model)
+
+
+def all_states():
+    """
+    Every abstract state (see abstract_state), whether the model can reach it or not
+    """
+    return [flags + (window,) for flags in itertools.product([False, True], repeat=4) for window in TIME_WINDOWS]
+
+
+def format_state(state):
+    paused, sale_closed, goal_reached, cap_reached, window = state
+    flags = [name for name, value in [("paused", paused), ("closed", sale_closed),
+                                      ("goal", goal_reached), ("cap", cap_reached)] if value]
+    return "/".join(flags + [window])
+
+
+def all_vectors(functions, excluded=()):
+    """
+    Every (function name, fail) pair that can be dispatched from functions
+    """
+    return [(f.function.__name__, fail) for f in functions for fail in f.failure_types() + [None]
+            if (f.function.__name__, fail) not in excluded]
+
+
+class CoverageScheduler:
+    """
+    Picks the next (Function, fail) to dispatch, favouring the (function, fail, abstract state) tuples
+    that have been dispatched the least often in the current abstract state of the model.
+    """
+    def __init__(self, excluded=()):
+        self.excluded = set(excluded)
+        self.counts = {}  # (function name, fail, abstract state) -> number of dispatches
+
+    def choose(self, functions, model, rng):
+        state = abstract_state(model)
+        candidates = [(f, fail) for f in functions for fail in f.failure_types() + [None]
+                      if (f.function.__name__, fail) not in self.excluded]
+        weights = [1.0 / (1 + self.counts.get((f.function.__name__, fail, state), 0)) ** 2
+                   for f, fail in candidates]
+        f, fail = rng.choices(candidates, weights)[0]
+        key = (f.function.__name__, fail, state)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return f, fail
+
+
+def merge_counts(total, counts):
+    for key, count in counts.items():
+        total[key] = total.get(key, 0) + count
+    return total
+
+
+def coverage_report(counts, vectors, out=sys.stdout):
+    """
+    Report which of the (function, fail) vectors have been dispatched in every abstract state (see all_states),
+    and which of the states were never reached
+    """
+    states = all_states()
+    reached = {key[2] for key in counts}
+    covered = {(name, fail, state) for (name, fail, state) in counts if (name, fail) in vectors}
+    out.write("coverage: %d/%d (function, fail, state) tuples over %d states, %d reached\n" %
+              (len(covered), len(vectors) * len(states), len(states), len(reached)))
+    for name, fail in vectors:
+        missing = [format_state(state) for state in states if state in reached and (name, fail, state) not in covered]
+        dispatched = sum(counts.get((name, fail, state), 0) for state in states)
+        out.write("  %-40s %6d dispatches, %2d/%d states" % (name + "(" + str(fail) + ")", dispatched,
+                                                              len(reached) - len(missing), len(states)))
+        if missing:
+            out.write(", missing in reached states: " + ", ".join(missing))
+        out.write("\n")
+    unreached = [format_state(state) for state in states if state not in reached]
+    if unreached:
+        out.write("  never reached: " + ", ".join(unreached) + "\n")
@@ -0,0 +1,205 @@
+import argparse
+import os
+import random
+import shlex
+import subprocess
+import sys
+
+import fuzzer
+from crowdsale_fuzzer import ETHER, CROWDSALE_CAP, BILLION
+from engine import ModelFailure, apply_op
+from results import LineMap, LineMapWriter, parse_output
+from triage import message_signature
+
+
+def parameter_domains(model, function_name, fail):
+    """
+    The ranges the numeric parameters of an operation must stay in, in the current state of the model,
+    for the operation to still test the same failure vector (see the *_parameters methods of CrowdsaleModel)
+    """
+    if function_name == "fallback":
+        if fail == "belowMinContribution":
+            return {"wei": (0, int(0.1 * ETHER - 1))}
+        return {"wei": (int(0.1 * ETHER), ETHER)}
+    if function_name == "set_rate":
+        if fail == "rateAbove":
+            return {"rate": (model.high_rate + 1, BILLION)}
+        if fail == "rateBelow":
+            return {"rate": (0, model.low_rate - 1)}
+        return {"rate": (model.low_rate, model.high_rate)}
+    if function_name == "owner_allocate_tokens":
+        allowance = model.token.crowdsale_allowance
+        if fail == "exceedAllowance":
+            amount_mini_qsp = (allowance + 1, allowance + BILLION)
+        else:
+            amount_mini_qsp = (0, allowance)
+        return {"amount_mini_qsp": amount_mini_qsp, "amount_wei": (0, CROWDSALE_CAP)}
+    return {}
+
+
+def consistent(sequence):
+    """
+    Whether every operation of the sequence still applies to the model, without crashing,
+    and with parameters that stay within the ranges of its failure vector
+    """
+    model = fuzzer.new_model(random.Random(0))
+    for index, (function_name, fail, parameters) in enumerate(sequence):
+        for key, (low, high) in parameter_domains(model, function_name, fail).items():
+            if not low <= parameters[key] <= high:
+                return False
+        try:
+            if apply_op(model, index, function_name, fail, parameters, invariants=()) is None:
+                return False
+        except ModelFailure:
+            return False
+    return True
+
+
+def simpler_values(value, low, high):
+    """
+    Candidate replacements for value, simplest first: the bounds of its range, then value rounded to
+    one significant digit
+    """
+    candidates = [low, high]
+    value = int(value)
+    if value > 0:
+        magnitude = 10 ** (len(str(value)) - 1)
+        candidates.append(value // magnitude * magnitude)
+    return [i for i in candidates if low <= i <= high and i != value]
+
+
+class Shrinker:
+    """
+    Delta-debugs a failing sequence of (function name, fail, parameters). Every candidate is checked against
+    the model first (see consistent), and only consistent candidates are given to the oracle, which decides
+    whether the candidate still fails on chain.
+    """
+    def __init__(self, oracle):
+        self.oracle = oracle
+        self.results = {}
+        self.oracle_runs = 0
+
+    def fails(self, sequence):
+        key = repr(sequence)
+        if key not in self.results:
+            if consistent(sequence):
+                self.oracle_runs += 1
+                self.results[key] = self.oracle(sequence)
+            else:
+                self.results[key] = False
+        return self.results[key]
+
+    def drop_ops(self, sequence):
+        n = 2
+        while len(sequence) >= 2:
+            chunk = -(-len(sequence) // n)
+            subsets = [sequence[i:i + chunk] for i in range(0, len(sequence), chunk)]
+            for i in range(len(subsets)):
+                complement = [op for j, subset in enumerate(subsets) if j != i for op in subset]
+                if self.fails(complement):
+                    sequence = complement
+                    n = max(n - 1, 2)
+                    break
+            else:
+                if n >= len(sequence):
+                    break
+                n = min(n * 2, len(sequence))
+        return sequence
+
+    def simplify_parameters(self, sequence):
+        for index in range(len(sequence)):
+            # the ranges depend on the state reached by the prefix of the sequence
+            model = fuzzer.new_model(random.Random(0))
+            for prefix_index, (function_name, fail, parameters) in enumerate(sequence[:index]):
+                apply_op(model, prefix_index, function_name, fail, parameters, invariants=())
+            function_name, fail, parameters = sequence[index]
+            for key, (low, high) in parameter_domains(model, function_name, fail).items():
+                for value in simpler_values(sequence[index][2][key], low, high):
+                    candidate = list(sequence)
+                    candidate[index] = (function_name, fail, dict(sequence[index][2], **{key: value}))
+                    if self.fails(candidate):
+                        sequence = candidate
+                        break
+        return sequence
+
+    def shrink(self, sequence):
+        if not self.fails(sequence):
+            raise ValueError("the sequence does not fail")
+        sequence = self.drop_ops(sequence)
+        return self.simplify_parameters(sequence)
+
+
+class ChainOracle:
+    """
+    Emits a candidate as a test file and runs command on it ({file} is replaced by the path of the test).
+    The output of command must be a report that results.py parses (the mocha JSON or TAP reporter).
+    The first sequence the oracle runs is the failing one (see Shrinker.shrink), and a candidate only fails if it
+    fails like it: its first failure is at an operation of the same function and fail vector, with the same
+    message up to its numbers (see triage.message_signature). A candidate that fails some other way has lost
+    the failure, e.g. because the model and the chain diverged.
+    """
+    def __init__(self, command, out_dir, seed, timeout=None):
+        self.command = command
+        self.out_file = os.path.join(out_dir, "fuzz_test." + str(seed) + ".shrink.js")
+        self.seed = seed
+        self.timeout = timeout
+        self.failure = None  # (function name, fail, message signature) of the failing sequence
+
+    def run(self, sequence):
+        """
+        The (function name, fail, message signature) of the first failure of the test of sequence,
+        or None if it passes or times out
+        """
+        with open(self.out_file, "w") as out:
+            lines = LineMapWriter(out)
+            fuzzer.gen_sequence_file(lines, sequence, self.seed)
+        command = [i.replace("{file}", self.out_file) for i in shlex.split(self.command)]
+        try:
+            completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                       universal_newlines=True, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            return None
+        if completed.returncode == 0:
+            return None
+        outcomes = parse_output(completed.stdout, LineMap(entries=[lines.entry(self.seed)]))
+        for _, _, _, failure in outcomes:
+            if failure is not None:
+                _, function_name, fail, message, _ = failure
+                return function_name, fail, message_signature(message)
+        if self.failure is None:
+            raise ValueError("the test fails but the output of the command reports no failure: run it with the "
+                             "mocha JSON or TAP reporter")
+        return None
+
+    def __call__(self, sequence):
+        failure = self.run(sequence)
+        if self.failure is None:
+            self.failure = failure
+            return failure is not None
+        return failure == self.failure
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shrink the op sequence of a failing fuzz test")
+    parser.add_argument("--seed", type=int, required=True, help="seed of the failing test")
+    parser.add_argument("--ops", type=int, default=None, help="number of ops of the failing random test")
+    parser.add_argument("--command", default="truffle test {file}",
+                        help="command that runs a test file, exits with a non-zero status if it fails and reports "
+                             "its failures with the mocha JSON or TAP reporter")
+    parser.add_argument("--out-dir", default=fuzzer.SUB_TEST_DIR)
+    parser.add_argument("--timeout", type=float, default=None, help="timeout of a single run in seconds")
+    args = parser.parse_args()
+
+    sequence = fuzzer.record_sequence(args.seed, args.ops)
+    shrinker = Shrinker(ChainOracle(args.command, args.out_dir, args.seed, args.timeout))
+    shrunk = shrinker.shrink(sequence)
+    out_file = os.path.join(args.out_dir, "fuzz_test." + str(args.seed) + ".min.js")
+    fuzzer.write_sequence_file(out_file, shrunk, args.seed)
+    sys.stderr.write("shrunk %d ops to %d with %d runs\n" % (len(sequence), len(shrunk), shrinker.oracle_runs))
+    for op in shrunk:
+        sys.stderr.write("  %s\n" % (op,))
+    print(out_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+class Accounts:
+    """
+    Interned account names: every name gets a small index, in the order in which the names are first seen,
+    and the balance vectors of the token and the crowdsale are lists indexed by it
+    """
+    __slots__ = ("names", "indices")
+
+    def __init__(self, names=()):
+        self.names = []
+        self.indices = {}
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        index = self.indices.get(name)
+        if index is None:
+            index = self.indices[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def name(self, index):
+        return self.names[index]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.indices
+
+
+def credit(vector, index, amount):
+    """
+    Add amount to vector[index], growing the vector with zeros if the account is new to it
+    """
+    if index >= len(vector):
+        vector.extend([0] * (index + 1 - len(vector)))
+    vector[index] += amount
+
+
+def vector_key(vector):
+    # trailing zeros are accounts that have not been credited yet
+    end = len(vector)
+    while end and not vector[end - 1]:
+        end -= 1
+    return tuple(vector[:end])
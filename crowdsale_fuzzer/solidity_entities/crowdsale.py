@@ -1,17 +1,20 @@
-import random
+from solidity_entities.crowdsale_model import CrowdsaleModel
+from test_writer import wrap_exception, gen_assert_equal, gen_big_int, gen_log, fragments, wrap_reads, \
+    wrap_batched_reads, balance_assertion_check, goal_and_cap_assertion_checks, check_value, \
+    wrap_ether_balance_checks, gen_user_str, token_balance_read, sale_balance_read, allowance_read, \
+    amount_raised_read, ether_balance_read, GOAL_AND_CAP_READS, field, template, batched_reads
 
-import sys
+# the assertions of the tests, from the cheapest:
+#   none: only the transactions, and that the failing ones fail
+#   final: the state of the sale and the token balances at the end of every test case (see final_checks)
+#   op: the effect of every operation, read before and after it
+#   paranoid: op, and the whole state after every operation
+ASSERTION_LEVELS = ["none", "final", "op", "paranoid"]
 
-from crowdsale_fuzzer import ETHER, CROWDSALE_CAP, BILLION
-from solidity_entities.environment import SolidityEnvironment
-from solidity_entities.function import Function
-from solidity_entities.token import Token
-from test_writer import wrap_exception, gen_assert_equal, gen_big_int, gen_log, \
-    wrap_token_balance_checks, wrap_sale_balance_checks, wrap_allowance_checks, balance_assertion_check, \
-    goal_and_cap_assertion_checks, wrap_amount_raised, check_value, wrap_ether_balance_checks, gen_user_str
 
+class CrowdsaleFuzzer(CrowdsaleModel):
+    __slots__ = ("verbosity", "batch_reads", "assertions")
 
-class CrowdsaleFuzzer:
     def __init__(self,
                  random_number_generator,
                  solidity_environment,
@@ -26,145 +29,182 @@ class CrowdsaleFuzzer:
                  start,
                  duration_in_minutes,
                  rate_qsp_to_ether,
-                 verbosity):
-        self.rng = random_number_generator
-        self.env = solidity_environment
-        self.env.current_time = start
-        self.token = token
+                 verbosity,
+                 batch_reads=False,
+                 assertions="op"):
+        if assertions not in ASSERTION_LEVELS:
+            raise ValueError("unknown assertion level: " + str(assertions))
         self.verbosity = verbosity
-
-        assert isinstance(self.rng, random.Random)
-        assert isinstance(self.env, SolidityEnvironment)
-        assert isinstance(self.token, Token)
-
-        self.all_users = users
-        self.owner = owner
-        self.beneficiary = beneficiary
-        self.token_admin = token_admin
-        self.basic_users = [i for i in self.all_users if i not in [self.owner, self.beneficiary, self.token_admin]]
-        self.non_owner_users = [i for i in self.all_users if i != self.owner]
-        self.bad_destinations = ["sale.address", "0x0", "token.owner()", self.token_admin, "token.address"]
-
-        self.funding_goal = funding_goal_in_ethers * ETHER
-        self.funding_cap = funding_cap_in_ethers * ETHER
-        self.minContribution = minimum_contribution_in_wei
-        self.startTime = start
-        self.endTime = start + duration_in_minutes * 60
-        self.rate = rate_qsp_to_ether
-
-        # other state variables
-        self.sale_closed = False
-        self.paused = False
-        self.amount_raised = 0
-        self.refund_amount = 0
-        self.balance = {}  # how much each donor has contributed to the crowdsale
-        self.low_rate = 5000
-        self.high_rate = 10000
-        self.goal_reached = (self.amount_raised >= self.funding_goal)
-        self.cap_reached = (self.amount_raised >= self.funding_cap)
-        self.functions = self.gen_functions()
-
-    def update_state_for_new_contract(self, beneficiary, funding_goal_in_ethers, funding_cap_in_ethers,
-                                      minimum_contribution_in_wei, start, duration_in_minutes, rate_qsp_to_ether):
-        self.beneficiary = beneficiary
-
-        self.funding_goal = funding_goal_in_ethers * ETHER
-        self.funding_cap = funding_cap_in_ethers * ETHER
-        self.minContribution = minimum_contribution_in_wei
-        self.startTime = start
-        self.endTime = start + duration_in_minutes * 60
-        self.rate = rate_qsp_to_ether
-
-        # other state variables
-        self.sale_closed = False
-        self.paused = False
-        self.amount_raised = 0
-        self.refund_amount = 0
-        self.balance = {}  # how much each donor has contributed to the crowdsale
-        self.goal_reached = (self.amount_raised >= self.funding_goal)
-        self.cap_reached = (self.amount_raised >= self.funding_cap)
-        self.functions = self.gen_functions()
+        # issue the state reads around a transaction as one Promise.all before and one after it
+        self.batch_reads = batch_reads
+        self.assertions = assertions
+        super().__init__(random_number_generator, solidity_environment, token, users, owner, beneficiary, token_admin,
+                         funding_goal_in_ethers, funding_cap_in_ethers, minimum_contribution_in_wei, start,
+                         duration_in_minutes, rate_qsp_to_ether)
 
     def create_new_crowdsale(self, params, set_crowdsale=True):
-        self.update_state_for_new_contract(*params)
+        super().create_new_crowdsale(params, set_crowdsale)
         params = ", ".join([str(i) for i in params])
-        s = "sale = await QuantstampSaleMock.new(" + params + ", token_address);\n"
+        s = ["sale = await QuantstampSaleMock.new(" + params + ", token_address);\n"]
         if set_crowdsale:
-            s += "await token.setCrowdsale(sale.address, 0);\n"
+            s.append("await token.setCrowdsale(sale.address, 0);\n")
         return s
 
-    def update_state_with_purchase(self, user, wei, mini_qsp):
-        # update amount raised, the allowance of the crowdsale, and the balance of user in token and sale
-        # if mini_qsp is None, then mini_qsp = wei * rate
-        if mini_qsp:
-            mini_qsp = int(mini_qsp)
-        else:
-            mini_qsp = wei * self.rate
-        self.amount_raised += wei
-        self.token.crowdsale_allowance -= mini_qsp
-        self.token.balances[user] = self.token.balances.get(user, 0) + mini_qsp
-        self.balance[user] = self.balance.get(user, 0) + wei
-        # update goal and cap if exceeded
-
-        if self.amount_raised > self.funding_goal:
-            self.goal_reached = True
-        if self.amount_raised > self.funding_cap:
-            self.cap_reached = True
-
-    def gen_functions(self):
-        """
-        Generate function signatures for testing vectors
-        """
-        return [
-            Function(self.terminate, ["onlyOwner"], None),
-            Function(self.set_rate, ["onlyOwner"], ["rateAbove", "rateBelow"]),
-            Function(self.owner_allocate_tokens, ["onlyOwner", "validDestination"], ["exceedAllowance"]),
-            Function(self.owner_unlock_fund, ["onlyOwner", "afterDeadline"], None),
-            Function(self.fallback, ["whenNotPaused", "beforeDeadline", "saleNotClosed"])
-        ]
-
     @staticmethod
     def check_time():
-        s = "var currTime = await sale._now();\n"
-        s += gen_log("'Time: ' + currTime")
-        return s
+        return ["var currTime = await sale._now();\n", gen_log("'Time: ' + currTime")]
 
     @staticmethod
     def check_sale_state():
-        s = gen_log("'================'")
-        s += gen_log("'Crowdsale State:'")
-        s += gen_log("")
-        s += check_value("amountRaised", "sale.amountRaised()")
-        s += check_value("refundAmount", "sale.refundAmount()")
-        s += check_value("paused", "sale.paused()")
-        s += check_value("saleClosed", "sale.saleClosed()")
-        s += check_value("fundingGoalReached", "sale.fundingGoalReached()")
-        s += check_value("fundingCapReached", "sale.fundingCapReached()")
-        s += check_value("rate", "sale.rate()")
-        s += check_value("startTime", "sale.startTime()")
-        s += check_value("currentTime", "sale.currentTime()")
-        s += check_value("endTime", "sale.endTime()")
-        s += check_value("crowdsaleOngoing", "(startTime <= currentTime && currentTime <= endTime)")
-
-        s += gen_log("'----------------'")
+        yield gen_log("'================'")
+        yield gen_log("'Crowdsale State:'")
+        yield gen_log("")
+        yield from check_value("amountRaised", "sale.amountRaised()")
+        yield from check_value("refundAmount", "sale.refundAmount()")
+        yield from check_value("paused", "sale.paused()")
+        yield from check_value("saleClosed", "sale.saleClosed()")
+        yield from check_value("fundingGoalReached", "sale.fundingGoalReached()")
+        yield from check_value("fundingCapReached", "sale.fundingCapReached()")
+        yield from check_value("rate", "sale.rate()")
+        yield from check_value("startTime", "sale.startTime()")
+        yield from check_value("currentTime", "sale.currentTime()")
+        yield from check_value("endTime", "sale.endTime()")
+        yield from check_value("crowdsaleOngoing", "(startTime <= currentTime && currentTime <= endTime)")
+
+        yield gen_log("'----------------'")
+
+    def op_checks(self):
+        return self.assertions == "op" or self.assertions == "paranoid"
+
+    def start_reads(self):
+        """
+        The (var name, read) pairs of the values that the model only knows relative to the start of a test case:
+        the token balances of the users and the allowance of the crowdsale
+        """
+        return ([("start_token_balance_" + user, token_balance_read(user)) for user in self.all_users] +
+                [("start_crowdsale_allowance", allowance_read("sale.address"))])
 
-        return s
+    def start_checks(self):
+        """
+        The reads at the start of a test case that final_checks compares with, or None without final checks
+        """
+        if self.assertions == "none" or self.assertions == "op":
+            return None
+        return batched_reads(self.start_reads())
 
-    def only_owner(self, function_name, error_message, parameters):
-        # instantiate parameters locally
-        if not parameters:
-            parameters = {}
+    def final_checks(self):
+        """
+        Assert that the sale and the token are in the state of the model: the token balances and the allowance
+        of the crowdsale have changed by what the model credited since start_checks, and the sale has the
+        balances and fields of the model
+        """
+        reads = []
+        for user in self.all_users:
+            reads.append(("final_token_balance_" + user, token_balance_read(user)))
+            reads.append(("final_sale_balance_" + user, sale_balance_read(user)))
+        reads += [("final_crowdsale_allowance", allowance_read("sale.address")),
+                  ("final_amount_raised", amount_raised_read()), ("final_rate", "sale.rate()"),
+                  ("final_paused", "sale.paused()"), ("final_sale_closed", "sale.saleClosed()")]
+        yield batched_reads(reads + GOAL_AND_CAP_READS)
+
+        for user in self.all_users:
+            account = self.accounts.intern(user)
+            token_balance = self.token.balances[account] if account < len(self.token.balances) else 0
+            sale_balance = self.balance[account] if account < len(self.balance) else 0
+            yield gen_assert_equal("start_token_balance_" + user + ".add(" + gen_big_int("'" + str(token_balance) +
+                                                                                       "'") + ")",
+                                   "final_token_balance_" + user,
+                                   "the token balance of " + user + " should be the one of the model")
+            yield gen_assert_equal(gen_big_int("'" + str(sale_balance) + "'"), "final_sale_balance_" + user,
+                                   "the sale balance of " + user + " should be the one of the model")
+        sold = self.token.initial_crowdsale_allowance - self.token.crowdsale_allowance
+        yield gen_assert_equal("start_crowdsale_allowance.minus(" + gen_big_int("'" + str(sold) + "'") + ")",
+                               "final_crowdsale_allowance",
+                               "the allowance of the crowdsale should be the one of the model")
+        yield gen_assert_equal(gen_big_int("'" + str(self.amount_raised) + "'"), "final_amount_raised",
+                               "the amountRaised should be the one of the model")
+        yield gen_assert_equal(gen_big_int(str(self.rate)), "final_rate", "the rate should be the one of the model")
+        if self.paused:
+            yield "assert(final_paused, 'the sale should be paused');\n"
+        else:
+            yield "assert(!final_paused, 'the sale should not be paused');\n"
+        if self.sale_closed:
+            yield "assert(final_sale_closed, 'the sale should be closed');\n"
+        else:
+            yield "assert(!final_sale_closed, 'the sale should not be closed');\n"
+        yield from goal_and_cap_assertion_checks(self.goal_reached, self.cap_reached, read=False)
 
-        user = parameters.get("user", self.rng.choice(self.non_owner_users))
-        # end parameter instantiation
+    def paranoid_checks(self):
+        """
+        The final checks of the state right after an operation. They are built now rather than when the code of
+        the operation is written, which may be after later operations (see fuzzer.gen_predefined_test).
+        """
+        return list(self.final_checks())
 
-        user_str = gen_user_str(user)
-        s = "await " + function_name + "(" + user_str + ");"
-        s = wrap_exception(s, error_message)
-        return s
+    def checkpoint(self, label):
+        """
+        Assert that the sale and the token are in the state of the model, as final_checks does, but with the
+        values read at once and compared as a single string (see test_writer.gen_checkpoint_helpers).
+        The start values are the ones of start_reads.
+        """
+        start_reads = self.start_reads()
+        reads = ([read for _, read in start_reads] + [sale_balance_read(user) for user in self.all_users] +
+                 [amount_raised_read(), "sale.rate()", "sale.paused()", "sale.saleClosed()"] +
+                 [read for _, read in GOAL_AND_CAP_READS])
+        return ("var checkpoint = await Promise.all([" + ", ".join(reads) + "]);\n"
+                "assert.equal(checkpointState([" + ", ".join([var_name for var_name, _ in start_reads]) +
+                "], checkpoint), '" + ",".join(self.checkpoint_values()) + "', '" + label +
+                ": the state should be the one of the model');\n")
+
+    def end_checks(self):
+        """
+        The checks at the end of a test case, or None if there are none
+        (with paranoid assertions, the last operation has already checked the final state)
+        """
+        if self.assertions == "final":
+            return self.final_checks()
+        return None
+
+    @staticmethod
+    def only_owner(function_name, error_message):
+        # the caller has already been instantiated by the parameters of the function (see CrowdsaleModel)
+        s = "await " + function_name + "(" + field("user_str") + ");"
+        return wrap_exception(s, error_message)
+
+    def balance_checks(self, s, checks):
+        """
+        Read the values of checks, a list of (var name, read, left operation, error message), before and after s,
+        and assert that every value after s equals its value before s with left operation applied;
+        then check the goalReached and capReached fields
+        """
+        if self.batch_reads:
+            s = wrap_batched_reads(s, [(vid, read) for vid, read, _, _ in checks], GOAL_AND_CAP_READS)
+            return fragments(s, [balance_assertion_check(vid, left_operation, error_message)
+                                 for vid, _, left_operation, error_message in checks],
+                             goal_and_cap_assertion_checks(self.goal_reached, self.cap_reached, read=False))
+        for vid, read, left_operation, error_message in checks:
+            s = wrap_reads(s, vid, read)
+            s = fragments(s, balance_assertion_check(vid, left_operation, error_message))
+        return fragments(s, goal_and_cap_assertion_checks(self.goal_reached, self.cap_reached))
+
+    @staticmethod
+    def log_call(function_name):
+        return gen_log("'About to call " + function_name + " with parameters: " + field("parameters") + "'")
+
+    def emit(self, template, parameters, values):
+        if self.verbosity:
+            values["parameters"] = str(parameters).replace("'", "")
+        if self.assertions == "paranoid":
+            return fragments(template.fill(values), self.paranoid_checks())
+        return template.fill(values)
 
     # -------------------------------------------------------------------------------------------------------
     # Crowdsale Functions
+    #
+    # Every function applies the operation to the model (see CrowdsaleModel) and returns the test code of the
+    # operation, or None when there is nothing to emit. The code is filled into a template that is built by
+    # the *_template method of the operation the first time the same branch of the operation is taken
+    # (see test_writer.template); the fields of the templates are the values the code depends on.
     # -------------------------------------------------------------------------------------------------------
 
     def set_pause(self, fail=None, parameters=None):
@@ -172,83 +212,73 @@ class CrowdsaleFuzzer:
         :param fail: onlyOwner
         :param parameters: user, pause
         """
-        if not parameters:
-            parameters = {}
-        if fail:
-            parameters["user"] = parameters.get("user", self.rng.choice(self.non_owner_users))
-        else:
-            parameters["user"] = parameters.get("user", "owner")
-        parameters["pause"] = parameters.get("pause", self.rng.choice([True, False]))
-
-        user = parameters["user"]
-        user_str = gen_user_str(user)
+        parameters = super().set_pause(fail, parameters)
         pause = parameters["pause"]
-        # end parameter instantiation
+        t = template(("set_pause", fail, self.verbosity, self.assertions, bool(pause)), self.set_pause_template,
+                     fail, pause)
+        return self.emit(t, parameters, {"user_str": gen_user_str(parameters["user"])})
 
+    def set_pause_template(self, fail, pause):
+        s = []
         if self.verbosity:
-            s = gen_log("'About to call pause with parameters: " + str(parameters).replace("'", "") + "'")
-        else:
-            s = ""
+            s.append(self.log_call("pause"))
 
         if pause:
-            s += "await sale.pause(" + user_str + ");\n"
-            self.paused = True
+            s.append("await sale.pause(" + field("user_str") + ");\n")
         else:
-            s += "await sale.unpause(" + user_str + ");\n"
-            self.paused = False
+            s.append("await sale.unpause(" + field("user_str") + ");\n")
 
         if not fail:
+            if not self.op_checks():
+                return s
             if pause:
-                s += "await sale.pause(" + user_str + ");\n"
-                s += "var is_paused = await sale.paused();\n"
-                s += "assert(is_paused, 'sale should be paused after owner pauses it');"
-                self.paused = True
+                s.append("await sale.pause(" + field("user_str") + ");\n")
+                s.append("var is_paused = await sale.paused();\n")
+                s.append("assert(is_paused, 'sale should be paused after owner pauses it');")
             else:
-                s += "await sale.unpause(" + user_str + ");\n"
-                s += "var is_paused = await sale.paused();\n"
-                s += "assert(!is_paused, 'sale should be unpaused after owner unpauses it');"
-                self.paused = False
+                s.append("await sale.unpause(" + field("user_str") + ");\n")
+                s.append("var is_paused = await sale.paused();\n")
+                s.append("assert(!is_paused, 'sale should be unpaused after owner unpauses it');")
         else:
             if pause:
-                s += self.only_owner("sale.pause", "only the owner can pause the crowd sale", parameters)
+                s = fragments(s, self.only_owner("sale.pause", "only the owner can pause the crowd sale"))
             else:
-                s += self.only_owner("sale.unpause", "only the owner can unpause the crowd sale", parameters)
+                s = fragments(s, self.only_owner("sale.unpause", "only the owner can unpause the crowd sale"))
         return s
 
     def change_time(self, time):
-        s = "await sale.changeTime (" + str(time) + ", {from: owner});"
-        self.env.current_time = time
-        return s
+        super().change_time(time)
+        t = template(("change_time",), self.change_time_template)
+        if self.assertions == "paranoid":
+            return fragments(t.fill({"time": str(time)}), self.paranoid_checks())
+        return t.fill({"time": str(time)})
+
+    @staticmethod
+    def change_time_template():
+        return "await sale.changeTime (" + field("time") + ", {from: owner});"
 
     def terminate(self, fail=None, parameters=None):
         """
         :param fail: onlyOwner
         :param parameters: user
         """
-        if not parameters:
-            parameters = {}
-        if fail:
-            parameters["user"] = parameters.get("user", self.rng.choice(self.non_owner_users))
-        else:
-            parameters["user"] = parameters.get("user", "owner")
-
-        user = parameters["user"]
-        # end parameter instantiation
+        parameters = super().terminate(fail, parameters)
+        t = template(("terminate", fail, self.verbosity, self.assertions), self.terminate_template, fail)
+        return self.emit(t, parameters, {"user_str": gen_user_str(parameters["user"])})
 
+    def terminate_template(self, fail):
+        s = []
         if self.verbosity:
-            s = gen_log("'About to call terminate with parameters: " + str(parameters).replace("'", "") + "'")
-        else:
-            s = ""
+            s.append(self.log_call("terminate"))
 
         if not fail:
             # run as the owner
-            user_str = gen_user_str(user)
-            s += "await sale.terminate(" + user_str + ");\n"
-            s += "var closed = await sale.saleClosed();\n"
-            s += "assert(closed, 'sale should be closed after owner terminates it');"
-            self.sale_closed = True
+            s.append("await sale.terminate(" + field("user_str") + ");\n")
+            if self.op_checks():
+                s.append("var closed = await sale.saleClosed();\n")
+                s.append("assert(closed, 'sale should be closed after owner terminates it');")
         else:
-            s += self.only_owner("sale.terminate", "only the owner can terminate the crowd sale", parameters)
+            s = fragments(s, self.only_owner("sale.terminate", "only the owner can terminate the crowd sale"))
         return s
 
     def owner_unlock_fund(self, fail=None, parameters=None):
@@ -256,41 +286,26 @@ class CrowdsaleFuzzer:
         :param fail: onlyOwner, afterDeadline
         :param parameters: user
         """
-        if not parameters:
-            parameters = {}
-        if fail == "onlyOwner":
-            parameters["user"] = parameters.get("user", self.rng.choice(self.non_owner_users))
-        else:
-            parameters["user"] = parameters.get("user", "owner")
-        if fail == "afterDeadline":
-            sys.exit("TODO afterDeadline")
-        elif not fail:
-            parameters["user"] = parameters.get("user", "owner")
-        else:
-            sys.exit("Missing case in ownerUnlockFund")
-
-        user = parameters["user"]
-        # end parameter instantiation
+        parameters = super().owner_unlock_fund(fail, parameters)
+        t = template(("owner_unlock_fund", fail, self.verbosity, self.assertions), self.owner_unlock_fund_template,
+                     fail)
+        return self.emit(t, parameters, {"user_str": gen_user_str(parameters["user"])})
 
+    def owner_unlock_fund_template(self, fail):
+        s = []
         if self.verbosity:
-            s = gen_log("'About to call ownerUnlockFund with parameters: " + str(parameters).replace("'", "") + "'")
-        else:
-            s = ""
+            s.append(self.log_call("ownerUnlockFund"))
 
         if not fail:
             # run as the owner
-            user_str = gen_user_str(user)
-            s += "await sale.ownerUnlockFund(" + user_str + ");\n"
-            s += "var goal_reached = await sale.fundingGoalReached();\n"
-            s += "assert(goal_reached, 'fundingGoalReached should be false after calling, allowing users to withdraw');"
-            self.sale_closed = True
+            s.append("await sale.ownerUnlockFund(" + field("user_str") + ");\n")
+            if self.op_checks():
+                s.append("var goal_reached = await sale.fundingGoalReached();\n")
+                s.append("assert(goal_reached, "
+                         "'fundingGoalReached should be false after calling, allowing users to withdraw');")
         elif fail == "onlyOwner":
-            s += self.only_owner("sale.ownerUnlockFund",
-                                 "only the owner can unlock funds from the crowd sale",
-                                 parameters)
-        elif fail == "afterDeadline":
-            # TODO
-            sys.exit("TODO afterDeadline")
+            s = fragments(s, self.only_owner("sale.ownerUnlockFund",
+                                             "only the owner can unlock funds from the crowd sale"))
         return s
 
     def set_rate(self, fail=None, parameters=None):
@@ -298,43 +313,31 @@ class CrowdsaleFuzzer:
         :param fail: onlyOwner, rateAbove, rateBelow
         :param parameters: user, rate
         """
-        if not parameters:
-            parameters = {}
-        if fail == "onlyOwner":
-            parameters["user"] = parameters.get("user", self.rng.choice(self.non_owner_users))
-        else:
-            parameters["user"] = parameters.get("user", "owner")
-        if fail == "rateAbove":
-            parameters["rate"] = parameters.get("rate", self.rng.randint(self.high_rate + 1, BILLION))
-        elif fail == "rateBelow":
-            parameters["rate"] = parameters.get("rate", self.rng.randint(0, self.low_rate - 1))
-        else:
-            parameters["rate"] = parameters.get("rate", self.rng.randint(self.low_rate, self.high_rate))
-
-        user = parameters["user"]
-        rate = parameters["rate"]
-        user_str = gen_user_str(user)
-        # end parameter instantiation
+        parameters = super().set_rate(fail, parameters)
+        t = template(("set_rate", fail, self.verbosity, self.assertions), self.set_rate_template, fail)
+        return self.emit(t, parameters, {"rate": str(parameters["rate"]), "current_rate": str(self.rate),
+                                         "user_str": gen_user_str(parameters["user"])})
 
+    def set_rate_template(self, fail):
+        s = []
         if self.verbosity:
-            s = gen_log("'About to call setRate with parameters: " + str(parameters).replace("'", "") + "'")
-        else:
-            s = ""
+            s.append(self.log_call("setRate"))
 
         if not fail:
             # run as the owner
-            s += "await sale.setRate(" + str(rate) + ", " + user_str + ");\n"
-            s += "var currentRate = await sale.rate();\n"
-            s += gen_assert_equal("currentRate", rate, "the rate should be set to the new value")
-            self.rate = rate
+            s.append("await sale.setRate(" + field("rate") + ", " + field("user_str") + ");\n")
+            if self.op_checks():
+                s.append("var currentRate = await sale.rate();\n")
+                s.append(gen_assert_equal("currentRate", field("rate"), "the rate should be set to the new value"))
         elif fail == "onlyOwner":
-            s += self.only_owner("sale.setRate", "only the owner can set the rate", parameters)
+            s = fragments(s, self.only_owner("sale.setRate", "only the owner can set the rate"))
         elif fail == "rateAbove" or fail == "rateBelow":
-            s += "await sale.setRate(" + str(rate) + ", " + user_str + ");\n"
+            s.append("await sale.setRate(" + field("rate") + ", " + field("user_str") + ");\n")
             s = wrap_exception(s, "the new rate must be within the bounds")
-        if fail:
-            s += "var currentRate = await sale.rate();\n"
-            s += gen_assert_equal("currentRate", self.rate, "the rate should not have changed")
+        if fail and self.op_checks():
+            s = fragments(s,
+                          "var currentRate = await sale.rate();\n",
+                          gen_assert_equal("currentRate", field("current_rate"), "the rate should not have changed"))
         return s
 
     def owner_safe_withdrawal(self, fail=None, parameters=None):
@@ -342,204 +345,169 @@ class CrowdsaleFuzzer:
         :param fail: onlyOwner
         :param parameters: user
         """
-        if not parameters:
-            parameters = {}
-        if fail == "onlyOwner":
-            parameters["user"] = parameters.get("user", self.rng.choice(self.non_owner_users))
-        else:
-            parameters["user"] = parameters.get("user", "owner")
+        parameters = super().owner_safe_withdrawal(fail, parameters)
+        t = template(("owner_safe_withdrawal", fail, self.verbosity, self.assertions, self.goal_reached,
+                      self.batch_reads), self.owner_safe_withdrawal_template, fail)
+        return self.emit(t, parameters, {"user_str": gen_user_str(parameters["user"])})
 
-        user = parameters["user"]
-        user_str = gen_user_str(user)
-        # end parameter instantiation
+    def owner_safe_withdrawal_template(self, fail):
+        s = []
         if self.verbosity:
-            s = gen_log("'About to call ownerSafeWithdrawal with parameters: " + str(parameters).replace("'", "") + "'")
-        else:
-            s = ""
+            s.append(self.log_call("ownerSafeWithdrawal"))
 
         if fail == "onlyOwner":
-            s += self.only_owner("sale.ownerSafeWithdrawal", "only the owner can can ownerSafeWithdrawal", parameters)
+            s = fragments(s, self.only_owner("sale.ownerSafeWithdrawal",
+                                             "only the owner can can ownerSafeWithdrawal"))
         elif not self.goal_reached:
-            s += "await sale.ownerSafeWithdrawal(" + user_str + ");\n"
+            s.append("await sale.ownerSafeWithdrawal(" + field("user_str") + ");\n")
             s = wrap_exception(s, "cannot call ownerSafeWithdrawal before the goal is reached")
-        elif not fail:
-            s += "await sale.ownerSafeWithdrawal(" + user_str + ");\n"
+        else:
+            s.append("await sale.ownerSafeWithdrawal(" + field("user_str") + ");\n")
+            if not self.op_checks():
+                return s
             # assert that the contract ether balance is zero
-            s = wrap_ether_balance_checks(s, "sale.address", "sale_ether")
-            s = wrap_ether_balance_checks(s, "beneficiary", "beneficiary_ether")
+            if self.batch_reads:
+                s = wrap_batched_reads(s, [("beneficiary_ether", ether_balance_read("beneficiary")),
+                                           ("sale_ether", ether_balance_read("sale.address"))])
+            else:
+                s = wrap_ether_balance_checks(s, "sale.address", "sale_ether")
+                s = wrap_ether_balance_checks(s, "beneficiary", "beneficiary_ether")
 
             # assert that the beneficiary's ether balance is increased
-            s += gen_assert_equal("beneficiary_ether_before.plus(sale_ether_before)",
-                                  "beneficiary_ether_after",
-                                  "the beneficiary should have gained the ether " +
-                                  "from the sale after ownerSafeWithdrawal")
-            return s
-        else:
-            sys.exit("Missing case in ownerSafeWithdrawal")
+            s = fragments(s, gen_assert_equal("beneficiary_ether_before.plus(sale_ether_before)",
+                                              "beneficiary_ether_after",
+                                              "the beneficiary should have gained the ether " +
+                                              "from the sale after ownerSafeWithdrawal"))
         return s
 
     def owner_allocate_tokens(self, fail=None, parameters=None):
         """
-        :param fail: belowMinContribution, validDestination
-        :param parameters: user, wei
+        :param fail: onlyOwner, validDestination, exceedAllowance
+        :param parameters: user, to_user, amount_mini_qsp, amount_wei
         """
-        if not parameters:
-            parameters = {}
-        if fail == "onlyOwner":
-            parameters["user"] = parameters.get("user", self.rng.choice(self.non_owner_users))
-        else:
-            parameters["user"] = parameters.get("user", "owner")
-        if fail == "validDestination":
-            parameters["to_user"] = parameters.get("to_user", self.rng.choice(self.bad_destinations))
-        else:
-            parameters["to_user"] = parameters.get("to_user", self.rng.choice(self.non_owner_users))
-        if fail == "exceedAllowance":
-            parameters["amount_mini_qsp"] = parameters.get("amount_mini_qsp",
-                                                           self.rng.randint(self.token.crowdsale_allowance + 1,
-                                                                            self.token.crowdsale_allowance + BILLION))
-        else:
-            parameters["amount_mini_qsp"] = parameters.get("amount_mini_qsp",
-                                                           self.rng.randint(0, self.token.crowdsale_allowance))
-        parameters["amount_wei"] = parameters.get("amount_wei", self.rng.randint(0, CROWDSALE_CAP))
-
-        user = parameters["user"]
-        user_str = gen_user_str(user)
-        to_user = parameters["to_user"]
-        amount_mini_qsp = parameters["amount_mini_qsp"]
-        amount_mini_qsp_str = "'" + str(parameters["amount_mini_qsp"]) + "'"
-        amount_wei = parameters["amount_wei"]
-        amount_wei_str = "'" + str(parameters["amount_wei"]) + "'"
-        # end parameter instantiation
-
+        parameters = super().owner_allocate_tokens(fail, parameters)
+        t = template(("owner_allocate_tokens", fail, self.verbosity, self.assertions, self.goal_reached,
+                      self.cap_reached, self.batch_reads), self.owner_allocate_tokens_template, fail)
+        return self.emit(t, parameters, {"user_str": gen_user_str(parameters["user"]),
+                                         "to_user": parameters["to_user"],
+                                         "amount_mini_qsp_str": "'" + str(parameters["amount_mini_qsp"]) + "'",
+                                         "amount_wei": str(parameters["amount_wei"]),
+                                         "amount_wei_str": "'" + str(parameters["amount_wei"]) + "'",
+                                         "crowdsale_allowance": str(self.token.crowdsale_allowance)})
+
+    def owner_allocate_tokens_template(self, fail):
+        user_str = field("user_str")
+        to_user = field("to_user")
+        amount_mini_qsp_str = field("amount_mini_qsp_str")
+        amount_wei = field("amount_wei")
+        amount_wei_str = field("amount_wei_str")
+
+        s = []
         if self.verbosity:
-            s = gen_log("'About to call ownerAllocateTokens with parameters: " + str(parameters).replace("'", "") + "'")
-        else:
-            s = ""
+            s.append(self.log_call("ownerAllocateTokens"))
 
         if not fail:
-            s += "await sale.ownerAllocateTokens(" + \
-                 ", ".join([to_user, amount_wei_str, amount_mini_qsp_str, user_str]) + ");\n"
-            # assert that token.balances[to_user] increases by amount_mini_qsp
-            vid = "token_balance_" + to_user
-            s = wrap_token_balance_checks(s, to_user, vid)
-            s += balance_assertion_check(vid, ".add(" + gen_big_int(amount_mini_qsp_str) + ")",
-                                         "the token balance of the to_user should increase after ownerAllocateTokens")
-
-            # assert that the sale.balanceOf[to_user] increases by amount_wei
-            vid = "sale_balance_" + to_user
-            s = wrap_sale_balance_checks(s, to_user, vid)
-            s += balance_assertion_check(vid, ".add(" + gen_big_int(amount_wei_str) + ")",
-                                         "the sale balance of the to_user should increase after ownerAllocateTokens")
-
-            # assert that the allowance of crowdsale decreases by amount_mini_qsp
-            vid = "crowdsale_allowance"
-            s = wrap_allowance_checks(s, "sale.address", vid)
-            s += balance_assertion_check(vid, ".minus(" + gen_big_int(amount_mini_qsp_str) + ")",
-                                         "the allowance of the crowdsale should decrease by amount_mini_qsp")
-
-            # assert that the amountRaised field has increased
-            vid = "amount_raised"
-            s = wrap_amount_raised(s, vid)
-            s += balance_assertion_check(vid, ".add(" + gen_big_int(amount_wei) + ")",
-                                         "the amountRaised of the crowdsale should " +
-                                         "increase by amountWei in ownerAllocateTokens")
-
-            # update the state of crowdsale
-            self.update_state_with_purchase(to_user, amount_wei, amount_mini_qsp)
-
-            # assert that the goalReached and capReached fields have changed if necessary
-            s += goal_and_cap_assertion_checks(self.goal_reached, self.cap_reached)
+            s.append("await sale.ownerAllocateTokens(" +
+                     ", ".join([to_user, amount_wei_str, amount_mini_qsp_str, user_str]) + ");\n")
+            if not self.op_checks():
+                return s
+            s = self.balance_checks(s, [
+                # assert that token.balances[to_user] increases by amount_mini_qsp
+                ("token_balance_" + to_user, token_balance_read(to_user),
+                 ".add(" + gen_big_int(amount_mini_qsp_str) + ")",
+                 "the token balance of the to_user should increase after ownerAllocateTokens"),
+                # assert that the sale.balanceOf[to_user] increases by amount_wei
+                ("sale_balance_" + to_user, sale_balance_read(to_user),
+                 ".add(" + gen_big_int(amount_wei_str) + ")",
+                 "the sale balance of the to_user should increase after ownerAllocateTokens"),
+                # assert that the allowance of crowdsale decreases by amount_mini_qsp
+                ("crowdsale_allowance", allowance_read("sale.address"),
+                 ".minus(" + gen_big_int(amount_mini_qsp_str) + ")",
+                 "the allowance of the crowdsale should decrease by amount_mini_qsp"),
+                # assert that the amountRaised field has increased
+                ("amount_raised", amount_raised_read(),
+                 ".add(" + gen_big_int(amount_wei) + ")",
+                 "the amountRaised of the crowdsale should increase by amountWei in ownerAllocateTokens"),
+            ])
 
         elif fail == "onlyOwner":
-            s += self.only_owner("sale.ownerAllocateTokens",
-                                 "only the owner can call ownerAllocateTokens",
-                                 parameters)
+            s = fragments(s, self.only_owner("sale.ownerAllocateTokens",
+                                             "only the owner can call ownerAllocateTokens"))
         elif fail == "validDestination":
-            s += "await sale.ownerAllocateTokens(" + \
-                 ", ".join([to_user, amount_wei, amount_mini_qsp, user_str]) + ");\n"
+            s.append("await sale.ownerAllocateTokens(" +
+                     ", ".join([to_user, amount_wei_str, amount_mini_qsp_str, user_str]) + ");\n")
             s = wrap_exception(s, "the to-address is not valid for allocating tokens")
         elif fail == "exceedAllowance":
-            s += "await sale.ownerAllocateTokens(" + \
-                 ", ".join([to_user, amount_wei, amount_mini_qsp, user_str]) + ");\n"
+            s.append("await sale.ownerAllocateTokens(" +
+                     ", ".join([to_user, amount_wei_str, amount_mini_qsp_str, user_str]) + ");\n")
             s = wrap_exception(s, "the amount of mini-QSP exceeds the crowdsale's allowance")
-        if fail:
-            s += "var currentCrowdSaleAllowance = await token.crowdSaleAllowance();\n"
-            s += gen_assert_equal("currentCrowdSaleAllowance",
-                                  self.token.crowdsale_allowance,
-                                  "the crowdsale allowance should not have changed")
+        if fail and self.op_checks():
+            s = fragments(s,
+                          "var currentCrowdSaleAllowance = await token.crowdSaleAllowance();\n",
+                          gen_assert_equal("currentCrowdSaleAllowance",
+                                           field("crowdsale_allowance"),
+                                           "the crowdsale allowance should not have changed"))
         return s
 
     def fallback(self, fail=None, parameters=None):
         """
-        :param fail: belowMinContribution, validDestination
+        :param fail: whenNotPaused, beforeDeadline, saleNotClosed, belowMinContribution, validDestination
         :param parameters: user, wei
         """
-        if not parameters:
-            parameters = {}
-        if fail == "validDestination":
-            parameters["user"] = parameters.get("user", self.rng.choice(self.bad_destinations))
-        else:
-            parameters["user"] = parameters.get("user", self.rng.choice(self.basic_users))
-        if fail == "belowMinContribution":
-            parameters["wei"] = parameters.get("wei", self.rng.randint(0, int(0.1 * ETHER - 1)))
-        else:
-            parameters["wei"] = parameters.get("wei", self.rng.randint(int(0.1 * ETHER), ETHER))
+        payable_disallowed = self.payable_disallowed()
+        allowance = self.token.crowdsale_allowance
+        parameters = super().fallback(fail, parameters)
+        if parameters is None:
+            return None
 
         wei = parameters["wei"]
-        wei_str = "'" + str(parameters["wei"]) + "'"
         user = str(parameters["user"])
-        user_str = gen_user_str(user, wei)
-        # end parameter instantiation
-
+        exceeds_allowance = self.exceeds_allowance(wei * self.rate, allowance)
+        t = template(("fallback", fail, self.verbosity, self.assertions, payable_disallowed, exceeds_allowance,
+                      self.goal_reached, self.cap_reached, self.batch_reads), self.fallback_template, fail,
+                     payable_disallowed, exceeds_allowance)
+        return self.emit(t, parameters, {"user": user, "user_str": gen_user_str(user, wei),
+                                         "wei_str": "'" + str(wei) + "'",
+                                         "mini_qsp_str": "'" + str(wei * self.rate) + "'"})
+
+    def fallback_template(self, fail, payable_disallowed, exceeds_allowance):
+        user = field("user")
+        wei_str = field("wei_str")
+        mini_qsp_str = field("mini_qsp_str")
+
+        s = []
         if self.verbosity:
-            s = gen_log("'About to call fallback with parameters: " + str(parameters).replace("'", "") + "'")
-        else:
-            s = ""
-
-        s += "await sale.sendTransaction(" + user_str + ");\n"
-
-        payable_disallowed = (self.cap_reached
-                              or self.sale_closed
-                              or self.paused
-                              or self.env.current_time < self.startTime
-                              or self.env.current_time > self.endTime)
-        if not fail and not payable_disallowed:
-            # assert that the balance of the user in token is increased (qsp = wei * rate)
-            vid = "token_balance_" + user
-            s = wrap_token_balance_checks(s, user, vid)
-            s += balance_assertion_check(vid, ".add(" + gen_big_int("'" + str(wei * self.rate) + "'") + ")",
-                                         "the token balance of the user should increase after contributing")
-
-            # assert that the balance of the user in sale is increased (wei)
-            vid = "sale_balance_" + user
-            s = wrap_sale_balance_checks(s, user, vid)
-            s += balance_assertion_check(vid, ".add(" + gen_big_int(wei_str) + ")",
-                                         "the sale balance of the user should increase after contributing")
-
-            # assert that the amountRaised field has increased
-            vid = "amount_raised"
-            s = wrap_amount_raised(s, vid)
-            s += balance_assertion_check(vid, ".add(" + gen_big_int(wei_str) + ")",
-                                         "the amountRaised of the crowdsale should increase by wei")
-
-            # assert that the allowance of the crowdsale has decreased
-            vid = "crowdsale_allowance"
-            s = wrap_allowance_checks(s, "sale.address", vid)
-            s += balance_assertion_check(vid, ".minus(" + gen_big_int("'" + str(wei * self.rate) + "'") + ")",
-                                         "the allowance of the crowdsale should decrease by wei * rate")
-
-            # update the state of crowdsale
-            self.update_state_with_purchase(user, wei, None)
-
-            # assert that the goalReached and capReached fields have changed if necessary
-            s += goal_and_cap_assertion_checks(self.goal_reached, self.cap_reached)
+            s.append(self.log_call("fallback"))
+
+        s.append("await sale.sendTransaction(" + field("user_str") + ");\n")
+
+        if not fail and not payable_disallowed and not exceeds_allowance:
+            if not self.op_checks():
+                return s
+            s = self.balance_checks(s, [
+                # assert that the balance of the user in token is increased (qsp = wei * rate)
+                ("token_balance_" + user, token_balance_read(user),
+                 ".add(" + gen_big_int(mini_qsp_str) + ")",
+                 "the token balance of the user should increase after contributing"),
+                # assert that the balance of the user in sale is increased (wei)
+                ("sale_balance_" + user, sale_balance_read(user),
+                 ".add(" + gen_big_int(wei_str) + ")",
+                 "the sale balance of the user should increase after contributing"),
+                # assert that the amountRaised field has increased
+                ("amount_raised", amount_raised_read(),
+                 ".add(" + gen_big_int(wei_str) + ")",
+                 "the amountRaised of the crowdsale should increase by wei"),
+                # assert that the allowance of the crowdsale has decreased
+                ("crowdsale_allowance", allowance_read("sale.address"),
+                 ".minus(" + gen_big_int(mini_qsp_str) + ")",
+                 "the allowance of the crowdsale should decrease by wei * rate"),
+            ])
         elif fail == "belowMinContribution":
             s = wrap_exception(s, "cannot contribute below the minimum")
         elif fail == "validDestination":
             s = wrap_exception(s, "the user is not allowed to purchase tokens")
-        elif payable_disallowed:
-            s = wrap_exception(s, "cannot contribute after the sale is beforeStart/closed/paused/finished")
+        elif not payable_disallowed and exceeds_allowance:
+            s = wrap_exception(s, "cannot buy more tokens than the allowance of the crowdsale")
         else:
-            print("TODO finish payable")
-            s = ""
+            s = wrap_exception(s, "cannot contribute after the sale is beforeStart/closed/paused/finished")
         return s
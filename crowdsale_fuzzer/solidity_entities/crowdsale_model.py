@@ -0,0 +1,430 @@
+import random
+
+import sys
+
+from crowdsale_fuzzer import ETHER, CROWDSALE_CAP, BILLION
+from solidity_entities.accounts import Accounts, credit, vector_key
+from solidity_entities.environment import SolidityEnvironment
+from solidity_entities.function import Function
+from solidity_entities.token import Token
+
+
+class CrowdsaleModel:
+    """
+    Python model of the crowdsale. Every operation instantiates its parameters, applies its effect to the model
+    and returns the instantiated parameters (or None if the operation does not apply), without emitting any JS.
+    CrowdsaleFuzzer extends the operations with the emission of the corresponding test code.
+
+    Users are interned in accounts, and the balances of the crowdsale and the token are lists indexed by account,
+    so that copying and hashing the state (see copy and state_key) is cheap.
+    """
+    __slots__ = ("rng", "env", "token", "all_users", "owner", "beneficiary", "token_admin", "basic_users",
+                 "non_owner_users", "bad_destinations", "accounts", "funding_goal", "funding_cap", "minContribution",
+                 "startTime", "endTime", "rate", "sale_closed", "paused", "amount_raised", "refund_amount",
+                 "balance", "balance_total", "low_rate", "high_rate", "goal_reached", "cap_reached", "functions",
+                 "trace", "shared")
+
+    # the slots saved by fork; the others are saved separately or never change
+    forked_slots = [name for name in __slots__ if name not in ("rng", "env", "token", "functions", "trace",
+                                                                  "shared")]
+
+    def __init__(self,
+                 random_number_generator,
+                 solidity_environment,
+                 token,
+                 users,
+                 owner,
+                 beneficiary,
+                 token_admin,
+                 funding_goal_in_ethers,
+                 funding_cap_in_ethers,
+                 minimum_contribution_in_wei,
+                 start,
+                 duration_in_minutes,
+                 rate_qsp_to_ether):
+        self.rng = random_number_generator
+        self.env = solidity_environment
+        self.env.current_time = start
+        self.token = token
+
+        assert isinstance(self.rng, random.Random)
+        assert isinstance(self.env, SolidityEnvironment)
+        assert isinstance(self.token, Token)
+
+        self.all_users = users
+        self.owner = owner
+        self.beneficiary = beneficiary
+        self.token_admin = token_admin
+        privileged = {self.owner, self.beneficiary, self.token_admin}
+        self.basic_users = [i for i in self.all_users if i not in privileged]
+        self.non_owner_users = [i for i in self.all_users if i != self.owner]
+        self.bad_destinations = ["sale.address", "0x0", "token.owner()", self.token_admin, "token.address"]
+        self.accounts = Accounts(self.all_users)
+
+        self.funding_goal = funding_goal_in_ethers * ETHER
+        self.funding_cap = funding_cap_in_ethers * ETHER
+        self.minContribution = minimum_contribution_in_wei
+        self.startTime = start
+        self.endTime = start + duration_in_minutes * 60
+        self.rate = rate_qsp_to_ether
+
+        # other state variables
+        self.sale_closed = False
+        self.paused = False
+        self.amount_raised = 0
+        self.refund_amount = 0
+        self.balance = [0] * len(self.accounts)  # how much each donor has contributed to the crowdsale, by account
+        self.balance_total = 0  # running sum of balance, so that checking it against amount_raised is O(1)
+        self.low_rate = 5000
+        self.high_rate = 10000
+        self.goal_reached = (self.amount_raised >= self.funding_goal)
+        self.cap_reached = (self.amount_raised >= self.funding_cap)
+        self.functions = self.gen_functions()
+        self.trace = []  # (function name, fail, parameters) of every operation applied to the model
+        self.shared = False  # whether balance is shared with a snapshot (see fork)
+
+    def update_state_for_new_contract(self, beneficiary, funding_goal_in_ethers, funding_cap_in_ethers,
+                                      minimum_contribution_in_wei, start, duration_in_minutes, rate_qsp_to_ether):
+        self.beneficiary = beneficiary
+
+        self.funding_goal = funding_goal_in_ethers * ETHER
+        self.funding_cap = funding_cap_in_ethers * ETHER
+        self.minContribution = minimum_contribution_in_wei
+        self.startTime = start
+        self.endTime = start + duration_in_minutes * 60
+        self.rate = rate_qsp_to_ether
+
+        # other state variables
+        self.sale_closed = False
+        self.paused = False
+        self.amount_raised = 0
+        self.refund_amount = 0
+        self.balance = [0] * len(self.accounts)  # how much each donor has contributed to the crowdsale, by account
+        self.balance_total = 0
+        self.goal_reached = (self.amount_raised >= self.funding_goal)
+        self.cap_reached = (self.amount_raised >= self.funding_cap)
+        self.functions = self.gen_functions()
+
+    def copy(self):
+        """
+        An independent copy of the state of the model; the copy shares the random number generator
+        """
+        model = object.__new__(type(self))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                setattr(model, name, getattr(self, name))
+        model.env = self.env.copy()
+        model.token = self.token.copy()
+        model.balance = list(self.balance)
+        model.trace = list(self.trace)
+        model.shared = False
+        model.functions = model.gen_functions()
+        return model
+
+    def fork(self):
+        """
+        Snapshot of the state of the model, which restore brings the model back to, as many times as needed.
+        The balance lists are shared with the snapshot until the next purchase copies them (copy on write),
+        and the trace is only copied on restore. The random number generator is not part of the snapshot,
+        so the operations that follow a restore draw new parameters.
+        """
+        self.shared = True
+        return ([getattr(self, name) for name in self.forked_slots], self.env.fork(), self.token.fork(),
+                self.trace, len(self.trace))
+
+    def restore(self, snapshot):
+        values, env, token, trace, length = snapshot
+        for name, value in zip(self.forked_slots, values):
+            setattr(self, name, value)
+        self.shared = True
+        self.env.restore(env)
+        self.token.restore(token)
+        self.trace = trace[:length]
+
+    def state_key(self):
+        """
+        Hashable key of the state of the model (the trace that led to it is left out)
+        """
+        return (self.env.current_time, self.beneficiary, self.funding_goal, self.funding_cap, self.minContribution,
+                self.startTime, self.endTime, self.rate, self.sale_closed, self.paused, self.amount_raised,
+                self.refund_amount, self.goal_reached, self.cap_reached, vector_key(self.balance),
+                self.token.state_key())
+
+    def checkpoint_values(self):
+        """
+        The state of the model as the strings a checkpoint compares (see CrowdsaleFuzzer.checkpoint): the token
+        balances of the users and the allowance of the crowdsale, both relative to the start, the sale balances
+        of the users, amountRaised, rate, paused, saleClosed, fundingGoalReached and fundingCapReached
+        """
+        token_balances = []
+        sale_balances = []
+        for user in self.all_users:
+            account = self.accounts.intern(user)
+            token_balances.append(self.token.balances[account] if account < len(self.token.balances) else 0)
+            sale_balances.append(self.balance[account] if account < len(self.balance) else 0)
+        sold = self.token.initial_crowdsale_allowance - self.token.crowdsale_allowance
+        return ([str(value) for value in token_balances + [-sold] + sale_balances + [self.amount_raised, self.rate]] +
+                [str(flag).lower() for flag in (self.paused, self.sale_closed, self.goal_reached, self.cap_reached)])
+
+    def create_new_crowdsale(self, params, set_crowdsale=True):
+        self.update_state_for_new_contract(*params)
+        self.trace.append(("create_new_crowdsale", None, {"params": list(params), "set_crowdsale": set_crowdsale}))
+
+    def replay(self, function_name, fail, parameters):
+        """
+        Apply an operation recorded in a trace, with its recorded parameters
+        """
+        if function_name == "change_time":
+            return self.change_time(parameters["time"])
+        if function_name == "create_new_crowdsale":
+            return self.create_new_crowdsale(parameters["params"], parameters["set_crowdsale"])
+        return getattr(self, function_name)(fail, dict(parameters))
+
+    def update_state_with_purchase(self, user, wei, mini_qsp):
+        # update amount raised, the allowance of the crowdsale, and the balance of user in token and sale
+        # if mini_qsp is None, then mini_qsp = wei * rate; an allocation of 0 mini-QSP transfers no tokens
+        if mini_qsp is not None:
+            mini_qsp = int(mini_qsp)
+        else:
+            mini_qsp = wei * self.rate
+        account = self.accounts.intern(user)
+        if self.shared:
+            self.balance = list(self.balance)
+            self.shared = False
+        self.amount_raised += wei
+        self.token.crowdsale_allowance -= mini_qsp
+        self.token.credit(account, mini_qsp)
+        credit(self.balance, account, wei)
+        self.balance_total += wei
+        # update goal and cap if exceeded
+
+        if self.amount_raised > self.funding_goal:
+            self.goal_reached = True
+        if self.amount_raised > self.funding_cap:
+            self.cap_reached = True
+
+    def payable_disallowed(self):
+        return (self.cap_reached
+                or self.sale_closed
+                or self.paused
+                or self.env.current_time < self.startTime
+                or self.env.current_time > self.endTime)
+
+    def exceeds_allowance(self, mini_qsp, allowance=None):
+        """
+        Whether the token reverts the transfer of mini_qsp from the allowance of the crowdsale
+        (the current one, unless allowance is given)
+        """
+        return mini_qsp > (self.token.crowdsale_allowance if allowance is None else allowance)
+
+    def gen_functions(self):
+        """
+        Generate function signatures for testing vectors
+        """
+        return [
+            Function(self.terminate, ["onlyOwner"], None),
+            Function(self.set_rate, ["onlyOwner"], ["rateAbove", "rateBelow"]),
+            Function(self.owner_allocate_tokens, ["onlyOwner", "validDestination"], ["exceedAllowance"]),
+            Function(self.owner_unlock_fund, ["onlyOwner", "afterDeadline"], None),
+            Function(self.fallback, ["whenNotPaused", "beforeDeadline", "saleNotClosed"])
+        ]
+
+    def only_owner_parameters(self):
+        # an onlyOwner failure that draws its caller draws it once more; the draw is kept so that seeds reproduce the
+        # same tests
+        self.rng.choice(self.non_owner_users)
+
+    # -------------------------------------------------------------------------------------------------------
+    # Parameter instantiation
+    # -------------------------------------------------------------------------------------------------------
+    # Only the parameters missing from parameters are drawn, so that an operation replayed with its recorded
+    # parameters (see replay) draws nothing from rng.
+
+    def set_pause_parameters(self, fail=None, parameters=None):
+        if not parameters:
+            parameters = {}
+        draw_user = fail and "user" not in parameters
+        if "user" not in parameters:
+            parameters["user"] = self.rng.choice(self.non_owner_users) if fail else "owner"
+        if "pause" not in parameters:
+            parameters["pause"] = self.rng.choice([True, False])
+        if draw_user:
+            self.only_owner_parameters()
+        return parameters
+
+    def terminate_parameters(self, fail=None, parameters=None):
+        if not parameters:
+            parameters = {}
+        draw_user = fail and "user" not in parameters
+        if "user" not in parameters:
+            parameters["user"] = self.rng.choice(self.non_owner_users) if fail else "owner"
+        if draw_user:
+            self.only_owner_parameters()
+        return parameters
+
+    def owner_unlock_fund_parameters(self, fail=None, parameters=None):
+        if not parameters:
+            parameters = {}
+        if "user" not in parameters:
+            parameters["user"] = self.rng.choice(self.non_owner_users) if fail == "onlyOwner" else "owner"
+        if fail == "afterDeadline":
+            sys.exit("TODO afterDeadline")
+        elif fail:
+            sys.exit("Missing case in ownerUnlockFund")
+        return parameters
+
+    def set_rate_parameters(self, fail=None, parameters=None):
+        if not parameters:
+            parameters = {}
+        draw_user = fail == "onlyOwner" and "user" not in parameters
+        if "user" not in parameters:
+            parameters["user"] = self.rng.choice(self.non_owner_users) if fail == "onlyOwner" else "owner"
+        if "rate" not in parameters:
+            if fail == "rateAbove":
+                parameters["rate"] = self.rng.randint(self.high_rate + 1, BILLION)
+            elif fail == "rateBelow":
+                parameters["rate"] = self.rng.randint(0, self.low_rate - 1)
+            else:
+                parameters["rate"] = self.rng.randint(self.low_rate, self.high_rate)
+        if draw_user:
+            self.only_owner_parameters()
+        return parameters
+
+    def owner_safe_withdrawal_parameters(self, fail=None, parameters=None):
+        if not parameters:
+            parameters = {}
+        draw_user = fail == "onlyOwner" and "user" not in parameters
+        if "user" not in parameters:
+            parameters["user"] = self.rng.choice(self.non_owner_users) if fail == "onlyOwner" else "owner"
+        if draw_user:
+            self.only_owner_parameters()
+        return parameters
+
+    def owner_allocate_tokens_parameters(self, fail=None, parameters=None):
+        if not parameters:
+            parameters = {}
+        draw_user = fail == "onlyOwner" and "user" not in parameters
+        if "user" not in parameters:
+            parameters["user"] = self.rng.choice(self.non_owner_users) if fail == "onlyOwner" else "owner"
+        if "to_user" not in parameters:
+            if fail == "validDestination":
+                parameters["to_user"] = self.rng.choice(self.bad_destinations)
+            else:
+                parameters["to_user"] = self.rng.choice(self.non_owner_users)
+        if "amount_mini_qsp" not in parameters:
+            allowance = self.token.crowdsale_allowance
+            if fail == "exceedAllowance":
+                parameters["amount_mini_qsp"] = self.rng.randint(allowance + 1, allowance + BILLION)
+            else:
+                parameters["amount_mini_qsp"] = self.rng.randint(0, allowance)
+        if "amount_wei" not in parameters:
+            parameters["amount_wei"] = self.rng.randint(0, CROWDSALE_CAP)
+        if draw_user:
+            self.only_owner_parameters()
+        return parameters
+
+    def fallback_parameters(self, fail=None, parameters=None):
+        if not parameters:
+            parameters = {}
+        if "user" not in parameters:
+            if fail == "validDestination":
+                parameters["user"] = self.rng.choice(self.bad_destinations)
+            else:
+                parameters["user"] = self.rng.choice(self.basic_users)
+        if "wei" not in parameters:
+            if fail == "belowMinContribution":
+                parameters["wei"] = self.rng.randint(0, int(0.1 * ETHER - 1))
+            else:
+                parameters["wei"] = self.rng.randint(int(0.1 * ETHER), ETHER)
+        return parameters
+
+    # -------------------------------------------------------------------------------------------------------
+    # Crowdsale Functions
+    # -------------------------------------------------------------------------------------------------------
+
+    def set_pause(self, fail=None, parameters=None):
+        """
+        :param fail: onlyOwner
+        :param parameters: user, pause
+        """
+        parameters = self.set_pause_parameters(fail, parameters)
+        self.paused = bool(parameters["pause"])
+        self.trace.append(("set_pause", fail, parameters))
+        return parameters
+
+    def change_time(self, time):
+        self.env.current_time = time
+        self.trace.append(("change_time", None, {"time": time}))
+
+    def terminate(self, fail=None, parameters=None):
+        """
+        :param fail: onlyOwner
+        :param parameters: user
+        """
+        parameters = self.terminate_parameters(fail, parameters)
+        if not fail:
+            self.sale_closed = True
+        self.trace.append(("terminate", fail, parameters))
+        return parameters
+
+    def owner_unlock_fund(self, fail=None, parameters=None):
+        """
+        :param fail: onlyOwner, afterDeadline
+        :param parameters: user
+        """
+        parameters = self.owner_unlock_fund_parameters(fail, parameters)
+        if not fail:
+            self.sale_closed = True
+        self.trace.append(("owner_unlock_fund", fail, parameters))
+        return parameters
+
+    def set_rate(self, fail=None, parameters=None):
+        """
+        :param fail: onlyOwner, rateAbove, rateBelow
+        :param parameters: user, rate
+        """
+        parameters = self.set_rate_parameters(fail, parameters)
+        if not fail:
+            self.rate = parameters["rate"]
+        self.trace.append(("set_rate", fail, parameters))
+        return parameters
+
+    def owner_safe_withdrawal(self, fail=None, parameters=None):
+        """
+        :param fail: onlyOwner
+        :param parameters: user
+        """
+        parameters = self.owner_safe_withdrawal_parameters(fail, parameters)
+        if fail and fail != "onlyOwner" and self.goal_reached:
+            sys.exit("Missing case in ownerSafeWithdrawal")
+        self.trace.append(("owner_safe_withdrawal", fail, parameters))
+        return parameters
+
+    def owner_allocate_tokens(self, fail=None, parameters=None):
+        """
+        :param fail: onlyOwner, validDestination, exceedAllowance
+        :param parameters: user, to_user, amount_mini_qsp, amount_wei
+        """
+        parameters = self.owner_allocate_tokens_parameters(fail, parameters)
+        if not fail:
+            self.update_state_with_purchase(parameters["to_user"], parameters["amount_wei"],
+                                            parameters["amount_mini_qsp"])
+        self.trace.append(("owner_allocate_tokens", fail, parameters))
+        return parameters
+
+    def fallback(self, fail=None, parameters=None):
+        """
+        :param fail: whenNotPaused, beforeDeadline, saleNotClosed, belowMinContribution, validDestination
+        :param parameters: user, wei
+        """
+        parameters = self.fallback_parameters(fail, parameters)
+        # a purchase of more tokens than the allowance of the crowdsale reverts, like a disallowed payable
+        payable_disallowed = (self.payable_disallowed() or
+                              self.exceeds_allowance(parameters["wei"] * self.rate))
+        if not fail and not payable_disallowed:
+            self.update_state_with_purchase(str(parameters["user"]), parameters["wei"], None)
+        elif fail not in ["belowMinContribution", "validDestination"] and not payable_disallowed:
+            # TODO finish payable
+            return None
+        self.trace.append(("fallback", fail, parameters))
+        return parameters
@@ -0,0 +1,151 @@
+from solidity_entities.crowdsale_model import CrowdsaleModel
+
+# the parameters that are numbers, written as strings since the amounts do not fit the numbers of JS
+NUMBER_PARAMETERS = ["rate", "wei", "amount_wei", "amount_mini_qsp", "time"]
+
+
+def encode_parameters(parameters):
+    return {name: str(value) if name in NUMBER_PARAMETERS else value for name, value in parameters.items()}
+
+
+def decode_parameters(parameters):
+    return {name: int(value) if name in NUMBER_PARAMETERS else value for name, value in parameters.items()}
+
+
+def pack(cases):
+    """
+    The table and the packed cases of the test cases of a JSON op list: every distinct (function name, fail,
+    parameter names) of their records (see CrowdsaleOpList) is written once in the table, and every record as
+    [its index in the table, whether the transaction fails, changes] + the values of its parameters
+    """
+    table = []
+    codes = {}
+    packed = []
+    for case in cases:
+        ops = []
+        for function_name, fail, parameters, throws, changes in case["ops"]:
+            names = tuple(parameters)
+            code = codes.get((function_name, fail, names))
+            if code is None:
+                code = codes[(function_name, fail, names)] = len(table)
+                table.append([function_name, fail, list(names)])
+            ops.append([code, throws, changes] + [parameters[name] for name in names])
+        packed.append(dict(case, ops=ops))
+    return table, packed
+
+
+def unpack(table, op):
+    """
+    The record of a packed operation (see pack)
+    """
+    function_name, fail, names = table[op[0]]
+    return [function_name, fail, dict(zip(names, op[3:])), op[1], op[2]]
+
+
+class CrowdsaleOpList(CrowdsaleModel):
+    """
+    Emitter of the operations as the records of a JSON op list, which the hand-written interpreter
+    (fuzz_interpreter.js) executes instead of generated code. The record of an operation is
+    [function name, fail, parameters, whether the transaction fails, changes], where changes are the
+    [index, value] of the values of the model (see CrowdsaleModel.checkpoint_values) that the operation changed,
+    which the interpreter compares with the whole state of the chain after the operation. Without op checks
+    (see CrowdsaleFuzzer.op_checks), the changes are None and only the final state of a test case is compared.
+    """
+    __slots__ = ("assertions", "expected")
+
+    def __init__(self,
+                 random_number_generator,
+                 solidity_environment,
+                 token,
+                 users,
+                 owner,
+                 beneficiary,
+                 token_admin,
+                 funding_goal_in_ethers,
+                 funding_cap_in_ethers,
+                 minimum_contribution_in_wei,
+                 start,
+                 duration_in_minutes,
+                 rate_qsp_to_ether,
+                 assertions="op"):
+        self.assertions = assertions
+        super().__init__(random_number_generator, solidity_environment, token, users, owner, beneficiary, token_admin,
+                         funding_goal_in_ethers, funding_cap_in_ethers, minimum_contribution_in_wei, start,
+                         duration_in_minutes, rate_qsp_to_ether)
+        self.expected = self.checkpoint_values()
+
+    def op_checks(self):
+        return self.assertions == "op" or self.assertions == "paranoid"
+
+    def start_values(self):
+        """
+        The values of the model at the start of the test case, or None without op checks
+        """
+        return list(self.expected) if self.op_checks() else None
+
+    def final_values(self):
+        """
+        The values of the model at the end of the test case, or None without final checks
+        (with op checks, the last operation has already compared them)
+        """
+        return self.checkpoint_values() if self.assertions == "final" else None
+
+    def record(self, function_name, fail, parameters, throws):
+        changes = None
+        if self.op_checks():
+            values = self.checkpoint_values()
+            changes = [[i, value] for i, (value, expected) in enumerate(zip(values, self.expected))
+                       if value != expected]
+            self.expected = values
+        return [function_name, fail, encode_parameters(parameters), throws, changes]
+
+    # -------------------------------------------------------------------------------------------------------
+    # Crowdsale Functions
+    #
+    # Every function applies the operation to the model and returns its record, or None when there is nothing
+    # to run. Whether the transaction fails is the one the JS emitter asserts (see CrowdsaleFuzzer), and depends
+    # on the state before the operation.
+    # -------------------------------------------------------------------------------------------------------
+
+    def create_new_crowdsale(self, params, set_crowdsale=True):
+        super().create_new_crowdsale(params, set_crowdsale)
+        return self.record("create_new_crowdsale", None, {"params": list(params), "set_crowdsale": set_crowdsale},
+                           False)
+
+    def set_pause(self, fail=None, parameters=None):
+        parameters = super().set_pause(fail, parameters)
+        return self.record("set_pause", fail, parameters, bool(fail))
+
+    def change_time(self, time):
+        super().change_time(time)
+        return self.record("change_time", None, {"time": time}, False)
+
+    def terminate(self, fail=None, parameters=None):
+        parameters = super().terminate(fail, parameters)
+        return self.record("terminate", fail, parameters, bool(fail))
+
+    def owner_unlock_fund(self, fail=None, parameters=None):
+        parameters = super().owner_unlock_fund(fail, parameters)
+        return self.record("owner_unlock_fund", fail, parameters, bool(fail))
+
+    def set_rate(self, fail=None, parameters=None):
+        parameters = super().set_rate(fail, parameters)
+        return self.record("set_rate", fail, parameters, bool(fail))
+
+    def owner_safe_withdrawal(self, fail=None, parameters=None):
+        goal_reached = self.goal_reached
+        parameters = super().owner_safe_withdrawal(fail, parameters)
+        return self.record("owner_safe_withdrawal", fail, parameters, fail == "onlyOwner" or not goal_reached)
+
+    def owner_allocate_tokens(self, fail=None, parameters=None):
+        parameters = super().owner_allocate_tokens(fail, parameters)
+        return self.record("owner_allocate_tokens", fail, parameters, bool(fail))
+
+    def fallback(self, fail=None, parameters=None):
+        payable_disallowed = self.payable_disallowed()
+        allowance = self.token.crowdsale_allowance
+        parameters = super().fallback(fail, parameters)
+        if parameters is None:
+            return None
+        return self.record("fallback", fail, parameters, bool(fail) or payable_disallowed or
+                           self.exceeds_allowance(parameters["wei"] * self.rate, allowance))
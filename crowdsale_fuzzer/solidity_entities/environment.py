@@ -1,4 +1,20 @@
 class SolidityEnvironment:
+    __slots__ = ("relative_eth_balances", "current_time")
+
     def __init__(self):
-        self.relative_eth_balances = {}  # stores the balance of each user/contract relative to before invoking the test
+        # the balance of each account relative to before invoking the test, by account index (see Accounts)
+        self.relative_eth_balances = []
         self.current_time = None
+
+    def copy(self):
+        env = SolidityEnvironment()
+        env.relative_eth_balances = list(self.relative_eth_balances)
+        env.current_time = self.current_time
+        return env
+
+    def fork(self):
+        # relative_eth_balances is never updated in place
+        return self.relative_eth_balances, self.current_time
+
+    def restore(self, snapshot):
+        self.relative_eth_balances, self.current_time = snapshot
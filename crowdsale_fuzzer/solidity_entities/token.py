@@ -1,4 +1,9 @@
+from solidity_entities.accounts import credit, vector_key
+
+
 class Token:
+    __slots__ = ("initial_supply", "initial_crowdsale_allowance", "initial_admin_allowance", "supply",
+                 "crowdsale_allowance", "admin_allowance", "balances", "allowances", "issued", "shared")
 
     def __init__(self,
                  initial_supply,
@@ -10,5 +15,41 @@ class Token:
         self.supply = initial_supply
         self.crowdsale_allowance = initial_crowdsale_allowance  # TODO: incorporate into balances as well
         self.admin_allowance = initial_admin_allowance
-        self.balances = {}  # the amount of tokens owned by each address
-        self.allowances = {}  # the amount of tokens that a sender can transfer from a different user's balance
+        self.balances = []  # the amount of tokens owned by each account, by account index (see Accounts)
+        self.allowances = {}  # (owner index, spender index) -> the amount of tokens that the spender can transfer
+        self.issued = 0  # running sum of balances, so that checking it against the allowance is O(1)
+        self.shared = False  # whether balances and allowances are shared with a snapshot (see fork)
+
+    def credit(self, account, amount):
+        if self.shared:
+            self.balances = list(self.balances)
+            self.allowances = dict(self.allowances)
+            self.shared = False
+        credit(self.balances, account, amount)
+        self.issued += amount
+
+    def copy(self):
+        token = Token.__new__(Token)
+        for name in Token.__slots__:
+            setattr(token, name, getattr(self, name))
+        token.balances = list(self.balances)
+        token.allowances = dict(self.allowances)
+        token.shared = False
+        return token
+
+    def fork(self):
+        """
+        Snapshot of the token for restore. The balances are shared with the snapshot until the next credit
+        copies them (copy on write), so a fork costs the same whatever the number of accounts.
+        """
+        self.shared = True
+        return tuple(getattr(self, name) for name in Token.__slots__)
+
+    def restore(self, snapshot):
+        for name, value in zip(Token.__slots__, snapshot):
+            setattr(self, name, value)
+        self.shared = True
+
+    def state_key(self):
+        return (self.supply, self.crowdsale_allowance, self.admin_allowance, vector_key(self.balances),
+                tuple(sorted(self.allowances.items())))
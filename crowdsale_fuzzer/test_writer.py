@@ -1,28 +1,136 @@
+import re
+
+INDENT = "        "
+
+# the JS variables of the accounts used by the tests, in the order of the accounts of the chain
+USERS = ["owner", "beneficiary", "token_admin", "user3", "user4"]
+
+
+def fragments(*parts):
+    """
+    Chain strings and lazy fragment streams (iterables of strings) into one stream
+    """
+    for part in parts:
+        if isinstance(part, str):
+            yield part
+        else:
+            yield from part
+
+
+# marks the fields of a template while it is built
+FIELD_MARK = "\x00"
+FIELD = re.compile(FIELD_MARK + r"(\w+)" + FIELD_MARK)
+
+TEMPLATES = {}
+
+
+def field(name):
+    """
+    Placeholder for the value of name in the code a template is built from (see Template)
+    """
+    return FIELD_MARK + name + FIELD_MARK
+
+
+class Template:
+    """
+    Code built once from a fragment stream in which the values that change from call to call are fields,
+    and then filled in with those values, which is a single string formatting
+    """
+    __slots__ = ("text",)
+
+    def __init__(self, s):
+        self.text = FIELD.sub(r"%(\1)s", "".join(fragments(s)).replace("%", "%%"))
+
+    def fill(self, values):
+        return self.text % values
+
+
+def template(key, build, *args):
+    """
+    The Template of key, built from build(*args) the first time key is asked for in the process
+    """
+    t = TEMPLATES.get(key)
+    if t is None:
+        t = TEMPLATES[key] = Template(build(*args))
+    return t
+
+
+def write_fragments(out, s, indent=INDENT):
+    """
+    Write a fragment stream to out, indenting every line as the fragments pass through
+    """
+    newline = "\n" + indent
+    write = out.write
+    write(indent)
+    for fragment in fragments(s):
+        write(fragment.replace("\n", newline))
+    write("\n")
+
+
 def wrap_exception(s, e):
-    ret = "try{\n"
-    ret += "    flag = false;\n"
-    ret += "    " + s + "\n"
-    ret += "}\n"
-    ret += "catch(e){\n"
-    ret += "    flag = true;\n"
-    ret += "}\n"
-    ret += "if(!flag){ throw new Error(\"" + e + "\"); }\n"
-    ret += "flag = false;\n"
-    return ret
+    yield ("try{\n"
+           "    flag = false;\n"
+           "    ")
+    yield from fragments(s)
+    yield ("\n"
+           "}\n"
+           "catch(e){\n"
+           "    flag = true;\n"
+           "}\n"
+           "if(!flag){ throw new Error(\"" + e + "\"); }\n"
+           "flag = false;\n")
+
+
+def token_balance_read(user):
+    return "token.balanceOf(" + user + ")"
+
+
+def ether_balance_read(addr):
+    return "web3.eth.getBalance(" + addr + ")"
+
+
+def sale_balance_read(user):
+    return "sale.balanceOf(" + user + ")"
+
+
+def amount_raised_read():
+    return "sale.amountRaised()"
+
+
+def allowance_read(user):
+    return "token.allowance(" + "token_owner" + ", " + user + ")"
+
+
+def wrap_reads(s, var_name, read):
+    yield "var " + var_name + "_before = await " + read + "\n"
+    yield from fragments(s)
+    yield "var " + var_name + "_after = await " + read + "\n"
+
+
+def wrap_batched_reads(s, reads, after_reads=()):
+    """
+    Read the (var name, read) pairs of reads before and after s, issuing all the reads on each side of s
+    at once with Promise.all; the (var name, read) pairs of after_reads are only read after s
+    """
+    yield batched_reads([(var_name + "_before", read) for var_name, read in reads])
+    yield from fragments(s)
+    yield batched_reads([(var_name + "_after", read) for var_name, read in reads] + list(after_reads))
+
+
+def batched_reads(reads):
+    """
+    Read the (var name, read) pairs of reads at once with Promise.all
+    """
+    return ("var [" + ", ".join([var_name for var_name, _ in reads]) + "] = await Promise.all([" +
+            ", ".join([read for _, read in reads]) + "]);\n")
 
 
 def wrap_token_balance_checks(s, user, var_name):
-    ret = "var " + var_name + "_before = await token.balanceOf(" + user + ")\n"
-    ret += s
-    ret += "var " + var_name + "_after = await token.balanceOf(" + user + ")\n"
-    return ret
+    return wrap_reads(s, var_name, token_balance_read(user))
 
 
 def wrap_ether_balance_checks(s, addr, var_name):
-    ret = "var " + var_name + "_before = await web3.eth.getBalance(" + addr + ")\n"
-    ret += s
-    ret += "var " + var_name + "_after = await web3.eth.getBalance(" + addr + ")\n"
-    return ret
+    return wrap_reads(s, var_name, ether_balance_read(addr))
 
 
 def balance_assertion_check(vid, left_operation, error_message):
@@ -33,41 +141,39 @@ def balance_assertion_check(vid, left_operation, error_message):
 
 
 def wrap_sale_balance_checks(s, user, var_name):
-    ret = "var " + var_name + "_before = await sale.balanceOf(" + user + ")\n"
-    ret += s
-    ret += "var " + var_name + "_after = await sale.balanceOf(" + user + ")\n"
-    return ret
+    return wrap_reads(s, var_name, sale_balance_read(user))
 
 
 def wrap_amount_raised(s, var_name):
-    ret = "var " + var_name + "_before = await sale.amountRaised()\n"
-    ret += s
-    ret += "var " + var_name + "_after = await sale.amountRaised()\n"
-    return ret
+    return wrap_reads(s, var_name, amount_raised_read())
 
 
 def wrap_allowance_checks(s, user, var_name):
-    ret = "var " + var_name + "_before = await token.allowance(" + "token_owner" + ", " + user + ")\n"
-    ret += s
-    ret += "var " + var_name + "_after = await token.allowance(" + "token_owner" + ", " + user + ")\n"
-    return ret
+    return wrap_reads(s, var_name, allowance_read(user))
+
+
+GOAL_AND_CAP_READS = [("goal_reached", "sale.fundingGoalReached()"), ("cap_reached", "sale.fundingCapReached()")]
 
 
-def goal_and_cap_assertion_checks(goal_reached, cap_reached):
+def goal_and_cap_assertion_checks(goal_reached, cap_reached, read=True):
+    """
+    :param read: False if goal_reached and cap_reached have already been read (see GOAL_AND_CAP_READS)
+    """
     # assert that the goalReached field has changed if necessary
-    s = "var goal_reached = await sale.fundingGoalReached();\n"
+    if read:
+        yield "var goal_reached = await sale.fundingGoalReached();\n"
     if goal_reached:
-        s += "assert(goal_reached, 'the funding goal has been reached and should be true');\n"
+        yield "assert(goal_reached, 'the funding goal has been reached and should be true');\n"
     else:
-        s += "assert(!goal_reached, 'the funding goal has not been reached and should be false');\n"
+        yield "assert(!goal_reached, 'the funding goal has not been reached and should be false');\n"
 
     # assert that the capReached field has changed if necessary
-    s += "var cap_reached = await sale.fundingCapReached();\n"
+    if read:
+        yield "var cap_reached = await sale.fundingCapReached();\n"
     if cap_reached:
-        s += "assert(cap_reached, 'the funding cap has been reached and should be true');\n"
+        yield "assert(cap_reached, 'the funding cap has been reached and should be true');\n"
     else:
-        s += "assert(!cap_reached, 'the funding cap has not been reached and should be false');\n"
-    return s
+        yield "assert(!cap_reached, 'the funding cap has not been reached and should be false');\n"
 
 
 def gen_header(out):
@@ -110,21 +216,75 @@ async function logEthBalances (token, sale, accounts) {
     out.write(header + "\n")
 
 
-def gen_test_contract_header(out, params, seed):
+def gen_snapshot_helpers(out):
+    helpers = """
+function evmRpc (method, params) {
+    return new Promise(function(resolve, reject) {
+        web3.currentProvider.sendAsync({jsonrpc: "2.0", method: method, params: params || [], id: new Date().getTime()},
+            function(err, res) {
+                if (err) { reject(err); } else { resolve(res.result); }
+            });
+    });
+}
+
+function evmSnapshot () {
+    return evmRpc("evm_snapshot");
+}
+
+function evmRevert (snapshotId) {
+    return evmRpc("evm_revert", [snapshotId]);
+}
+"""
+    out.write(helpers + "\n")
+
+
+def gen_test_contract_header(out, params, seed, snapshot=False, users=USERS, chunked=False):
+    """
+    By default the sale is deployed again before every test case. With snapshot, it is deployed once in before()
+    and every test case starts by reverting the chain to the snapshot taken right after the deployment
+    (needs gen_snapshot_helpers). With chunked, every test case deploys its own sale (see gen_chunked_case_header).
+    The i-th of users is bound to the i-th account of the chain.
+    """
     params = ", ".join([str(i) for i in params])
     s = "contract('Fuzz Test " + str(seed) + "', function(accounts) {\n"
 
-    s += """
-        var owner = accounts[0];
-        var beneficiary = accounts[1];
-        var token_admin = accounts[2];
-        var user3 = accounts[3];
-        var user4 = accounts[4];
-        var flag = false;
+    s += "\n"
+    s += "".join(["        var " + user + " = accounts[" + str(i) + "];\n" for i, user in enumerate(users)])
+    s += """        var flag = false;
         var time = new Date().getTime() / 1000;
 
 
-        beforeEach(function() {
+"""
+    if chunked:
+        out.write(s)
+        return
+    if snapshot:
+        s += """        var deployed_sale;
+        var snapshot_id;
+
+        before(async function() {
+            token = await QuantstampToken.deployed();
+            token_address = token.address;
+"""
+        s += "            deployed_sale = await QuantstampSaleMock.new(" + params + ", token_address);\n"
+        s += """            initialSupply = await token.INITIAL_SUPPLY();
+            rate = await deployed_sale.rate();
+            token_owner = await token.owner();
+            snapshot_id = await evmSnapshot();
+        });
+
+        beforeEach(async function() {
+            // a snapshot can only be reverted to once, so take it again for the next test case
+            await evmRevert(snapshot_id);
+            snapshot_id = await evmSnapshot();
+            sale = deployed_sale;
+        });
+
+"""
+        out.write(s)
+        return
+
+    s += """        beforeEach(function() {
         return QuantstampToken.deployed().then(function(instance) {
             token = instance;
             return token.address;
@@ -151,15 +311,82 @@ def gen_test_contract_header(out, params, seed):
     out.write(s)
 
 
-def gen_test_case_header(out):
-    out.write("it('should pass the fuzz test', async function(){\n")
+def gen_checkpoint_helpers(out):
+    helpers = """
+function checkpointState (start, state) {
+    // the first values of state are relative to start, since the token is shared by all the test cases
+    return state.map(function(value, i) {
+        if (typeof value === "boolean") { return String(value); }
+        return (i < start.length ? value.minus(start[i]) : value).toFixed();
+    }).join(",");
+}
+"""
+    out.write(helpers + "\n")
+
+
+def gen_chunked_case_header(out, params, case, start_reads):
+    """
+    Open the describe block of a test case split into chunks (see gen_chunk_header), which all run on the sale
+    deployed in its before(); before() also reads the (var name, read) pairs of start_reads into variables of
+    the whole test case, and is left open for the code that restores a checkpoint (see gen_chunked_setup_footer).
+    The block is titled like the it block of an unchunked test case.
+    """
+    params = ", ".join([str(i) for i in params])
+    if case:
+        s = "describe('should pass the fuzz test " + str(case) + "', function(){\n"
+    else:
+        s = "describe('should pass the fuzz test', function(){\n"
+    s += """        // every chunk starts from the state the previous one left, so the first failure ends the test case
+        this.bail(true);
+"""
+    s += "        var " + ", ".join([var_name for var_name, _ in start_reads]) + ";\n"
+    s += """
+        before(async function() {
+            token = await QuantstampToken.deployed();
+            token_address = token.address;
+"""
+    s += "            sale = await QuantstampSaleMock.new(" + params + ", token_address);\n"
+    s += """            initialSupply = await token.INITIAL_SUPPLY();
+            rate = await sale.rate();
+            token_owner = await token.owner();
+            await token.setCrowdsale(sale.address, 0);
+"""
+    s += ("            [" + ", ".join([var_name for var_name, _ in start_reads]) + "] = await Promise.all([" +
+          ", ".join([read for _, read in start_reads]) + "]);\n")
+    out.write(s)
+
+
+def gen_chunked_setup_footer(out):
+    out.write("        });\n\n")
+
+
+def gen_chunk_header(out, chunk):
+    out.write("it('chunk " + str(chunk) + "', async function(){\n")
+
+
+def gen_test_case_header(out, case=0):
+    if case:
+        out.write("it('should pass the fuzz test " + str(case) + "', async function(){\n")
+    else:
+        out.write("it('should pass the fuzz test', async function(){\n")
     out.write("        await token.setCrowdsale(sale.address, 0);\n")
 
 
+def gen_tree_snapshot():
+    # the sale is saved as well, since a branch can deploy a new one
+    return ("var tree_sale = sale;\n"
+            "var tree_snapshot = await evmSnapshot();\n")
+
+
+def gen_tree_revert():
+    return ("await evmRevert(tree_snapshot);\n"
+            "tree_snapshot = await evmSnapshot();\n"
+            "sale = tree_sale;\n")
+
+
 def check_value(var_name, expr):
-    s = "var " + var_name + " = await " + expr + ";\n"
-    s += gen_log("'" + var_name + " = ' + " + var_name)
-    return s
+    yield "var " + var_name + " = await " + expr + ";\n"
+    yield gen_log("'" + var_name + " = ' + " + var_name)
 
 
 def gen_test_contract_footer(out):
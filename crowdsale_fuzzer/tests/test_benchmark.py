@@ -0,0 +1,22 @@
+import copy
+import io
+
+import benchmark
+
+
+def test_every_benchmark_reports_comparable_rates():
+    results = benchmark.run([10, 20], 5, repeat=1)
+    for verbose in [0, 1]:
+        for ops in [10, 20]:
+            assert results["gen_test/ops=%d/verbose=%d" % (ops, verbose)]["ops"] == ops
+        assert "gen_predefined_test/verbose=%d" % verbose in results
+        assert "op:fallback/verbose=%d" % verbose in results
+    assert results["helper:wrap_exception"]["ops"] == 5
+    for result in results.values():
+        assert result["ops_per_s"] > 0 and result["bytes_per_s"] > 0 and result["peak_rss_kb"] > 0
+
+    old = {"results": results}
+    new = copy.deepcopy(old)
+    new["results"]["gen_test/ops=20/verbose=1"]["ops_per_s"] *= 0.5
+    assert benchmark.compare(old, old, 0.1, io.StringIO()) == 0
+    assert benchmark.compare(old, new, 0.1, io.StringIO()) == 1
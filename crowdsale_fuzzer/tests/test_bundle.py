@@ -0,0 +1,27 @@
+import gzip
+import os
+
+import fuzzer
+from bundle import BUNDLE_FILE, INDEX_FILE, extract, read_index
+
+
+def test_a_test_extracted_from_a_bundle_is_the_one_generated_alone(tmp_path):
+    seeds = [1, 2, 3, 4, 5]
+    alone = str(tmp_path / "alone")
+    fuzzer.gen_batch(seeds, 1, alone, ops=10)
+    for compress in [False, True]:
+        bundle_dir = str(tmp_path / ("compressed" if compress else "plain"))
+        fuzzer.gen_bundles(seeds, 2, 1, bundle_dir, ops=10, compress=compress)
+        entries = read_index(bundle_dir)
+        assert sorted(entries) == seeds
+        tests = []
+        for seed in seeds:
+            with open(os.path.join(alone, fuzzer.test_file_name(seed))) as f:
+                tests.append(f.read())
+            assert extract(bundle_dir, entries[seed]) == tests[-1]
+        # 3 bundles of up to 2 tests, which are the concatenation of their tests
+        names = [BUNDLE_FILE % n + (".gz" if compress else "") for n in range(3)]
+        assert sorted(os.listdir(bundle_dir)) == sorted(names + [INDEX_FILE])
+        with open(os.path.join(bundle_dir, names[0]), "rb") as f:
+            data = f.read()
+        assert (gzip.decompress(data) if compress else data).decode() == tests[0] + tests[1]
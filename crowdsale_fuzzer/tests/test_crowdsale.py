@@ -0,0 +1,74 @@
+import io
+import random
+
+import fuzzer
+import test_writer
+from test_writer import Template, field, fragments
+
+
+def code_lines(s):
+    return [line.strip() for line in s.splitlines() if line.strip()]
+
+
+def test_paranoid_checks_are_the_state_after_each_operation(monkeypatch):
+    monkeypatch.setattr(fuzzer, "ASSERTIONS", "paranoid")
+    out = io.StringIO()
+    crowdsale = fuzzer.gen_predefined_test(out, random.Random(0))
+    lines = code_lines(out.getvalue())
+
+    # replay the operations on a new model: the checks after every operation must be the ones of the state of the
+    # model after it, in the order of the operations
+    model = fuzzer.new_crowdsale(random.Random(0), "paranoid")
+    position = 0
+    for index, (function_name, fail, parameters) in enumerate(crowdsale.trace):
+        model.replay(function_name, fail, parameters)
+        if function_name == "create_new_crowdsale":
+            continue
+        checks = code_lines("".join(fragments(model.final_checks())))
+        # the first line of the checks follows the code of the operation on the same line
+        start = next((i for i in range(position, len(lines))
+                      if lines[i].endswith(checks[0]) and lines[i + 1:i + len(checks)] == checks[1:]), None)
+        assert start is not None, "op %d %s: the checks are not the state of the model after it" % (index,
+                                                                                                     function_name)
+        position = start + len(checks)
+
+
+def test_paranoid_checks_of_a_purchase(monkeypatch):
+    monkeypatch.setattr(fuzzer, "ASSERTIONS", "paranoid")
+    out = io.StringIO()
+    fuzzer.gen_predefined_test(out, random.Random(0))
+    # the first operation of the predefined test buys for 0.2 ETH
+    first = next(line for line in code_lines(out.getvalue()) if "equals(final_amount_raised)" in line)
+    assert first.startswith("assert(new bigInt('2e+17')")
+
+
+def test_a_template_fills_in_the_code_it_is_built_from():
+    t = Template(fragments("var x = ", field("x"), "; // 100%\n", ("f(", field("y"), ");")))
+    assert t.fill({"x": "1", "y": "user3"}) == "var x = 1; // 100%\nf(user3);"
+
+
+def test_the_templates_built_for_other_tests_write_the_same_tests(monkeypatch):
+    # the key of a template must hold everything its code depends on, or a template built in another state is reused
+    def test(seed):
+        out = io.StringIO()
+        fuzzer.gen_test(out, 60, random.Random(seed))
+        return out.getvalue()
+    cold = []
+    for seed in range(30):
+        monkeypatch.setattr(test_writer, "TEMPLATES", {})
+        cold.append(test(seed))
+    monkeypatch.setattr(test_writer, "TEMPLATES", {})
+    assert [test(seed) for seed in range(30)] == cold
+
+
+def test_batched_reads_make_the_same_checks_in_two_round_trips(monkeypatch):
+    code = {}
+    for batch_reads in [False, True]:
+        monkeypatch.setattr(fuzzer, "BATCH_READS", batch_reads)
+        crowdsale = fuzzer.new_crowdsale(random.Random(0), "op")
+        code[batch_reads] = code_lines("".join(fragments(crowdsale.fallback(None, {"user": "user3",
+                                                                                   "wei": 2 * 10 ** 17}))))
+    awaits = [line for line in code[True] if "await" in line]
+    assert len(awaits) == 3 and "Promise.all" in awaits[0] and "Promise.all" in awaits[2]
+    assert len([line for line in code[False] if "await" in line]) == 11
+    assert [line for line in code[True] if "assert" in line] == [line for line in code[False] if "assert" in line]
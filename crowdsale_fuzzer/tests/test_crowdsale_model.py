@@ -0,0 +1,100 @@
+import io
+import random
+
+import fuzzer
+from crowdsale_fuzzer import ETHER
+from engine import INVARIANTS
+from scheduler import CoverageScheduler
+from test_writer import fragments
+
+
+def drain_allowance(crowdsale, left):
+    # allocate all the allowance of the crowdsale but left mini-QSP
+    crowdsale.owner_allocate_tokens(None, {"user": "owner", "to_user": "user3", "amount_wei": 0,
+                                           "amount_mini_qsp": crowdsale.token.crowdsale_allowance - left})
+
+
+def test_purchase_above_allowance_is_rejected():
+    model = fuzzer.new_model(random.Random(0))
+    drain_allowance(model, ETHER)
+    state = model.state_key()
+    # 1 ETH buys 5000 ETH worth of mini-QSP at the starting rate
+    model.fallback(None, {"user": "user4", "wei": ETHER})
+    assert model.state_key() == state
+    assert model.token.crowdsale_allowance == ETHER
+
+    model.fallback(None, {"user": "user4", "wei": ETHER // model.rate})
+    assert model.token.crowdsale_allowance == 0
+
+
+def test_purchase_above_allowance_is_expected_to_fail():
+    crowdsale = fuzzer.new_crowdsale(random.Random(0), "op")
+    drain_allowance(crowdsale, ETHER)
+    code = "".join(fragments(crowdsale.fallback(None, {"user": "user4", "wei": ETHER})))
+    assert "cannot buy more tokens than the allowance of the crowdsale" in code
+
+    op_list = fuzzer.new_op_list(random.Random(0), "op")
+    drain_allowance(op_list, ETHER)
+    function_name, fail, parameters, throws, changes = op_list.fallback(None, {"user": "user4", "wei": ETHER})
+    assert throws and changes == []
+
+
+def test_zero_allocation_transfers_no_tokens():
+    model = fuzzer.new_model(random.Random(0))
+    model.owner_allocate_tokens(None, {"user": "owner", "to_user": "user3", "amount_wei": ETHER,
+                                       "amount_mini_qsp": 0})
+    assert model.token.crowdsale_allowance == model.token.initial_crowdsale_allowance
+    assert model.amount_raised == ETHER
+
+
+def test_long_random_runs_keep_the_invariants():
+    for scheduler in [None, CoverageScheduler(fuzzer.UNSUPPORTED_VECTORS)]:
+        crowdsale = fuzzer.gen_test(io.StringIO(), 10000, random.Random(3), scheduler)
+        assert len(crowdsale.trace) >= 10000
+        for invariant in INVARIANTS:
+            assert invariant(crowdsale), invariant.__name__
+
+
+def test_a_copy_is_independent_and_keys_like_the_original():
+    model = fuzzer.new_model(random.Random(0))
+    state = model.state_key()
+    copy = model.copy()
+    assert copy.state_key() == state and hash(copy.state_key()) == hash(state)
+    copy.fallback(None, {"user": "user4", "wei": ETHER // 5})
+    assert copy.state_key() != state
+    assert model.state_key() == state
+
+    # accounts are interned on first use, and the zeros of an account that was never credited are not state
+    assert "user9" not in model.accounts
+    model.owner_allocate_tokens(None, {"user": "owner", "to_user": "user9", "amount_wei": 0, "amount_mini_qsp": 0})
+    assert model.accounts.name(len(model.accounts) - 1) == "user9"
+    assert len(model.balance) == len(model.accounts)
+    assert model.state_key() == state
+
+
+def run_random_ops(model, rng, ops):
+    done = 0
+    while done < ops:
+        op = fuzzer.choose_op(model, rng)
+        if op is not None and op[0].function(op[1]) is not None:
+            done += 1
+
+
+def test_restore_brings_back_the_state_of_the_fork():
+    for seed in range(100):
+        rng = random.Random(seed)
+        model = fuzzer.new_model(rng)
+        run_random_ops(model, rng, rng.randint(0, 20))
+        state, trace = model.state_key(), list(model.trace)
+        snapshot = model.fork()
+        for branch in range(3):
+            if branch == 1:
+                model.change_time(model.endTime + 1)
+            run_random_ops(model, rng, rng.randint(1, 20))
+            model.restore(snapshot)
+            assert model.state_key() == state and model.trace == trace, "seed %d, branch %d" % (seed, branch)
+        # the branches did not write through to the state the prefix leads to
+        replayed = fuzzer.new_model(random.Random(0))
+        for op in trace:
+            replayed.replay(*op)
+        assert replayed.state_key() == state, "seed %d" % seed
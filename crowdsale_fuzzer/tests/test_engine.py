@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+import fuzzer
+from crowdsale_fuzzer import ETHER
+from engine import AUDIT_INVARIANTS, ModelFailure, dry_run, random_sequence, run_sequence
+from solidity_entities.crowdsale_model import CrowdsaleModel
+
+
+def test_random_sequences_run_to_their_length():
+    assert dry_run(range(200), 50, AUDIT_INVARIANTS) == {}
+    sequence = random_sequence(random.Random(1), 50)
+    assert len(sequence) == 50
+    assert not {(function_name, fail) for function_name, fail, _ in sequence} & set(fuzzer.UNSUPPORTED_VECTORS)
+
+
+def test_replayed_sequences_reach_the_same_state():
+    sequence = random_sequence(random.Random(2), 30)
+    model = run_sequence(sequence)
+    assert model.trace == sequence
+
+
+def test_crashes_are_located_at_their_operation():
+    sequence = random_sequence(random.Random(3), 5) + [("owner_unlock_fund", "afterDeadline", {"user": "owner"})]
+    with pytest.raises(ModelFailure) as e:
+        run_sequence(sequence)
+    assert (e.value.kind, e.value.index, e.value.function_name, e.value.fail) == ("SystemExit", 5, "owner_unlock_fund",
+                                                                                  "afterDeadline")
+
+
+def test_a_broken_conservation_law_is_reported_at_the_first_op_that_breaks_it(monkeypatch):
+    purchase = CrowdsaleModel.update_state_with_purchase
+
+    def leaky_purchase(model, user, wei, mini_qsp):
+        purchase(model, user, wei, mini_qsp)
+        if wei:
+            # a wei that the sale balances do not account for
+            model.amount_raised += 1
+    monkeypatch.setattr(CrowdsaleModel, "update_state_with_purchase", leaky_purchase)
+    sequence = [("set_rate", None, {"user": "owner", "rate": 6000}),
+                ("owner_allocate_tokens", None, {"user": "owner", "to_user": "user3", "amount_wei": 0,
+                                                 "amount_mini_qsp": ETHER}),
+                ("fallback", None, {"user": "user4", "wei": ETHER // 5}),
+                ("fallback", None, {"user": "user3", "wei": ETHER // 5})]
+    with pytest.raises(ModelFailure) as e:
+        run_sequence(sequence)
+    assert (e.value.kind, e.value.message, e.value.index, e.value.function_name) == \
+        ("invariant", "sale_balances_match_amount_raised", 2, "fallback")
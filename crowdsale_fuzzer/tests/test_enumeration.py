@@ -0,0 +1,27 @@
+from enumeration import Enumerator
+
+
+def test_the_first_step_tries_every_vector_and_one_fresh_basic_user():
+    enumerator = Enumerator(1).run()
+    tried = {(function_name, fail): count for (function_name, fail, _), count in enumerator.coverage.items()}
+    # the sale is open and not paused at the start
+    unreachable = {("fallback", "whenNotPaused"), ("fallback", "beforeDeadline"), ("fallback", "saleNotClosed")}
+    assert set(tried) == set(enumerator.vectors) - unreachable
+    # user3 and user4 have not bought anything, so only user3 is tried
+    assert tried[("fallback", None)] == 1
+    assert tried[("owner_allocate_tokens", None)] == len(["beneficiary", "token_admin", "user3"])
+
+
+def test_every_abstract_state_is_expanded_once():
+    for strategy in ["bfs", "dfs"]:
+        enumerator = Enumerator(3, with_time=True).run(strategy)
+        assert enumerator.complete and not enumerator.failures
+        assert max(enumerator.visited.values()) <= 3
+    bfs = Enumerator(3, with_time=True).run("bfs")
+    assert bfs.expanded == len([depth for depth in bfs.visited.values() if depth < 3])
+
+
+def test_the_enumeration_stops_within_its_budget():
+    enumerator = Enumerator(3, with_time=True, max_states=5).run()
+    assert not enumerator.complete
+    assert len(enumerator.visited) <= 5 + len(enumerator.vectors) + 3
@@ -0,0 +1,60 @@
+import io
+import shutil
+import subprocess
+
+import pytest
+
+import fuzzer
+from fake_node import FakeNode
+
+# runs the hooks of a generated test under node, with the contracts and the test cases stubbed out, so that only
+# the calls of the test to the chain (through web3.currentProvider) are made, here to the fake node at argv[3]
+HOOKS_RUNNER = """
+const fs = require("fs");
+const http = require("http");
+const vm = require("vm");
+const [path, url] = process.argv.slice(2);
+
+function sendAsync(payload, callback) {
+    const data = JSON.stringify(payload);
+    const request = http.request(url, {method: "POST", headers: {"Content-Type": "application/json"}}, response => {
+        let body = "";
+        response.on("data", chunk => body += chunk);
+        response.on("end", () => callback(null, JSON.parse(body)));
+    });
+    request.on("error", callback);
+    request.end(data);
+}
+
+// a contract whose every property and call is itself, awaited or not
+const dummy = new Proxy(function() {}, {get: (target, name) => name === "then" ? undefined : dummy,
+                                        apply: () => dummy});
+const before = [], beforeEach = [], tests = [];
+vm.runInNewContext(fs.readFileSync(path, "utf8"), {
+    artifacts: {require: () => dummy}, require: () => dummy, web3: {currentProvider: {sendAsync}},
+    console: {log() {}}, contract: (name, body) => body(["0x1", "0x2", "0x3", "0x4", "0x5"]),
+    before: hook => before.push(hook), beforeEach: hook => beforeEach.push(hook), it: name => tests.push(name)});
+(async () => {
+    for (const hook of before) await hook();
+    for (const name of tests) for (const hook of beforeEach) await hook();
+})().catch(e => { console.error(e); process.exit(1); });
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_snapshot_test_reverts_to_a_fresh_snapshot_for_every_case(tmp_path):
+    out = io.StringIO()
+    fuzzer.gen_test_file(out, 5, 5, cases=3, snapshot=True)
+    test = tmp_path / "fuzz_test.5.js"
+    test.write_text(out.getvalue())
+    runner = tmp_path / "hooks_runner.js"
+    runner.write_text(HOOKS_RUNNER)
+    with FakeNode() as node:
+        subprocess.run(["node", str(runner), str(test), node.url], check=True, timeout=60)
+    calls = [call for call in node.calls if call[0].startswith("evm_")]
+    # the deployment is snapshotted once, and every test case reverts to the last snapshot and takes a new one
+    assert calls == [("evm_snapshot", []),
+                     ("evm_revert", ["0x1"]), ("evm_snapshot", []),
+                     ("evm_revert", ["0x2"]), ("evm_snapshot", []),
+                     ("evm_revert", ["0x3"]), ("evm_snapshot", [])]
+    assert node.snapshots == ["0x4"]
@@ -0,0 +1,112 @@
+import json
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import fuzzer
+from results import LINE_MAP_FILE
+from traces import TRACE_FILE, read_traces
+
+
+def seeds_of(path):
+    with open(path) as f:
+        return [json.loads(line)["seed"] for line in f]
+
+
+def test_batch_maps_and_traces_only_the_files_dedup_keeps(tmp_path):
+    dedup_index = str(tmp_path / "dedup.db")
+    first, second = str(tmp_path / "first"), str(tmp_path / "second")
+    fuzzer.gen_batch([1, 2], 1, first, ops=5, dedup_index=dedup_index, line_map=True, traces=True)
+    # the test of seed 2 is the same as the one already generated in first
+    results = fuzzer.gen_batch([2, 3], 1, second, ops=5, dedup_index=dedup_index, line_map=True, traces=True)
+    assert [result["seed"] for result in results] == [3]
+    assert sorted(os.listdir(second)) == sorted([LINE_MAP_FILE, TRACE_FILE, fuzzer.test_file_name(3)])
+    assert seeds_of(os.path.join(second, LINE_MAP_FILE)) == [3]
+    assert seeds_of(os.path.join(second, TRACE_FILE)) == [3]
+
+
+
+def test_the_same_sequence_under_another_config_is_not_a_duplicate(tmp_path, monkeypatch):
+    dedup_index = str(tmp_path / "dedup.db")
+    assert len(fuzzer.gen_batch([1], 1, str(tmp_path / "first"), ops=5, dedup_index=dedup_index)) == 1
+    assert fuzzer.gen_batch([1], 1, str(tmp_path / "again"), ops=5, dedup_index=dedup_index) == []
+    monkeypatch.setattr(fuzzer, "ASSERTIONS", "paranoid")
+    assert len(fuzzer.gen_batch([1], 1, str(tmp_path / "paranoid"), ops=5, dedup_index=dedup_index)) == 1
+
+
+def test_a_test_only_depends_on_its_seed(tmp_path):
+    # e.g. in a shard of the campaign, or when the manifest only generates the tests that changed
+    fuzzer.gen_batch([1, 2, 3], 1, str(tmp_path / "all"), ops=20)
+    fuzzer.gen_batch([2], 1, str(tmp_path / "one"), ops=20)
+    name = fuzzer.test_file_name(2)
+    assert (tmp_path / "one" / name).read_text() == (tmp_path / "all" / name).read_text()
+
+
+class NoDraws(random.Random):
+    def random(self):
+        raise AssertionError("drew from the random number generator")
+
+    def getrandbits(self, k):
+        raise AssertionError("drew from the random number generator")
+
+
+def test_a_replay_writes_the_original_test_without_drawing(tmp_path, monkeypatch):
+    original, replayed = str(tmp_path / "original"), tmp_path / "replayed"
+    fuzzer.gen_batch([1, 2, 3], 1, original, ops=30, traces=True)
+    replayed.mkdir()
+    monkeypatch.setattr(fuzzer, "RNG", NoDraws())
+    for seed, entry in read_traces(os.path.join(original, TRACE_FILE)).items():
+        fuzzer.write_trace_file(entry, str(replayed))
+        name = fuzzer.test_file_name(seed)
+        with open(os.path.join(original, name)) as f:
+            assert (replayed / name).read_text() == f.read()
+
+
+def test_the_contract_parameters_follow_the_model(monkeypatch):
+    for name in ["CROWDSALE_PARAMETERS", "CROWDSALE_CONTRACT_PARAMETERS"]:
+        monkeypatch.setattr(fuzzer, name, getattr(fuzzer, name))
+    fuzzer.configure({"crowdsale_parameters": ["owner", "beneficiary", "token_admin", 30, 40, 2, 1000, 5, 6000]})
+    assert fuzzer.CROWDSALE_CONTRACT_PARAMETERS == ["beneficiary", 30, 40, 2, 1000, 5, 6000]
+
+
+def test_options_that_would_be_ignored_are_rejected(tmp_path):
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"crowdsale_contract_parameters": ["beneficiary", 30, 40, 2, 1000, 5, 6000]}))
+    for argv in [["--config", str(config)], ["--jobs", "2"]]:
+        with pytest.raises(SystemExit):
+            fuzzer.parse_args(argv)
+
+
+# runs fuzzer.py as a script with worker pools started by spawn, which only get the state init_worker passes them
+SPAWN_FUZZER = """
+import multiprocessing, runpy, sys
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
+    sys.argv = sys.argv[1:]
+    runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def run_fuzzer(tmp_path, out_dir, jobs):
+    script = tmp_path / "spawn_fuzzer.py"
+    script.write_text(SPAWN_FUZZER)
+    here = os.path.dirname(os.path.abspath(fuzzer.__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([here, os.path.dirname(here)]))
+    subprocess.run([sys.executable, str(script), fuzzer.__file__, "--count", "3", "--ops", "5", "--seed", "7",
+                    "--quiet", "--users", "owner", "beneficiary", "token_admin", "user9", "--jobs", str(jobs),
+                    "--out-dir", out_dir, "--profile", os.path.join(out_dir, "profile.json")],
+                   env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    tests = {name: open(os.path.join(out_dir, name)).read() for name in os.listdir(out_dir) if name.endswith(".js")}
+    with open(os.path.join(out_dir, "profile.json")) as f:
+        return tests, {row["key"] for row in json.load(f)}
+
+
+def test_spawned_workers_use_the_state_of_the_parent(tmp_path):
+    serial_tests, serial_profile = run_fuzzer(tmp_path, str(tmp_path / "serial"), 1)
+    spawned_tests, spawned_profile = run_fuzzer(tmp_path, str(tmp_path / "spawned"), 2)
+    assert len(serial_tests) == 3 and "user9" in "".join(serial_tests.values())
+    assert spawned_tests == serial_tests
+    assert spawned_profile == serial_profile
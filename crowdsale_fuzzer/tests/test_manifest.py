@@ -0,0 +1,24 @@
+import glob
+import os
+import shutil
+
+import manifest
+from manifest import GENERATOR_SOURCES, generator_hash
+
+
+def test_generator_sources_exist():
+    for pattern in GENERATOR_SOURCES:
+        assert glob.glob(os.path.join(manifest.HERE, pattern)), pattern
+
+
+def test_generator_hash_covers_the_interpreter(tmp_path, monkeypatch):
+    for pattern in GENERATOR_SOURCES:
+        for path in glob.glob(os.path.join(manifest.HERE, pattern)):
+            target = tmp_path / os.path.relpath(path, manifest.HERE)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(path, str(target))
+    monkeypatch.setattr(manifest, "HERE", str(tmp_path))
+    before = generator_hash()
+    with open(str(tmp_path / "fuzz_interpreter.js"), "a") as f:
+        f.write("\n")
+    assert generator_hash() != before
@@ -0,0 +1,61 @@
+import io
+import json
+import sys
+
+import pytest
+
+import fuzzer
+import op_lists
+
+
+def op_list(monkeypatch, seed, ops):
+    monkeypatch.setattr(fuzzer, "BACKEND", "json")
+    out = io.StringIO()
+    fuzzer.gen_test_file(out, seed, ops)
+    return json.loads(out.getvalue())
+
+
+def test_op_lists_of_the_model_are_valid(monkeypatch):
+    assert op_lists.validate(op_list(monkeypatch, 5, 20)) == []
+
+
+def test_tampered_op_lists_are_rejected(monkeypatch):
+    test = op_list(monkeypatch, 5, 20)
+    test["cases"][0]["start"][12] = "1"
+    assert op_lists.validate(test) == ["case 0: the start values are not the ones of the model"]
+
+    test = op_list(monkeypatch, 5, 20)
+    # the change of a balance written by an operation
+    delta = next(delta for op in test["cases"][0]["ops"] for delta in op[2] if delta[1].lstrip("-").isdigit())
+    delta[1] = str(int(delta[1]) + 1)
+    errors = op_lists.validate(test)
+    assert len(errors) == 1 and " instead of " in errors[0]
+
+
+def test_unreadable_op_lists_are_invalid(tmp_path, monkeypatch, capsys):
+    broken = tmp_path / "fuzz_test.1.json"
+    broken.write_text("{")
+    missing = str(tmp_path / "fuzz_test.2.json")
+    monkeypatch.setattr(sys, "argv", ["op_lists.py", str(broken), missing])
+    with pytest.raises(SystemExit) as e:
+        op_lists.main()
+    assert e.value.code == 1
+    out, err = capsys.readouterr()
+    assert out.startswith(str(broken) + ": cannot read the op list: ")
+    assert missing + ": cannot read the op list: [Errno 2]" in out
+    assert err == "2 op lists, 2 invalid\n"
+
+
+def test_malformed_op_lists_are_invalid(tmp_path, monkeypatch, capsys):
+    paths = []
+    for seed, content in [(1, '{"seed": 1, "users": []}'), (2, "[]"), (3, '{"contract_parameters": 1}')]:
+        path = tmp_path / ("fuzz_test.%d.json" % seed)
+        path.write_text(content)
+        paths.append(str(path))
+    monkeypatch.setattr(sys, "argv", ["op_lists.py"] + paths)
+    with pytest.raises(SystemExit):
+        op_lists.main()
+    out, err = capsys.readouterr()
+    assert out.split("\n")[0] == paths[0] + ": malformed op list: KeyError 'contract_parameters'"
+    assert [line.split(": ")[1] for line in out.split("\n")[:-1]] == ["malformed op list"] * 3
+    assert err == "3 op lists, 3 invalid\n"
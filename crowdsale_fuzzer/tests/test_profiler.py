@@ -0,0 +1,24 @@
+import io
+import random
+
+import fuzzer
+import test_writer
+from profiler import Profiler
+
+
+def test_the_profile_of_built_templates_is_in_their_fills():
+    fill = test_writer.Template.fill
+    profiler = Profiler()
+    profiler.instrument(vars(fuzzer))
+    try:
+        fuzzer.gen_test(io.StringIO(), 50, random.Random(1))
+        profiler.take()
+        # the templates of the ops are built by now, so the ops only fill them
+        fuzzer.gen_test(io.StringIO(), 50, random.Random(1))
+        stats = profiler.take()
+    finally:
+        profiler.uninstrument()
+    assert test_writer.Template.fill is fill
+    assert stats["test_writer.Template.fill"][0] >= 50
+    assert stats["test_writer.template"][0] >= 50
+    assert "test_writer.wrap_exception" not in stats
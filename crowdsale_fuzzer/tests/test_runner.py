@@ -0,0 +1,58 @@
+import shlex
+import socket
+import sys
+
+import pytest
+
+import runner
+
+# a test command that prints the url of its node and fails the files that say so
+FAKE_TEST = """
+import os, sys
+print(os.environ["FUZZ_NODE_URL"])
+sys.exit(open(sys.argv[1]).read() == "fail")
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_runner_runs_every_file_on_a_fake_node(tmp_path):
+    for seed, content in [(1, "pass"), (2, "fail")]:
+        (tmp_path / ("fuzz_test.%d.js" % seed)).write_text(content)
+    script = tmp_path / "fake_test.py"
+    script.write_text(FAKE_TEST)
+    port = free_port()
+    command = shlex.quote(sys.executable) + " " + shlex.quote(str(script)) + " {file}"
+    pool = runner.Runner(runner.FAKE_NODE_COMMAND, command, base_port=port, timeout=60,
+                         output_dir=str(tmp_path / "logs"))
+    results = pool.run(runner.test_files(str(tmp_path)))
+    assert [(result["seed"], result["status"], result["attempts"]) for result in results] == [(1, "pass", 1),
+                                                                                           (2, "fail", 1)]
+    assert (tmp_path / "logs" / "2.log").read_text() == "http://127.0.0.1:%d\n" % port
+
+
+def test_op_lists_and_bundles_are_run(tmp_path):
+    (tmp_path / "fuzz_test.3.json").write_text("{}")
+    (tmp_path / runner.INTERPRETER_FILE).write_text("pass")
+    (tmp_path / "fuzz_bundle.0.js").write_text("fail")
+    (tmp_path / "fuzz_lines.jsonl").write_text("")
+    script = tmp_path / "fake_test.py"
+    # prints the op list the interpreter is asked to run
+    script.write_text(FAKE_TEST.replace('os.environ["FUZZ_NODE_URL"]', 'os.environ.get("FUZZ_OP_LIST")'))
+    command = shlex.quote(sys.executable) + " " + shlex.quote(str(script)) + " {file}"
+    pool = runner.Runner(runner.FAKE_NODE_COMMAND, command, base_port=free_port(), timeout=60,
+                         output_dir=str(tmp_path / "logs"))
+    results = pool.run(runner.test_files(str(tmp_path)))
+    assert [(result["seed"], result["status"]) for result in results] == [(3, "pass"), (None, "fail")]
+    assert (tmp_path / "logs" / "3.log").read_text() == "fuzz_test.3.json\n"
+    assert (tmp_path / "logs" / "fuzz_bundle.0.js.log").read_text() == "None\n"
+
+
+def test_compressed_bundles_are_rejected(tmp_path):
+    (tmp_path / "fuzz_bundle.0.js.gz").write_bytes(b"")
+    with pytest.raises(ValueError):
+        runner.test_files(str(tmp_path))
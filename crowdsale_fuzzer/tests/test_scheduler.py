@@ -0,0 +1,18 @@
+import io
+import random
+
+import fuzzer
+from scheduler import all_states, all_vectors, coverage_report
+
+
+def test_coverage_is_reported_over_every_abstract_state():
+    vectors = all_vectors(fuzzer.new_model(random.Random(0)).functions, fuzzer.UNSUPPORTED_VECTORS)
+    ongoing = (False, False, False, False, "ongoing")
+    out = io.StringIO()
+    coverage_report({vectors[0] + (ongoing,): 3, vectors[1] + (ongoing,): 1}, vectors, out)
+    lines = out.getvalue().split("\n")
+    assert len(all_states()) == 48
+    assert lines[0] == "coverage: 2/%d (function, fail, state) tuples over 48 states, 1 reached" % (len(vectors) * 48)
+    assert lines[1].endswith(" 3 dispatches,  1/48 states")
+    assert lines[3].endswith(" 0 dispatches,  0/48 states, missing in reached states: ongoing")
+    assert lines[-2].startswith("  never reached: beforeStart, afterEnd, cap/beforeStart")
@@ -0,0 +1,55 @@
+import random
+import shlex
+import sys
+
+import fuzzer
+from shrinker import ChainOracle, Shrinker
+
+# a test command that fails at the first setRate of the test it is given, or else at its first terminate,
+# and reports the failure with the TAP reporter
+FAKE_TRUFFLE = """
+import sys
+path = sys.argv[1]
+lines = open(path).read().split("\\n")
+for call, message in [("await sale.setRate(", "the rate should be set to the new value"),
+                      ("await sale.terminate(", "sale should be closed after owner terminates it")]:
+    for number, line in enumerate(lines, 1):
+        if call in line:
+            print("not ok 1 Contract: Fuzz Test 5 should pass the fuzz test")
+            print("  " + message)
+            print("  at Context.<anonymous> (" + path + ":%d:9)" % number)
+            sys.exit(1)
+print("ok 1 Contract: Fuzz Test 5 should pass the fuzz test")
+"""
+
+
+def oracle(tmp_path):
+    script = tmp_path / "fake_truffle.py"
+    script.write_text(FAKE_TRUFFLE)
+    return ChainOracle(shlex.quote(sys.executable) + " " + shlex.quote(str(script)) + " {file}", str(tmp_path), 5)
+
+
+def sequence():
+    model = fuzzer.new_model(random.Random(0))
+    model.fallback(None, {"user": "user3", "wei": 10 ** 17})
+    model.set_rate(None, {"user": "owner", "rate": 6000})
+    model.terminate(None, {"user": "owner"})
+    return model.trace
+
+
+def test_oracle_needs_the_same_failure(tmp_path):
+    chain = oracle(tmp_path)
+    ops = sequence()
+    assert chain(ops)
+    assert chain.failure == ("set_rate", None, "the rate should be set to the new value")
+    assert chain([ops[1]])
+    # fails, but at another operation
+    assert not chain([ops[0], ops[2]])
+    # passes
+    assert not chain([ops[0]])
+
+
+def test_shrink_keeps_the_failing_op(tmp_path):
+    shrunk = Shrinker(oracle(tmp_path)).shrink(sequence())
+    assert [function_name for function_name, _, _ in shrunk] == ["set_rate"]
+    assert shrunk[0][2]["rate"] == 5000
@@ -0,0 +1,25 @@
+from test_writer import INDENT, write_fragments, wrap_exception
+
+
+class Recorder:
+    def __init__(self, events):
+        self.events = events
+
+    def write(self, s):
+        self.events.append(("write", s))
+
+
+def test_fragments_are_indented_and_written_as_they_are_made():
+    events = []
+
+    def op():
+        for fragment in ["await sale.", "terminate();\nvar x = 1;", "\n"]:
+            events.append(("made", fragment))
+            yield fragment
+
+    write_fragments(Recorder(events), wrap_exception(op(), "only the owner can terminate"))
+    code = "".join(wrap_exception(["await sale.terminate();\nvar x = 1;\n"], "only the owner can terminate"))
+    assert "".join(s for kind, s in events if kind == "write") == INDENT + code.replace("\n", "\n" + INDENT) + "\n"
+    # the first fragment of the op is written before the op makes the next one
+    made = [i for i, (kind, _) in enumerate(events) if kind == "made"]
+    assert events[made[0] + 1] == ("write", "await sale.")
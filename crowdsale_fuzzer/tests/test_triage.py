@@ -0,0 +1,32 @@
+import fuzzer
+from results import ResultIndex
+from scheduler import format_state
+from triage import Triage, replay_state
+
+OPS = 30
+MESSAGE = "the sale balance of the user should increase after contributing"
+
+
+def test_failures_are_bucketed_by_signature_with_the_shortest_representative(tmp_path):
+    failures = []
+    expected = {}  # state -> [seeds, representative (length, seed)]
+    for seed in range(2, 9):
+        trace = fuzzer.record_sequence(seed, OPS)
+        op_index = next(i for i, (function_name, fail, _) in enumerate(trace) if function_name == "fallback" and
+                        fail is None)
+        # the same assertion with the values of every seed
+        message = MESSAGE + ": %d" % seed
+        failures.append((seed, 0, op_index, "fallback", None, message, None, "run"))
+        bucket = expected.setdefault(format_state(replay_state(trace, op_index)), [set(), (OPS + 1, None)])
+        bucket[0].add(seed)
+        bucket[1] = min(bucket[1], (op_index + 1, seed))
+    assert len(expected) < len(failures)
+
+    with ResultIndex(str(tmp_path / "results.db")) as index:
+        index.connection.executemany("INSERT INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?)", failures)
+        triage = Triage(index)
+        assert triage.bucket(ops=OPS, jobs=1) == len(expected)
+        for _, message, function_name, fail, state, count, seeds, seed, case, _, length, _, _ in triage.buckets():
+            assert (message, function_name, fail) == (MESSAGE + ": N", "fallback", None)
+            assert count == seeds == len(expected[state][0])
+            assert (length, seed) == expected[state][1]
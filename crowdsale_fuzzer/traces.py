@@ -0,0 +1,66 @@
+import json
+import os
+
+# the traces of the tests of a directory, one JSON {"seed", "ops", "cases"} per line (see trace_entry)
+TRACE_FILE = "fuzz_traces.jsonl"
+
+
+def trace_entry(seed, crowdsales):
+    """
+    The trace of the test of seed: for every test case (every branch of a tree), the (function name, fail,
+    parameters) of its operations (see CrowdsaleModel.trace). Besides the parameters of the model and the settings
+    of the emitter, this is all the test depends on, so replay.py regenerates the test from it without the RNG.
+    Every distinct (function name, fail, parameter names) is written once in ops, and every operation of cases as
+    [its index in ops] + the values of its parameters.
+    """
+    ops = []
+    codes = {}
+    cases = []
+    for crowdsale in crowdsales:
+        case = []
+        for function_name, fail, parameters in crowdsale.trace:
+            # the names keep the order of the parameters, which the logs of the calls print
+            names = tuple(parameters)
+            code = codes.get((function_name, fail, names))
+            if code is None:
+                code = codes[(function_name, fail, names)] = len(ops)
+                ops.append([function_name, fail, list(names)])
+            case.append([code] + [parameters[name] for name in names])
+        cases.append(case)
+    return {"seed": seed, "ops": ops, "cases": cases}
+
+
+def decode(entry):
+    """
+    The cases of a trace entry as lists of (function name, fail, parameters)
+    """
+    ops = entry["ops"]
+    cases = []
+    for case in entry["cases"]:
+        decoded = []
+        for op in case:
+            function_name, fail, names = ops[op[0]]
+            decoded.append((function_name, fail, dict(zip(names, op[1:]))))
+        cases.append(decoded)
+    return cases
+
+
+def write_traces(out_dir, entries):
+    """
+    Append the traces of entries to the traces of out_dir; the last entry of a seed is the current one
+    """
+    with open(os.path.join(out_dir, TRACE_FILE), "a") as out:
+        for entry in entries:
+            out.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+
+def read_traces(path):
+    """
+    {seed: {"seed", "cases"}} of a trace file, with the cases decoded (see decode)
+    """
+    entries = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            entries[entry["seed"]] = {"seed": entry["seed"], "cases": decode(entry)}
+    return entries
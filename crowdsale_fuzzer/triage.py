@@ -0,0 +1,216 @@
+import argparse
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+from functools import partial
+from multiprocessing import Pool
+
+import fuzzer
+from results import ResultIndex
+from scheduler import abstract_state, format_state
+
+
+def message_signature(message):
+    # strip the numbers so that the same assertion with different values falls in the same bucket
+    return re.sub(r"-?\d+", "N", message or "")
+
+
+def replay_state(trace, length):
+    """
+    The abstract state of the model after the first length operations of trace
+    """
+    model = fuzzer.new_model(random.Random(0))
+    for function_name, fail, parameters in trace[:length]:
+        model.replay(function_name, fail, dict(parameters))
+    return abstract_state(model)
+
+
+def failure_states(seed, failures, ops=None, cases=1):
+    """
+    Regenerate the test of seed once and return, for every (case, op index, function name) of failures, the
+    abstract state of the model at the failing operation and the length of the sequence that reproduces the
+    failure (None, None when the failure was not mapped to an operation)
+    """
+    with open(os.devnull, "w") as out:
+        crowdsales, _ = fuzzer.gen_test_file(out, seed, ops, cases)
+    states = []
+    for case, op_index, function_name in failures:
+        if case is None or case >= len(crowdsales):
+            states.append((None, None))
+            continue
+        trace = crowdsales[case].trace
+        reproduction = None
+        if function_name == "end_checks":
+            length = len(trace)
+        elif function_name == "start_checks":
+            length = 0
+        elif function_name == "checkpoint":
+            # the op index of a checkpoint is the number of operations before it
+            length = reproduction = op_index
+        elif op_index is not None:
+            length = op_index
+            # the failing operation itself is part of the reproduction, but the state is the one it started from
+            reproduction = length + 1
+        else:
+            states.append((None, None))
+            continue
+        states.append((format_state(replay_state(trace, length)), length if reproduction is None else reproduction))
+    return states
+
+
+class Triage:
+    """
+    Groups the failures of a ResultIndex into buckets of the same signature: the assertion message (without
+    numbers), the function and fail vector of the operation that emitted it and the abstract model state at that
+    operation. The representative of a bucket is its failure with the shortest reproduction, which can be
+    written as a test of its own and run once for the whole bucket.
+    """
+    def __init__(self, index):
+        self.connection = index.connection
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER PRIMARY KEY, message TEXT, function TEXT, fail TEXT,
+                                                state TEXT, failures INTEGER, seeds INTEGER, seed INTEGER,
+                                                case_index INTEGER, op_index INTEGER, length INTEGER, file TEXT,
+                                                verified TEXT);
+            CREATE TABLE IF NOT EXISTS failure_buckets (seed INTEGER, case_index INTEGER, op_index INTEGER,
+                                                        bucket INTEGER);
+            CREATE INDEX IF NOT EXISTS failure_buckets_bucket ON failure_buckets (bucket);
+            CREATE INDEX IF NOT EXISTS failure_buckets_seed ON failure_buckets (seed);
+        """)
+
+    def bucket(self, ops=None, cases=1, jobs=None):
+        """
+        Replace the buckets with the ones of the current failures
+        """
+        failures = {}
+        for seed, case, op_index, function_name, fail, message in self.connection.execute(
+                "SELECT seed, case_index, op_index, function, fail, message FROM failures WHERE seed IS NOT NULL"):
+            failures.setdefault(seed, []).append((case, op_index, function_name, fail, message))
+        seeds = sorted(failures)
+        worker = partial(failure_states, ops=ops, cases=cases)
+        arguments = [[(case, op_index, function_name) for case, op_index, function_name, _, _ in failures[seed]]
+                     for seed in seeds]
+        if jobs == 1:
+            states = [worker(seed, i) for seed, i in zip(seeds, arguments)]
+        else:
+            with Pool(jobs, fuzzer.init_worker, fuzzer.worker_state()) as pool:
+                states = pool.starmap(worker, zip(seeds, arguments))
+
+        buckets = {}  # signature -> [failures, seeds, representative (length, seed, case, op index)]
+        members = []
+        for seed, seed_states in zip(seeds, states):
+            for (case, op_index, function_name, fail, message), (state, length) in zip(failures[seed], seed_states):
+                signature = (message_signature(message), function_name, fail, state)
+                bucket = buckets.setdefault(signature, [0, set(), None])
+                bucket[0] += 1
+                bucket[1].add(seed)
+                candidate = (float("inf") if length is None else length, seed, case, op_index)
+                if bucket[2] is None or candidate < bucket[2]:
+                    bucket[2] = candidate
+                members.append((seed, case, op_index, signature))
+
+        self.connection.execute("DELETE FROM buckets")
+        self.connection.execute("DELETE FROM failure_buckets")
+        ids = {}
+        for number, (signature, (count, bucket_seeds, (length, seed, case, op_index))) in enumerate(
+                sorted(buckets.items(), key=lambda item: -item[1][0])):
+            ids[signature] = number
+            self.connection.execute("INSERT INTO buckets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL)",
+                                    (number,) + signature + (count, len(bucket_seeds), seed, case, op_index,
+                                                             None if length == float("inf") else length))
+        self.connection.executemany("INSERT INTO failure_buckets VALUES (?, ?, ?, ?)",
+                                    [(seed, case, op_index, ids[signature])
+                                     for seed, case, op_index, signature in members])
+        self.connection.commit()
+        return len(buckets)
+
+    def buckets(self):
+        return self.connection.execute(
+            "SELECT bucket, message, function, fail, state, failures, seeds, seed, case_index, op_index, length, "
+            "file, verified FROM buckets ORDER BY bucket").fetchall()
+
+    def write_representatives(self, out_dir, ops=None):
+        """
+        Write the shortest reproduction of every bucket as a test of its own (see fuzzer.write_sequence_file)
+        """
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        for bucket, seed, case, length in self.connection.execute(
+                "SELECT bucket, seed, case_index, length FROM buckets").fetchall():
+            if length is None:
+                continue
+            trace = fuzzer.record_sequence(seed, ops, case or 0)
+            out_file = os.path.join(out_dir, "fuzz_test." + str(seed) + ".bucket" + str(bucket) + ".js")
+            fuzzer.write_sequence_file(out_file, trace[:length], seed)
+            self.connection.execute("UPDATE buckets SET file = ? WHERE bucket = ?", (out_file, bucket))
+        self.connection.commit()
+
+    def verify(self, command, timeout=None):
+        """
+        Run command once on the representative of every bucket ({file} is replaced by its path), and record
+        whether it still fails
+        """
+        for bucket, out_file in self.connection.execute(
+                "SELECT bucket, file FROM buckets WHERE file IS NOT NULL").fetchall():
+            try:
+                returncode = subprocess.run([i.replace("{file}", out_file) for i in shlex.split(command)],
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                            timeout=timeout).returncode
+                verified = "fail" if returncode else "pass"
+            except subprocess.TimeoutExpired:
+                verified = "timeout"
+            self.connection.execute("UPDATE buckets SET verified = ? WHERE bucket = ?", (verified, bucket))
+        self.connection.commit()
+
+
+def report(triage, out=sys.stdout):
+    for bucket, message, function_name, fail, state, failures, seeds, seed, case, op_index, length, out_file, \
+            verified in triage.buckets():
+        out.write("bucket %d: %d failures, %d seeds  %s(%s) in %s: %s\n" % (bucket, failures, seeds, function_name,
+                                                                           fail, state, message))
+        out.write("  representative: seed %d case %s op %s, %s ops%s%s\n" %
+                  (seed, case, op_index, "?" if length is None else length,
+                   "" if out_file is None else ", " + out_file, "" if verified is None else ", " + verified))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group the failures of a results index (see results.py) into "
+                                                 "buckets and pick the shortest reproduction of every bucket")
+    parser.add_argument("index")
+    parser.add_argument("--config", default=None, help="config file of the campaign (see fuzzer.load_config)")
+    parser.add_argument("--ops", type=int, default=None, help="number of ops of the random tests of the campaign")
+    parser.add_argument("--cases", type=int, default=None, help="number of test cases per file of the campaign")
+    parser.add_argument("--jobs", type=int, default=None, help="size of the worker pool that regenerates the tests")
+    parser.add_argument("--out-dir", default=None, help="write the representative of every bucket to this directory")
+    parser.add_argument("--verify-command", default=None,
+                        help="run the representatives with this command ({file} is replaced by the path of the "
+                             "test) and record whether they still fail; needs --out-dir")
+    parser.add_argument("--timeout", type=float, default=None, help="timeout of a single verification in seconds")
+    args = parser.parse_args()
+    if args.verify_command and not args.out_dir:
+        parser.error("--verify-command needs --out-dir")
+
+    options = {}
+    if args.config:
+        config = fuzzer.load_config(args.config)
+        fuzzer.configure({key: value for key, value in config.items() if key in fuzzer.CONFIG_CONSTANTS})
+        options = {key: value for key, value in config.items() if key not in fuzzer.CONFIG_CONSTANTS}
+    ops = args.ops if args.ops is not None else options.get("ops")
+    cases = args.cases if args.cases is not None else options.get("cases", 1)
+
+    with ResultIndex(args.index) as index:
+        triage = Triage(index)
+        buckets = triage.bucket(ops, cases, args.jobs)
+        sys.stderr.write("%d buckets\n" % buckets)
+        if args.out_dir:
+            triage.write_representatives(args.out_dir, ops)
+        if args.verify_command:
+            triage.verify(args.verify_command, args.timeout)
+        report(triage)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 #!/bin/bash
 
 NUM_TESTS=10
+# size of the worker pool; leave empty to use one worker per core
+JOBS=
+# slice i/N of the tests to generate on this machine (see --shard); leave empty to generate them all
+SHARD=
 
-for i in `seq 1 ${NUM_TESTS}`
-do
-    python3 crowdsale_fuzzer/fuzzer.py
-done
+python3 crowdsale_fuzzer/fuzzer.py --count ${NUM_TESTS} ${JOBS:+--jobs ${JOBS}} ${SHARD:+--shard ${SHARD}}